@@ -0,0 +1,243 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from websocket_server import handshake_response, run_session_async
+from http_request import parse_request_head, FIRST_BYTE_TIMEOUT, HEADER_TIMEOUT, MAX_HEADER_BYTES
+from response_writer import WRITE_CHUNK_BYTES, route_name
+from main_server import (
+    route_request, ready_to_send, connection_state, update_notifier, EditSession, change_log_compactor,
+    blob_store, version_log_db, route_metrics, crypto_pool,
+    KEEP_ALIVE_TIMEOUT, MAX_REQUESTS_PER_CONNECTION
+)
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_WORKERS = 32
+
+
+class FileRange:
+    """Part of the output of a StreamSocket that is sent from a file"""
+
+    def __init__(self, file, offset, count):
+        self.file = file
+        self.offset = offset
+        self.count = count
+
+
+class StreamSocket:
+    """Socket-like object handed to the synchronous handlers.
+
+    The body is read by the event loop before the handler runs, and everything the
+    handler sends is collected here and written back by the event loop afterwards,
+    so the handler thread never blocks on the network.
+    """
+
+    def __init__(self, body=b""):
+        self.body = body
+        self.body_remaining = len(body)
+        self.output = []
+        self.bytes_sent = 0
+        self.closed = False
+        self.parked_poll = None   # (fileID, ModID, seconds) when a long-poll handed its wait back
+        self.poll_timeout = None  # remaining long-poll budget when the handler is re-run
+
+    def recv(self, bufsize, flags=0):
+        start = len(self.body) - self.body_remaining
+        data = self.body[start:start + bufsize]
+        self.body_remaining -= len(data)
+        return data
+
+    def read_exact(self, length):
+        return self.recv(length)
+
+    def discard_body(self):
+        self.body_remaining = 0
+
+    def send(self, data, flags=0):
+        self.output.append(data if isinstance(data, bytes) else bytes(data))
+        self.bytes_sent += len(data)
+        return len(data)
+
+    def sendall(self, data, flags=0):
+        self.send(data)
+
+    def sendmsg(self, buffers, flags=0):
+        for data in buffers:
+            self.send(data)
+        return sum(len(data) for data in buffers)
+
+    def sendfile(self, file, offset=0, count=None):
+        """Queue a file range; the event loop streams it with loop.sendfile after the handler returns.
+
+        The handler closes its file when it is done, so the queued copy gets its own descriptor.
+        """
+        if count is None:
+            count = os.fstat(file.fileno()).st_size - offset
+        self.output.append(FileRange(os.fdopen(os.dup(file.fileno()), 'rb'), offset, count))
+        self.bytes_sent += count
+        return count
+
+    def park_poll(self, file_id, after_mod_id, timeout):
+        self.parked_poll = (file_id, after_mod_id, timeout)
+
+    def settimeout(self, timeout):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def run_handler(stream_socket, action, request, headers_data, keep_alive):
+    """Runs on an executor thread: the handlers do blocking SQLite and crypto work"""
+    connection_state.keep_alive = keep_alive
+    try:
+        route_request(stream_socket, action, request, headers_data)
+    except Exception as e:
+        logger.error(f"Request failed: {str(e)}")
+        connection_state.keep_alive = False
+        stream_socket.send(ready_to_send("500 Internal Server Error", str(e), "text/plain"))
+        stream_socket.closed = True
+    finally:
+        connection_state.keep_alive = False
+
+
+async def write_output(loop, writer, output):
+    """Write what a handler sent: buffers as they are, file ranges with sendfile.
+
+    Big buffers go out a chunk at a time, waiting for the transport to drain in
+    between, so a slow client never makes the transport copy a whole body.
+    """
+    try:
+        for item in output:
+            if isinstance(item, FileRange):
+                await writer.drain()
+                await loop.sendfile(writer.transport, item.file, item.offset, item.count)
+                item.file.close()
+            elif len(item) <= WRITE_CHUNK_BYTES:
+                writer.write(item)
+            else:
+                view = memoryview(item)
+                for start in range(0, len(view), WRITE_CHUNK_BYTES):
+                    writer.write(view[start:start + WRITE_CHUNK_BYTES])
+                    await writer.drain()
+        await writer.drain()
+    finally:
+        for item in output:
+            if isinstance(item, FileRange) and not item.file.closed:
+                item.file.close()
+
+
+async def read_request(reader, first_byte_timeout):
+    """Read one request head. Returns None if the client closed or stayed idle."""
+    try:
+        first = await asyncio.wait_for(reader.read(1), first_byte_timeout)
+    except asyncio.TimeoutError:
+        return None
+    if not first:
+        return None
+    try:
+        rest = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEADER_TIMEOUT)
+    except asyncio.LimitOverrunError:
+        raise ValueError("Request headers too large")
+    except asyncio.IncompleteReadError:
+        raise ConnectionResetError("Client disconnected while sending headers")
+    return parse_request_head(first + rest[:-4])
+
+
+async def handle_connection(reader, writer, executor, keep_alive_timeout, max_requests):
+    loop = asyncio.get_running_loop()
+    client_ip = writer.get_extra_info('peername')[0]
+    requests_served = 0
+
+    try:
+        while True:
+            timeout = FIRST_BYTE_TIMEOUT if requests_served == 0 else keep_alive_timeout
+            http_request = await read_request(reader, timeout)
+            if http_request is None:
+                break
+            if http_request.method not in ["GET", "POST", "DELETE"]:
+                logger.warning(f"Invalid HTTP method from {client_ip}")
+                break
+
+            requests_served += 1
+            keep_alive = http_request.keep_alive and requests_served < max_requests
+            request = http_request.target
+            if "/poll-updates" not in request:
+                logger.info(f"{client_ip} → {http_request.method} {request.split('?', 1)[0]}")
+
+            if request.startswith("/ws-edit"):
+                response = handshake_response(http_request)
+                if response is None:
+                    writer.write(ready_to_send("400 Bad Request", "Invalid WebSocket upgrade", "text/plain"))
+                    await writer.drain()
+                    break
+                writer.write(response)
+                await writer.drain()
+                await run_session_async(reader, writer, EditSession(), update_notifier, executor)
+                break
+
+            body = b""
+            if http_request.content_length:
+                body = await asyncio.wait_for(reader.readexactly(http_request.content_length), HEADER_TIMEOUT)
+
+            stream_socket = StreamSocket(body)
+            while True:
+                await loop.run_in_executor(
+                    executor, run_handler, stream_socket, http_request.method,
+                    request, http_request.raw_headers, keep_alive
+                )
+                if stream_socket.parked_poll is None:
+                    break
+                # Long-poll with nothing new: wait here without a thread, then re-run the handler
+                file_id, after_mod_id, timeout = stream_socket.parked_poll
+                started = loop.time()
+                await update_notifier.wait_async(file_id, after_mod_id, timeout)
+                stream_socket.parked_poll = None
+                stream_socket.poll_timeout = max(0, timeout - (loop.time() - started))
+
+            if stream_socket.output:
+                started = time.perf_counter()
+                await write_output(loop, writer, stream_socket.output)
+                route_metrics.record(route_name(request), stream_socket.bytes_sent, time.perf_counter() - started)
+
+            # Handlers that bail out without answering rely on the close to end the request
+            if not keep_alive or stream_socket.closed or not stream_socket.output:
+                break
+
+    except (ConnectionResetError, asyncio.IncompleteReadError):
+        logger.warning(f"Connection lost: {client_ip}")
+    except asyncio.TimeoutError:
+        logger.warning(f"Request timeout: {client_ip}")
+    except Exception as e:
+        logger.error(f"Request failed from {client_ip}: {str(e)}")
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+
+async def serve(host, port, executor_workers, keep_alive_timeout, max_requests):
+    executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix="handler")
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(reader, writer, executor, keep_alive_timeout, max_requests),
+        host, port, limit=MAX_HEADER_BYTES, backlog=1024
+    )
+    logger.info(f"Async main server is up and running on {host}:{port}")
+    logger.info(f"Link: http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def start_async_server(host='127.0.0.1', port=8000, executor_workers=EXECUTOR_WORKERS,
+                       keep_alive_timeout=KEEP_ALIVE_TIMEOUT, max_requests=MAX_REQUESTS_PER_CONNECTION):
+    """Start the main server on asyncio streams, running the handlers on an executor"""
+    logger.info("Starting async main server...")
+    crypto_pool.start()
+    change_log_compactor.start()
+    blob_store.start_gc(version_log_db.get_blob_hashes)
+    asyncio.run(serve(host, port, executor_workers, keep_alive_timeout, max_requests))
@@ -0,0 +1,83 @@
+"""AES encrypt/decrypt cost per call and per KB: a new cipher per call vs cached key contexts.
+
+"per call" is what RSAManager did before: base64-decode the key and build a new
+AES cipher for every message. "cached" is RSAManager now (CBC, the browser's
+format, and GCM); "batch" decrypts the messages of one request together, the
+way /save-batch and /poll-updates headers are handled.
+
+Run from the repo root:  python benchmarks/bench_aes.py [--seconds 0.5]
+"""
+import os
+import sys
+import time
+import base64
+import argparse
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from Crypto.Cipher import AES  # noqa: E402
+from Crypto.Util.Padding import pad, unpad  # noqa: E402
+from class_users import RSAManager  # noqa: E402
+
+SIZES = [16, 256, 1024, 16 * 1024, 256 * 1024]
+BATCH = 8
+
+
+def encrypt_per_call(message, aes_key):
+    key_bytes = base64.b64decode(aes_key)
+    iv = os.urandom(AES.block_size)
+    return base64.b64encode(iv + AES.new(key_bytes, AES.MODE_CBC, iv).encrypt(pad(message, AES.block_size))).decode()
+
+
+def decrypt_per_call(encrypted, aes_key):
+    encrypted_bytes = base64.b64decode(encrypted)
+    key_bytes = base64.b64decode(aes_key)
+    cipher = AES.new(key_bytes, AES.MODE_CBC, encrypted_bytes[:AES.block_size])
+    return unpad(cipher.decrypt(encrypted_bytes[AES.block_size:]), AES.block_size).decode()
+
+
+def rate(function, seconds):
+    """Calls per second of function, run for about seconds"""
+    calls, started = 0, time.perf_counter()
+    while True:
+        for _ in range(50):
+            function()
+        calls += 50
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return calls / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=0.5, help="time per measurement")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    rsa_manager = RSAManager()
+    key = rsa_manager.generateAESKey()
+    print(f"{'size':>8}  {'operation':34} {'us/call':>9} {'MB/s':>8}")
+    for size in SIZES:
+        text = "x" * size
+        message = text.encode()
+        cbc = rsa_manager.encryptAES(text, key)
+        gcm = rsa_manager.encryptAES(text, key, "gcm")
+        batch = [cbc] * BATCH
+        rows = [
+            ("encrypt, new cipher per call", lambda: encrypt_per_call(message, key), 1),
+            ("encrypt, cached CBC", lambda: rsa_manager.encryptAES(text, key), 1),
+            ("encrypt, cached GCM", lambda: rsa_manager.encryptAES(text, key, "gcm"), 1),
+            ("decrypt, new cipher per call", lambda: decrypt_per_call(cbc, key), 1),
+            ("decrypt, cached CBC", lambda: rsa_manager.decryptAES(cbc, key), 1),
+            ("decrypt, cached GCM", lambda: rsa_manager.decryptAES(gcm, key), 1),
+            (f"decrypt, cached CBC batch of {BATCH}", lambda: rsa_manager.decryptAES_batch(batch, key), BATCH),
+        ]
+        for name, function, messages in rows:
+            per_second = rate(function, args.seconds) * messages
+            print(f"{size:>8}  {name:34} {1e6 / per_second:>9.2f} {per_second * size / 1e6:>8.1f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Disk usage and latency of the content-addressed blob store.
+
+1. Many users upload the same template and each edits a few lines of their copy:
+   plain files under uploads/ against BlobStorage.
+2. Saving a version identical to the previous one against saving one with a
+   single edited line, with VersionDatabase backed by the blob store.
+3. Loading a file that is not open in the editor: reading the plain file against
+   BlobStorage, where identical content is served from the shared cache.
+
+Run from the repo root:  python benchmarks/bench_blob_store.py [--users 200]
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from blob_store import BlobStore, BlobStorage  # noqa: E402
+from class_users import VersionDatabase  # noqa: E402
+from document_store import DocumentStore, DiskStorage  # noqa: E402
+
+
+def folder_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def template(lines):
+    rng = random.Random(3)
+    return "".join(f"def handler_{i}(request):  # {rng.random():.8f}\n    return process(request, {i})\n"
+                   for i in range(lines // 2))
+
+
+def edited_copies(storage, uploads, text, users):
+    store = DocumentStore(storage=storage)
+    rng = random.Random(1)
+    for user in range(users):
+        path = os.path.join(uploads, f"user{user}_main.py")
+        store.create(path, text)
+        for _ in range(5):
+            row = rng.randrange(len(text) // 60)
+            store.edit(path, lambda lines: lines.__setitem__(row, f"    # note from user {user}\n"))
+        store.flush(store.resident(path))
+    return store
+
+
+def median_ms(samples):
+    return sorted(samples)[len(samples) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=4000)
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+    text = template(args.lines)
+    print(f"template: {args.lines} lines, {len(text) / 1e3:.0f} KB")
+
+    # 1. uploads
+    directory = tempfile.mkdtemp()
+    plain_uploads = os.path.join(directory, "plain")
+    os.makedirs(plain_uploads)
+    edited_copies(DiskStorage(), plain_uploads, text, args.users)
+    db_path = os.path.join(directory, "blobs.db")
+    blob_store = BlobStore(db_path, os.path.join(directory, "blobs"))
+    blob_uploads = os.path.join(directory, "uploads")
+    os.makedirs(blob_uploads)
+    blob_documents = edited_copies(BlobStorage(blob_store), blob_uploads, text, args.users)
+    conn = sqlite3.connect(db_path)
+    table_bytes = conn.execute("SELECT SUM(LENGTH(chunks) + LENGTH(hash)) FROM blobs").fetchone()[0]
+    conn.close()
+    plain = folder_size(plain_uploads)
+    blobs = folder_size(blob_store.root) + table_bytes
+    print(f"1. {args.users} edited copies: plain files {plain / 1e6:.2f} MB, "
+          f"blob store {blobs / 1e6:.2f} MB ({1 - blobs / plain:.1%} less)")
+
+    # 2. version saves, unchanged against one edited line
+    results = {}
+    for name, changed in [("unchanged", False), ("one line edited", True)]:
+        versions_path = os.path.join(directory, f"versions_{changed}.db")
+        versions = VersionDatabase(versions_path, blob_store)
+        versions.add_version(1, text)
+        samples = []
+        for i in range(args.repeats):
+            content = text.replace("return process(request, 7)", f"return process(request, {i})") if changed else text
+            started = time.perf_counter()
+            versions.add_version(1, content)
+            samples.append(time.perf_counter() - started)
+        conn = sqlite3.connect(versions_path)
+        stored = conn.execute("SELECT IFNULL(SUM(LENGTH(data)), 0) FROM versionsLog WHERE version > 1").fetchone()[0]
+        conn.close()
+        print(f"2. {args.repeats} version saves, {name}: p50 {median_ms(samples):.2f} ms, "
+              f"{stored / args.repeats:.0f} bytes stored per version")
+
+    # 3. loads of a file that is not resident
+    plain_store = DocumentStore()
+    path = os.path.join(plain_uploads, "user0_main.py")
+    samples = []
+    for _ in range(args.repeats):
+        started = time.perf_counter()
+        plain_store.read_text(path)
+        samples.append(time.perf_counter() - started)
+    plain_ms = median_ms(samples)
+    blob_documents.documents.clear()
+    path = os.path.join(blob_uploads, "user0_main.py")
+    samples = []
+    for _ in range(args.repeats):
+        started = time.perf_counter()
+        blob_documents.read_text(path)
+        samples.append(time.perf_counter() - started)
+    print(f"3. load p50: plain file {plain_ms:.3f} ms, blob store {median_ms(samples):.3f} ms "
+          f"(cache hits {blob_store.stats()['cache_hits']})")
+
+
+if __name__ == "__main__":
+    main()
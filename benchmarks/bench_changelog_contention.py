@@ -0,0 +1,122 @@
+"""Poll latency and write throughput of ChangeLogDatabase with many files and pollers.
+
+Compares the current per-file write locks and lock-free reads against the old
+design, where one process-wide lock wrapped every read and write. One extra
+writer keeps appending large (paste-sized) modifications to a hot file.
+
+Run from the repo root:  python benchmarks/bench_changelog_contention.py [--pollers 100]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from class_users import ChangeLogDatabase  # noqa: E402
+
+BIG_PASTE = "x" * 512 * 1024
+
+
+class GlobalLockChangeLog(ChangeLogDatabase):
+    """The previous behaviour: every call queues behind one lock"""
+
+    def __init__(self, db_path):
+        self.global_lock = threading.Lock()
+        super().__init__(db_path)
+
+    def get_last_mod_id(self, fileID):
+        with self.global_lock:
+            return super().get_last_mod_id(fileID)
+
+    def get_changes_for_user(self, fileID, lastModID, userID):
+        with self.global_lock:
+            return super().get_changes_for_user(fileID, lastModID, userID)
+
+    def add_modification(self, fileID, modification, modBy):
+        with self.global_lock:
+            return super().add_modification(fileID, modification, modBy)
+
+
+def run(database_class, args):
+    directory = tempfile.mkdtemp()
+    db = database_class(os.path.join(directory, "bench.db"))
+    for file_id in range(args.files):
+        db.add_modification(file_id, {"content": "seed", "row": 0, "action": "update", "linesLength": 1}, 1)
+
+    stop = threading.Event()
+    latencies = []
+    writes = [0]
+    lock = threading.Lock()
+
+    def poller(index):
+        file_id = index % args.files
+        last_mod_id = 0
+        local = []
+        while not stop.is_set():
+            started = time.perf_counter()
+            db.get_last_mod_id(file_id)
+            changes = db.get_changes_for_user(file_id, last_mod_id, index)
+            local.append(time.perf_counter() - started)
+            if changes:
+                last_mod_id = changes[-1]['ModID']
+            time.sleep(args.poll_interval)
+        with lock:
+            latencies.extend(local)
+
+    def writer(seed):
+        rng = random.Random(seed)
+        count = 0
+        while not stop.is_set():
+            db.add_modification(rng.randrange(args.files),
+                                {"content": "edit", "row": 0, "action": "update", "linesLength": 1}, 2)
+            count += 1
+        with lock:
+            writes[0] += count
+
+    def hot_writer():
+        while not stop.is_set():
+            db.add_modification(0, {"content": BIG_PASTE, "row": 0, "action": "paste", "linesLength": 1}, 3)
+
+    threads = [threading.Thread(target=poller, args=(i,)) for i in range(args.pollers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    threads.append(threading.Thread(target=hot_writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        "polls/s": len(latencies) / args.seconds,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p99": latencies[int(len(latencies) * 0.99)] * 1000,
+        "max": latencies[-1] * 1000,
+        "writes/s": writes[0] / args.seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--pollers", type=int, default=100)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--poll-interval", type=float, default=0.01)
+    args = parser.parse_args()
+
+    print(f"{args.files} files, {args.pollers} pollers, {args.writers} writers + 1 hot writer, {args.seconds:.0f} s")
+    print(f"{'':>12} {'polls/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'writes/s':>9}")
+    for name, database_class in [("global lock", GlobalLockChangeLog), ("per file", ChangeLogDatabase)]:
+        result = run(database_class, args)
+        print(f"{name:>12} {result['polls/s']:>9.0f} {result['p50']:>8.2f} {result['p99']:>8.2f} "
+              f"{result['max']:>8.1f} {result['writes/s']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Bytes on the wire and time-to-first-edit of a cold editor load, per content encoding.
+
+A cold load fetches the editor page, its stylesheet and scripts with an empty
+browser cache, does the key exchange, loads the file and saves a first edit.
+The client reads through a simulated link (bandwidth and round-trip time) so
+the numbers reflect a slow VPN rather than localhost; requests are sequential.
+
+    python benchmarks/bench_compression.py --port 8000 --file-id 3 --user-id 1234 --mbps 10 --rtt-ms 30
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import socket
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from load_test_websocket import crypto  # noqa: E402
+from content_encoding import ENCODINGS, brotli  # noqa: E402
+
+EDITOR_ASSETS = ["/editor_page.html", "/editor_page.css", "/editor_page.js",
+                 "/jsencrypt.min.js", "/monaco-loader.min.js"]
+
+
+class Link:
+    """Client side of a connection with limited bandwidth and a fixed round-trip time"""
+
+    def __init__(self, args, accept_encoding):
+        self.args = args
+        self.accept_encoding = accept_encoding
+        self.bytes = 0
+
+    def request(self, method, path, headers=None, body=b""):
+        time.sleep(self.args.rtt_ms / 1000 * 2)  # TCP handshake, then the request itself
+        sock = socket.create_connection((self.args.host, self.args.port))
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.args.host}", "Connection: close",
+                 f"Content-Length: {len(body)}"]
+        if self.accept_encoding:
+            lines.append(f"Accept-Encoding: {self.accept_encoding}")
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        data = b""
+        started = time.perf_counter()
+        while True:
+            chunk = sock.recv(16384)
+            if not chunk:
+                break
+            data += chunk
+            # Hold the bytes back until the link would have delivered them
+            due = started + len(data) * 8 / (self.args.mbps * 1_000_000)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        sock.close()
+        self.bytes += len(data)
+        head, _, payload = data.partition(b"\r\n\r\n")
+        headers = dict(line.split(": ", 1) for line in head.decode().split("\r\n")[1:])
+        return headers, decode(payload, headers.get("Content-Encoding"))
+
+
+def decode(payload, encoding):
+    if encoding == "gzip":
+        return gzip.decompress(payload)
+    if encoding == "br":
+        return brotli.decompress(payload)
+    return payload
+
+
+def cold_load(args, accept_encoding):
+    link = Link(args, accept_encoding)
+    start = time.perf_counter()
+    for path in EDITOR_ASSETS:
+        link.request("GET", path)
+    assets_done = time.perf_counter()
+
+    body = json.dumps({"public_key_client": crypto.get_public_key()}).encode()
+    _, reply = link.request("POST", "/get-global-aes", body=body)
+    global_key = crypto.decryptRSA(json.loads(reply)["AESKey"])
+    headers = {"fileId": crypto.encryptAES(str(args.file_id), global_key), "encrypted": "true"}
+    _, reply = link.request("GET", "/load", headers)
+    loaded = json.loads(crypto.decryptAES(json.loads(reply)["encrypted_data"], global_key))
+    loaded_at = time.perf_counter()
+
+    modification = json.dumps({"content": "first edit", "row": 0, "action": "update", "linesLength": 1})
+    body = json.dumps({"modifications": [crypto.encryptAES(modification, loaded["fileAESKey"])]}).encode()
+    headers = {"fileID": crypto.encryptAES(str(args.file_id), global_key),
+               "userID": crypto.encryptAES(str(args.user_id), global_key),
+               "encrypted": "true", "Content-Type": "application/json"}
+    link.request("POST", "/save-batch", headers, body)
+    done = time.perf_counter()
+    return link.bytes, assets_done - start, loaded_at - start, done - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--file-id", type=int, required=True)
+    parser.add_argument("--user-id", type=int, required=True, help="a user with write access to the file")
+    parser.add_argument("--mbps", type=float, default=10.0, help="simulated link bandwidth")
+    parser.add_argument("--rtt-ms", type=float, default=30.0, help="simulated round-trip time")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"link: {args.mbps:g} Mbit/s, {args.rtt_ms:g} ms RTT; median of {args.runs} cold loads")
+    print(f"{'Accept-Encoding':18} {'bytes':>10} {'assets':>9} {'loaded':>9} {'first edit':>11}")
+    for accept_encoding in [None] + list(ENCODINGS):
+        runs = sorted((cold_load(args, accept_encoding) for _ in range(args.runs)), key=lambda run: run[3])
+        size, assets, loaded, first_edit = runs[len(runs) // 2]
+        print(f"{accept_encoding or 'identity':18} {size:>10} {assets * 1000:>7.0f}ms "
+              f"{loaded * 1000:>7.0f}ms {first_edit * 1000:>9.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Editing latency during a login storm: Argon2 and RSA inline vs in the crypto worker processes.
+
+"editing" threads stand in for polls and saves: each request decrypts three
+AES headers, reads the changes after a ModID and encrypts them, as
+/poll-updates does. Meanwhile "login" threads call UserDatabase.login back to
+back, with the credentials RSA-encrypted as the browser sends them. "inline"
+runs Argon2 and RSA on the login threads, as before; "pool" goes through
+CryptoPool. Everything runs in-process, without sockets.
+
+Run from the repo root:  python benchmarks/bench_crypto_pool.py [--logins 16 --seconds 5]
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import tempfile
+import threading
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from Crypto.PublicKey import RSA  # noqa: E402
+from Crypto.Cipher import PKCS1_v1_5  # noqa: E402
+from class_users import UserDatabase, ChangeLogDatabase, RSAManager  # noqa: E402
+from crypto_pool import CryptoPool, CryptoPoolBusy  # noqa: E402
+
+FILE_ID = 1
+PASSWORD = "correct horse"
+
+
+def editing(rsa_manager, key, changes, headers, stop, latencies):
+    while not stop.is_set():
+        started = time.perf_counter()
+        file_id, user_id, last_mod_id = (int(value) for value in rsa_manager.decryptAES_batch(headers, key))
+        updates = changes.get_changes_for_user(file_id, last_mod_id, user_id)
+        rsa_manager.encryptAES(json.dumps(updates), key)
+        latencies.append(time.perf_counter() - started)
+
+
+def logging_in(users, crypto, server_cipher, username, client_pem, stop, counts):
+    credentials = [base64.b64encode(server_cipher.encrypt(value.encode())).decode() for value in (username, PASSWORD)]
+    while not stop.is_set():
+        try:
+            decrypted_username, decrypted_password = crypto.decrypt_rsa(credentials)
+            status = users.login(decrypted_username, decrypted_password, client_pem)['status']
+        except CryptoPoolBusy:
+            status = 503
+        counts[status] = counts.get(status, 0) + 1
+
+
+def run(folder, rsa_manager, crypto, logins, editors, seconds):
+    users = UserDatabase(os.path.join(folder, "bench.db"), crypto_pool=crypto)
+    changes = ChangeLogDatabase(os.path.join(folder, "bench.db"))
+    key = rsa_manager.generateAESKey()
+    changes.add_modifications(FILE_ID, [{"content": "x" * 40, "row": 3, "action": "update", "linesLength": 100}] * 5, 2)
+    headers = [rsa_manager.encryptAES(str(value), key) for value in (FILE_ID, 1, 0)]
+    client_pem = RSA.generate(1024).publickey().export_key().decode()
+    server_cipher = PKCS1_v1_5.new(rsa_manager.public_key)
+    username = f"bench{time.time_ns()}"
+    users.signup(username, PASSWORD, client_pem)
+
+    stop, latencies, counts = threading.Event(), [], {}
+    threads = [threading.Thread(target=editing, args=(rsa_manager, key, changes, headers, stop, latencies))
+               for _ in range(editors)]
+    threads += [threading.Thread(target=logging_in, args=(users, crypto, server_cipher, username, client_pem, stop, counts))
+                for _ in range(logins)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return latencies, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=16, help="threads logging in concurrently")
+    parser.add_argument("--editors", type=int, default=4, help="threads polling and saving")
+    parser.add_argument("--workers", type=int, default=2, help="crypto worker processes")
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    rsa_manager = RSAManager()
+    print(f"{args.logins} login threads, {args.editors} editing threads, {args.seconds}s, {os.cpu_count()} CPUs")
+    print(f"{'':8} {'edits/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}  logins by status")
+    with tempfile.TemporaryDirectory() as folder:
+        for name, workers in (("idle", None), ("inline", 0), ("pool", args.workers)):
+            crypto = CryptoPool(rsa_manager.private_key, workers=workers or 0)
+            crypto.start()
+            latencies, counts = run(folder, rsa_manager, crypto, args.logins if workers is not None else 0,
+                                    args.editors, args.seconds)
+            if crypto.executor is not None:
+                crypto.executor.shutdown()
+            print(f"{name:8} {len(latencies) / args.seconds:>9.0f} {latencies[len(latencies) // 2] * 1000:>8.3f}"
+                  f" {latencies[int(len(latencies) * 0.99)] * 1000:>8.3f} {latencies[-1] * 1000:>8.1f}  {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Mixed edit workload on a plain list of lines vs LineRope, for files of 1k to 1M lines.
+
+Every edit goes through apply_action-style steps (the change plus normalize on the
+touched window), spread uniformly over the file:
+row updates, single-line inserts and deletes, 20-line range deletes and 50-line pastes.
+
+Run from the repo root:  python benchmarks/bench_line_store.py [--edits 2000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from document_store import normalize  # noqa: E402
+from line_store import LineRope  # noqa: E402
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+PASTE = "".join(f"pasted line {i}\n" for i in range(50))
+
+
+def workload(lines_count, edits, seed=7):
+    rng = random.Random(seed)
+    steps = []
+    length = lines_count
+    for i in range(edits):
+        kind = rng.choice(["update", "update", "insert", "delete", "range", "paste"])
+        row = rng.randrange(max(1, length - 60))
+        steps.append((kind, row, i))
+        length += {"insert": 1, "delete": -1, "range": -20, "paste": 50}.get(kind, 0)
+    return steps
+
+
+def run(lines, steps):
+    for kind, row, i in steps:
+        if kind == "update":
+            lines[row] = f"edited {i}\r"
+            normalize(lines, row, row + 1)
+        elif kind == "insert":
+            lines.insert(row, f"inserted {i}\r")
+            normalize(lines, row, row + 1)
+        elif kind == "delete":
+            del lines[row]
+            normalize(lines, row, row)
+        elif kind == "range":
+            del lines[row:row + 20]
+            normalize(lines, row, row)
+        else:
+            lines.insert(row, PASTE + "\r")
+            normalize(lines, row, row + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--edits", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'lines':>10} {'list':>12} {'rope':>12} {'speedup':>8} {'rope write':>11}")
+    for size in SIZES:
+        original = [f"line {i} of the document\n" for i in range(size)]
+        steps = workload(size, args.edits)
+
+        as_list = list(original)
+        start = time.perf_counter()
+        run(as_list, steps)
+        list_time = time.perf_counter() - start
+
+        rope = LineRope(original)
+        start = time.perf_counter()
+        run(rope, steps)
+        rope_time = time.perf_counter() - start
+
+        assert list(rope) == as_list
+        start = time.perf_counter()
+        written = sum(len(text) for text in rope.snapshot().iter_text())
+        write_time = time.perf_counter() - start
+        assert written == sum(len(line) for line in as_list)
+
+        per_edit = 1e6 / args.edits
+        print(f"{size:>10} {list_time * per_edit:>9.1f} us {rope_time * per_edit:>9.1f} us "
+              f"{list_time / rope_time:>7.1f}x {write_time * 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
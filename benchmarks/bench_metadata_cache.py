@@ -0,0 +1,91 @@
+"""SQLite queries and time per request spent on file metadata lookups, with and without the cache.
+
+Each request type repeats the lookups its handler in main_server makes (file key,
+filename, owner, role) for a random open file and one of its users; the statements
+are counted with SQLite's trace callback. "no cache" runs the same classes with a
+zero TTL, so every lookup goes to the database as it did before the cache.
+
+Run from the repo root:  python benchmarks/bench_metadata_cache.py [--files 200 --requests 20000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from class_users import FileInfoDatabase, FilePermissionsDatabase  # noqa: E402
+from db_pool import get_pool  # noqa: E402
+from metadata_cache import TTL_SECONDS  # noqa: E402
+
+# Lookups per request, as the handlers make them
+REQUESTS = {
+    "/poll-updates": lambda files, roles, f, u: files.get_aes_key(f),
+    "/save-batch": lambda files, roles, f, u: (files.get_aes_key(f), files.get_filename_by_id(f)),
+    "/load": lambda files, roles, f, u: (files.get_filename_by_id(f), files.get_aes_key(f)),
+    "/ws-edit open": lambda files, roles, f, u: (roles.has_access(f, u), files.get_aes_key(f),
+                                                 files.get_filename_by_id(f)),
+    "/check-viewer-status": lambda files, roles, f, u: (files.get_aes_key(str(f)), roles.is_editor_or_owner(f, u)),
+    "/save-version": lambda files, roles, f, u: (files.get_aes_key(str(f)), roles.is_viewer(f, u),
+                                                 roles.is_editor_or_owner(f, u)),
+}
+
+
+def populate(db_path, file_count, users_per_file):
+    files = FileInfoDatabase(db_path)
+    roles = FilePermissionsDatabase(db_path)
+    conn = get_pool(db_path).connection()
+    for user_id in range(1, users_per_file + 1):
+        conn.execute("INSERT INTO users (userID, username, password) VALUES (?, ?, '')", (user_id, f"user{user_id}"))
+    conn.commit()
+    conn.close()
+    opened = []
+    for index in range(file_count):
+        files.add_file(f"file{index}.py", 1)
+        file_id = files.check_file_exists(1, f"file{index}.py")
+        for user_id in range(1, users_per_file + 1):
+            roles.grant_access(file_id, user_id, "owner" if user_id == 1 else random.choice(["editor", "viewer"]))
+        opened.append(file_id)
+    return files, roles, opened
+
+
+def run(files, roles, opened, users_per_file, requests, lookup):
+    statements = [0]
+    conn = get_pool(files.db_path).connection()
+    conn.set_trace_callback(lambda statement: statements.__setitem__(0, statements[0] + 1))
+    rng = random.Random(5)
+    started = time.perf_counter()
+    for _ in range(requests):
+        lookup(files, roles, rng.choice(opened), rng.randint(1, users_per_file))
+    elapsed = time.perf_counter() - started
+    conn.set_trace_callback(None)
+    conn.close()
+    return statements[0] / requests, elapsed / requests * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=200, help="open files")
+    parser.add_argument("--users", type=int, default=5, help="users per file")
+    parser.add_argument("--requests", type=int, default=20000, help="requests per request type")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        files, roles, opened = populate(os.path.join(folder, "bench.db"), args.files, args.users)
+        print(f"{args.files} open files, {args.users} users each, {args.requests} requests per type")
+        print(f"{'request':22} {'queries/req':>22} {'us/req':>18}")
+        print(f"{'':22} {'no cache':>10} {'cache':>11} {'no cache':>9} {'cache':>8}")
+        for name, lookup in REQUESTS.items():
+            files.cache.ttl = roles.cache.ttl = 0
+            files.cache.clear()
+            roles.cache.clear()
+            plain_queries, plain_us = run(files, roles, opened, args.users, args.requests, lookup)
+            files.cache.ttl = roles.cache.ttl = TTL_SECONDS
+            cached_queries, cached_us = run(files, roles, opened, args.users, args.requests, lookup)
+            print(f"{name:22} {plain_queries:>10.2f} {cached_queries:>11.3f} {plain_us:>9.1f} {cached_us:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Poll query latency against change-log size, with and without the schema indexes.
+
+Each poll is what /poll-updates does per wake-up: get_last_mod_id plus
+get_changes_for_user for a client that is up to date, on a change log spread
+over 1000 files with a skewed edit distribution (a few busy files, many quiet
+ones). Without an index a poll on a quiet file scans the log back to its last
+edit and then forward to the end.
+
+Run from the repo root:  python benchmarks/bench_poll_latency.py [--max-rows 1000000]
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from class_users import ChangeLogDatabase  # noqa: E402
+from schema import migrate  # noqa: E402
+
+FILES = 1000
+POLLS = 200
+MODIFICATION = json.dumps({"content": "some edited line of code", "row": 10, "action": "update", "linesLength": 80})
+
+
+def build(path, rows):
+    migrate(path)
+    conn = sqlite3.connect(path)
+    rng = random.Random(rows)
+    batch = []
+    for _ in range(rows):
+        batch.append((int(FILES * rng.random() ** 3), MODIFICATION, rng.randrange(1000, 1010)))
+        if len(batch) == 100_000:
+            conn.executemany("INSERT INTO changeLog (fileID, modification, modBy) VALUES (?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO changeLog (fileID, modification, modBy) VALUES (?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+
+
+def drop_indexes(path):
+    conn = sqlite3.connect(path)
+    names = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'")]
+    for name in names:
+        conn.execute(f"DROP INDEX {name}")
+    conn.commit()
+    conn.close()
+
+
+def time_polls(path):
+    db = ChangeLogDatabase(path)
+    rng = random.Random(1)
+    latencies = []
+    for _ in range(POLLS):
+        file_id = rng.randrange(FILES)
+        started = time.perf_counter()
+        last = db.get_last_mod_id(file_id)
+        db.get_changes_for_user(file_id, last, 1000)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    sizes = [size for size in (10_000, 100_000, 1_000_000, 10_000_000) if size <= args.max_rows]
+    print(f"{'rows':>10} {'no index p50':>13} {'p99':>8} {'indexed p50':>12} {'p99':>8}")
+    for rows in sizes:
+        directory = tempfile.mkdtemp()
+        indexed = os.path.join(directory, "indexed.db")
+        plain = os.path.join(directory, "plain.db")
+        build(indexed, rows)
+        build(plain, rows)
+        drop_indexes(plain)
+        plain_p50, plain_p99 = time_polls(plain)
+        indexed_p50, indexed_p99 = time_polls(indexed)
+        print(f"{rows:>10} {plain_p50:>10.3f} ms {plain_p99:>8.3f} {indexed_p50:>9.3f} ms {indexed_p99:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
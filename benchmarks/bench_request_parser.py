@@ -0,0 +1,91 @@
+"""Compare the old byte-at-a-time header reader with BufferedSocket.read_request.
+
+Run from the repo root:  python benchmarks/bench_request_parser.py
+"""
+import os
+import sys
+import base64
+import socket
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from http_request import BufferedSocket  # noqa: E402
+
+REQUESTS = 2000
+
+
+def fake_cipher():
+    """Same size as an AES-CBC ciphertext of a short id: 16 byte IV + 16 byte block"""
+    return base64.b64encode(os.urandom(32)).decode()
+
+
+POLL_REQUEST = (
+    "GET /poll-updates HTTP/1.1\r\n"
+    "Host: 192.168.1.110:8000\r\n"
+    "Connection: keep-alive\r\n"
+    f"fileID: {fake_cipher()}\r\n"
+    f"userID: {fake_cipher()}\r\n"
+    f"lastModID: {fake_cipher()}\r\n"
+    "encrypted: true\r\n"
+    "User-Agent: Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36\r\n"
+    "Accept: */*\r\n"
+    "Referer: http://192.168.1.110:8000/editor_page.html\r\n"
+    "Accept-Encoding: gzip, deflate\r\n"
+    "Accept-Language: en-US,en;q=0.9,he;q=0.8\r\n"
+    "\r\n"
+).encode()
+
+
+def legacy_receive_headers(client_socket):
+    """The previous main_server.receive_headers, kept here for comparison"""
+    headers = b""
+    action = client_socket.recv(4).decode()
+    if action == "DELE":
+        action = action + client_socket.recv(2).decode()
+    while True:
+        chunk = client_socket.recv(1)
+        headers += chunk
+        if b"\r\n\r\n" in headers:
+            break
+    return action, headers.decode()
+
+
+def buffered_receive_headers(reader):
+    return reader.read_request()
+
+
+def run(parser):
+    server, client = socket.socketpair()
+    payload = POLL_REQUEST * REQUESTS
+
+    def writer():
+        client.sendall(payload)
+
+    thread = threading.Thread(target=writer)
+    start = time.perf_counter()
+    thread.start()
+    # One wrapper for the whole stream, exactly like a keep-alive connection
+    source = BufferedSocket(server) if parser is buffered_receive_headers else server
+    for _ in range(REQUESTS):
+        parser(source)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    server.close()
+    client.close()
+    return elapsed
+
+
+def main():
+    print(f"{REQUESTS} poll requests, {len(POLL_REQUEST)} header bytes each")
+    legacy = run(legacy_receive_headers)
+    buffered = run(buffered_receive_headers)
+    for name, elapsed in (("legacy recv(1)", legacy), ("buffered", buffered)):
+        print(f"{name:16s} {elapsed * 1000:9.1f} ms total  {elapsed / REQUESTS * 1e6:8.1f} us/request")
+    print(f"speedup: {legacy / buffered:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
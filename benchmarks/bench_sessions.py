@@ -0,0 +1,67 @@
+"""Cost of identifying the user and file of a request: session token vs encrypted headers.
+
+"encrypted headers" is what /poll-updates did for every request: three AES
+decryptions (fileID, userID, lastModID) under the global key. "session token"
+validates the HMAC of the token, looks the session up and checks the file
+against the files the session has opened. Both run in-process, without sockets.
+
+Run from the repo root:  python benchmarks/bench_sessions.py [--requests 50000]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from class_users import RSAManager  # noqa: E402
+from sessions import SessionManager  # noqa: E402
+
+FILE_ID, USER_ID, LAST_MOD_ID = 42, 1234, 98765
+
+
+def encrypted_headers(rsa_manager, global_key, requests):
+    headers = [rsa_manager.encryptAES(str(value), global_key) for value in (FILE_ID, USER_ID, LAST_MOD_ID)]
+    started = time.perf_counter()
+    for _ in range(requests):
+        file_id, user_id, last_mod_id = (int(rsa_manager.decryptAES(value, global_key)) for value in headers)
+    return time.perf_counter() - started
+
+
+def session_token(sessions, requests):
+    token = sessions.issue(USER_ID)
+    last_mod_header = str(LAST_MOD_ID)  # sent in the clear alongside the token
+    started = time.perf_counter()
+    for _ in range(requests):
+        session = sessions.validate(token)
+        sessions.open_file(session, FILE_ID, lambda file_id, user_id: True)
+        user_id, last_mod_id = session.user_id, int(last_mod_header)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    rsa_manager = RSAManager()
+    global_key = rsa_manager.generateAESKey()
+    sessions = SessionManager()
+    rows = [("encrypted headers (3x AES)", lambda: encrypted_headers(rsa_manager, global_key, args.requests)),
+            ("session token (HMAC)", lambda: session_token(sessions, args.requests))]
+
+    print(f"{args.requests} requests, median of {args.runs} runs")
+    print(f"{'':28} {'us/request':>10} {'requests/s':>12}")
+    results = {}
+    for name, run in rows:
+        seconds = statistics.median(run() for _ in range(args.runs))
+        results[name] = seconds
+        print(f"{name:28} {seconds / args.requests * 1e6:>10.2f} {args.requests / seconds:>12.0f}")
+    baseline, tokens = results.values()
+    print(f"speed-up: {baseline / tokens:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Time to hand one edit to K readers of a file: per-reader work vs the shared fan-out bodies.
+
+Each round one user saves a batch of modifications and K other readers of the
+file, all at the same ModID, fetch them encrypted with the file key, as
+/poll-updates and the WebSocket pusher do. "per reader" queries, serialises and
+encrypts for every reader, as before; "fan-out" goes through UpdateFanout.
+
+Run from the repo root:  python benchmarks/bench_update_fanout.py [--readers 1,10,50 --rounds 200]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from class_users import ChangeLogDatabase, RSAManager  # noqa: E402
+from update_fanout import UpdateFanout  # noqa: E402
+
+WRITER = 1
+
+
+def per_reader(changes, rsa_manager, key, file_id, after, upto, reader):
+    updates = changes.get_changes_for_user(file_id, after, reader)
+    return json.dumps({"encrypted_data": rsa_manager.encryptAES(json.dumps(updates), key), "encrypted": True})
+
+
+def run(changes, rsa_manager, key, readers, rounds, batch, fetch):
+    file_id = 1
+    modification = {"content": "x" * 40, "row": 3, "action": "update", "linesLength": 100}
+    after = changes.get_last_mod_id(file_id) or 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        upto = changes.add_modifications(file_id, [modification] * batch, WRITER)['lastModID']
+        for reader in range(WRITER + 1, WRITER + 1 + readers):
+            fetch(file_id, after, upto, reader)
+        after = upto
+    return (time.perf_counter() - started) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", default="1,10,50", help="comma-separated reader counts")
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=5, help="modifications saved per round")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    rsa_manager = RSAManager()
+    key = rsa_manager.generateAESKey()
+    with tempfile.TemporaryDirectory() as folder:
+        changes = ChangeLogDatabase(os.path.join(folder, "bench.db"))
+        print(f"{args.batch} modifications per edit, {args.rounds} edits")
+        print(f"{'readers':>7} {'per reader':>12} {'fan-out':>10} {'speed-up':>9}  fan-out queries/encryptions")
+        for readers in [int(count) for count in args.readers.split(",")]:
+            plain = run(changes, rsa_manager, key, readers, args.rounds, args.batch,
+                        lambda f, a, u, r: per_reader(changes, rsa_manager, key, f, a, u, r))
+            fanout = UpdateFanout(changes.get_changes_between, rsa_manager.encryptAES)
+            shared = run(changes, rsa_manager, key, readers, args.rounds, args.batch,
+                         lambda f, a, u, r: fanout.updates(f, a, u, r, key))
+            stats = fanout.stats()
+            print(f"{readers:>7} {plain * 1000:>10.2f}ms {shared * 1000:>8.2f}ms {plain / shared:>8.1f}x"
+                  f"  {stats['misses']}/{stats['bodies']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Storage size and save/load time of VersionDatabase on a synthetic edit history.
+
+Compares the current keyframe + delta encoding against the old layout, where every
+version stored the full text in versionsLog.content. The history is one source file
+saved repeatedly with a handful of line edits between saves and an occasional
+large rewrite.
+
+Run from the repo root:  python benchmarks/bench_version_storage.py [--versions 300]
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from class_users import VersionDatabase  # noqa: E402
+
+FILE_ID = 1
+
+
+class PlainVersionDatabase(VersionDatabase):
+    """The previous behaviour: the full text of every version in content"""
+
+    def _store(self, cursor, fileID, version, content, base_version, update=False):
+        cursor.execute('''
+            INSERT INTO versionsLog (version, fileID, content)
+            VALUES (?, ?, ?)
+        ''', (version, fileID, content))
+
+
+def history(versions, lines, seed=7):
+    rng = random.Random(seed)
+    text = [f"    value_{i} = compute({i}, {rng.random():.6f})  # line {i}\n" for i in range(lines)]
+    for version in range(versions):
+        if version and version % 50 == 0:
+            # Reformat a fifth of the file
+            start = rng.randrange(len(text))
+            for i in range(start, min(len(text), start + len(text) // 5)):
+                text[i] = text[i].replace("    ", "\t", 1)
+        for _ in range(rng.randrange(1, 15)):
+            i = rng.randrange(len(text))
+            roll = rng.random()
+            if roll < 0.5:
+                text[i] = f"    changed_{version} = {rng.random():.6f}\n"
+            elif roll < 0.8:
+                text.insert(i, f"    added_{version} = {rng.random():.6f}\n")
+            elif len(text) > 10:
+                del text[i]
+        yield "".join(text)
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000
+
+
+def run(database_class, texts, loads):
+    path = os.path.join(tempfile.mkdtemp(), "versions.db")
+    db = database_class(path)
+    saves = []
+    for text in texts:
+        started = time.perf_counter()
+        db.add_version(FILE_ID, text)
+        saves.append(time.perf_counter() - started)
+
+    rng = random.Random(1)
+    reads = []
+    for _ in range(loads):
+        version = rng.randrange(1, len(texts) + 1)
+        started = time.perf_counter()
+        content = db.get_version_fullcontent(version, FILE_ID)[0]
+        reads.append(time.perf_counter() - started)
+        assert content == texts[version - 1]
+
+    conn = sqlite3.connect(path)
+    stored = conn.execute(
+        "SELECT SUM(IFNULL(LENGTH(CAST(content AS BLOB)), 0) + IFNULL(LENGTH(data), 0)) FROM versionsLog"
+    ).fetchone()[0]
+    conn.execute("VACUUM")
+    conn.close()
+    return {
+        "stored": stored,
+        "file": os.path.getsize(path),
+        "save p50": percentile(saves, 0.5),
+        "save p99": percentile(saves, 0.99),
+        "load p50": percentile(reads, 0.5),
+        "load p99": percentile(reads, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--versions", type=int, default=300)
+    parser.add_argument("--lines", type=int, default=3000)
+    parser.add_argument("--loads", type=int, default=300)
+    args = parser.parse_args()
+
+    texts = list(history(args.versions, args.lines))
+    raw = sum(len(text.encode('utf-8')) for text in texts)
+    print(f"{args.versions} versions of a ~{args.lines}-line file, {raw / 1e6:.1f} MB of raw text")
+    print(f"{'':>8} {'stored MB':>10} {'db file MB':>11} {'save p50':>9} {'p99':>7} {'load p50':>9} {'p99':>7}")
+    results = {}
+    for name, database_class in [("full", PlainVersionDatabase), ("delta", VersionDatabase)]:
+        result = results[name] = run(database_class, texts, args.loads)
+        print(f"{name:>8} {result['stored'] / 1e6:>10.2f} {result['file'] / 1e6:>11.2f} "
+              f"{result['save p50']:>6.2f} ms {result['save p99']:>7.2f} "
+              f"{result['load p50']:>6.2f} ms {result['load p99']:>7.2f}")
+    print(f"storage saved: {1 - results['delta']['file'] / results['full']['file']:.1%} of the database file")
+
+
+if __name__ == "__main__":
+    main()
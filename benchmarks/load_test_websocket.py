@@ -0,0 +1,176 @@
+"""Drive N simulated editors over /ws-edit against one file of a running server.
+
+Every editor does the same key exchange as editor_page.js, opens a WebSocket,
+sends single-line updates and counts the updates pushed from the other editors.
+
+    python benchmarks/load_test_websocket.py --port 8000 --file-id 3 --user-ids 1234,5678 --editors 50
+"""
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import struct
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from class_users import RSAManager  # noqa: E402
+
+crypto = RSAManager()  # doubles as the client's RSA key pair and AES helper
+
+
+def http_request(host, port, method, path, headers=None, body=b""):
+    sock = socket.create_connection((host, port))
+    lines = [f"{method} {path} HTTP/1.1", f"Host: {host}", "Connection: close",
+             f"Content-Length: {len(body)}"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+    data = b""
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    sock.close()
+    return json.loads(data.split(b"\r\n\r\n", 1)[1])
+
+
+def get_keys(host, port, file_id):
+    body = json.dumps({"public_key_client": crypto.get_public_key()}).encode()
+    global_key = crypto.decryptRSA(http_request(host, port, "POST", "/get-global-aes", body=body)["AESKey"])
+    headers = {"fileId": crypto.encryptAES(str(file_id), global_key), "encrypted": "true"}
+    loaded = http_request(host, port, "GET", "/load", headers)
+    loaded = json.loads(crypto.decryptAES(loaded["encrypted_data"], global_key))
+    return global_key, loaded["fileAESKey"], loaded["lastModID"]
+
+
+class WebSocketClient:
+    def __init__(self, host, port, path):
+        self.sock = socket.create_connection((host, port))
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall((
+            f"GET {path} HTTP/1.1\r\nHost: {host}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+        ).encode())
+        self.buffer = b""
+        while b"\r\n\r\n" not in self.buffer:
+            self.buffer += self.sock.recv(4096)
+        head, self.buffer = self.buffer.split(b"\r\n\r\n", 1)
+        if b" 101 " not in head.split(b"\r\n")[0]:
+            raise RuntimeError(f"Upgrade failed: {head[:100]}")
+
+    def send(self, text):
+        payload = text.encode()
+        mask = os.urandom(4)
+        header = bytes([0x81])
+        if len(payload) < 126:
+            header += bytes([0x80 | len(payload)])
+        elif len(payload) < 65536:
+            header += bytes([0x80 | 126]) + struct.pack("!H", len(payload))
+        else:
+            header += bytes([0x80 | 127]) + struct.pack("!Q", len(payload))
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.sock.sendall(header + mask + masked)
+
+    def _read(self, length):
+        while len(self.buffer) < length:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionResetError("Server closed the connection")
+            self.buffer += chunk
+        data, self.buffer = self.buffer[:length], self.buffer[length:]
+        return data
+
+    def recv(self):
+        first, second = self._read(2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self._read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self._read(8))[0]
+        return first & 0x0F, self._read(length)
+
+
+def editor(args, index, user_id, keys, stats):
+    global_key, file_key, last_mod_id = keys
+    ws = WebSocketClient(args.host, args.port, "/ws-edit")
+    ws.send(json.dumps({
+        "type": "hello", "encrypted": True,
+        "fileID": crypto.encryptAES(str(args.file_id), global_key),
+        "userID": crypto.encryptAES(str(user_id), global_key),
+        "lastModID": crypto.encryptAES(str(last_mod_id), global_key),
+    }))
+
+    sent_at = {}
+    done = threading.Event()
+
+    def receiver():
+        while not done.is_set():
+            try:
+                opcode, payload = ws.recv()
+            except (ConnectionResetError, OSError):
+                return
+            if opcode != 0x1:
+                continue
+            message = json.loads(payload)
+            with stats["lock"]:
+                if message["type"] == "ack":
+                    stats["ack_latencies"].append(time.perf_counter() - sent_at.pop(message["id"]))
+                elif message["type"] == "updates":
+                    stats["pushed"] += 1
+                elif message["type"] == "error":
+                    stats["errors"] += 1
+
+    thread = threading.Thread(target=receiver, daemon=True)
+    thread.start()
+    for edit in range(args.edits):
+        modification = json.dumps({"content": f"editor {index} edit {edit}", "row": index,
+                                   "action": "update", "linesLength": args.editors})
+        request_id = f"{index}-{edit}"
+        sent_at[request_id] = time.perf_counter()
+        ws.send(json.dumps({"type": "save", "id": request_id,
+                            "modifications": [crypto.encryptAES(modification, file_key)]}))
+        time.sleep(args.interval)
+    time.sleep(1)
+    done.set()
+    ws.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--file-id", type=int, required=True)
+    parser.add_argument("--user-ids", required=True, help="comma separated users with access to the file")
+    parser.add_argument("--editors", type=int, default=20)
+    parser.add_argument("--edits", type=int, default=50, help="edits per editor")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between edits")
+    args = parser.parse_args()
+
+    user_ids = [int(user_id) for user_id in args.user_ids.split(",")]
+    keys = get_keys(args.host, args.port, args.file_id)
+    stats = {"lock": threading.Lock(), "ack_latencies": [], "pushed": 0, "errors": 0}
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=editor, args=(args, i, user_ids[i % len(user_ids)], keys, stats))
+               for i in range(args.editors)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(stats["ack_latencies"])
+    print(f"{args.editors} editors x {args.edits} edits in {elapsed:.2f} s")
+    print(f"acked edits: {len(latencies)}  ({len(latencies) / elapsed:.0f}/s)  errors: {stats['errors']}")
+    if latencies:
+        print(f"ack latency  p50 {latencies[len(latencies) // 2] * 1000:.1f} ms  "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    print(f"update pushes received: {stats['pushed']}")
+
+
+if __name__ == "__main__":
+    main()
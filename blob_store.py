@@ -0,0 +1,340 @@
+"""Content-addressed blob store.
+
+A blob is stored once per distinct content. It is cut into line-aligned chunks
+whose boundaries depend only on the lines around them, each chunk is written
+zlib-compressed to <root>/<2 hex digits>/<sha256 of the chunk>, and the list of
+chunk hashes is kept in the blobs table under the sha256 of the whole content.
+Saving content that already exists costs one row update, and similar content
+(an edited copy, the next version) shares every chunk the edit did not touch.
+
+blobRefs gives blobs stable names; BlobStorage uses them to keep the files of
+uploads/ here. gc() deletes what neither a name nor the caller's roots reach:
+
+    python blob_store.py /Users/hila/CEOs/users.db /Users/hila/CEOs/blobs
+"""
+import io
+import os
+import json
+import time
+import zlib
+import hashlib
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from db_pool import get_pool
+from schema import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+CHUNK_MIN_BYTES = 2048      # no boundary before a chunk holds this much
+CHUNK_MAX_BYTES = 65536     # forced boundary, also splits very long lines
+BOUNDARY_MASK = 31          # a line whose crc32 & mask is 0 ends a chunk (every ~32 lines)
+CACHE_BYTES = 64 * 1024 * 1024
+GC_GRACE_SECONDS = 3600     # blobs and chunks younger than this are never collected
+GC_INTERVAL = 3600
+
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def chunk_data(data):
+    """Split bytes into chunks that end on a line break chosen by the line's content"""
+    chunks = []
+    start = pos = 0
+    while pos < len(data):
+        end = data.find(b"\n", pos)
+        end = len(data) if end < 0 else end + 1
+        if end - start > CHUNK_MAX_BYTES:
+            end = start + CHUNK_MAX_BYTES
+            chunks.append(data[start:end])
+            start = pos = end
+            continue
+        line_start, pos = pos, end
+        if pos - start >= CHUNK_MIN_BYTES and zlib.crc32(data[line_start:pos]) & BOUNDARY_MASK == 0:
+            chunks.append(data[start:pos])
+            start = pos
+    if start < len(data):
+        chunks.append(data[start:])
+    return chunks
+
+
+class BlobStore:
+    """Blobs by content hash over chunk files in root, with an LRU cache of whole blobs"""
+
+    def __init__(self, db_path, root, cache_bytes=CACHE_BYTES):
+        self.db_path = db_path
+        self.root = root
+        ensure_schema(db_path)
+        self.pool = get_pool(db_path)
+        os.makedirs(root, exist_ok=True)
+        self.cache_bytes = cache_bytes
+        self.cache = OrderedDict()  # hash -> bytes, least recently used first
+        self.cache_size = 0
+        self.lock = threading.Lock()
+        self.gc_thread = None
+        self.counters = {'puts': 0, 'blob_dedups': 0, 'chunks_written': 0, 'chunk_dedups': 0,
+                         'bytes_written': 0, 'cache_hits': 0, 'cache_misses': 0}
+
+    def get_db_connection(self):
+        return self.pool.connection()
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data, commit=True):
+        """Store data (bytes or str) and return its hash.
+
+        With commit=False the blobs row is left in the transaction open on this
+        thread's pooled connection, so a caller storing a reference to the blob
+        commits both at once (or rolls both back).
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        digest = content_hash(data)
+        self._count('puts')
+
+        conn = self.get_db_connection()
+        try:
+            # Refreshing created_at also keeps gc() from collecting the blob before
+            # the caller has stored a reference to it
+            cursor = conn.execute("UPDATE blobs SET created_at = CURRENT_TIMESTAMP WHERE hash = ?", (digest,))
+            if commit:
+                conn.commit()
+            if cursor.rowcount:
+                self._count('blob_dedups')
+                if commit:
+                    self._remember(digest, data)
+                return digest
+
+            chunks = [self._write_chunk(chunk) for chunk in chunk_data(data)]
+            conn.execute("INSERT OR IGNORE INTO blobs (hash, size, chunks) VALUES (?, ?, ?)",
+                         (digest, len(data), json.dumps(chunks)))
+            if commit:
+                conn.commit()
+        finally:
+            conn.close()
+        if commit:
+            self._remember(digest, data)  # not yet, while the caller may still roll the row back
+        return digest
+
+    def _write_chunk(self, chunk):
+        digest = content_hash(chunk)
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            os.utime(path)  # gc() judges chunk age by mtime
+            self._count('chunk_dedups')
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        compressed = zlib.compress(chunk)
+        with open(temp_path, 'wb') as file:
+            file.write(compressed)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+        self._count('chunks_written')
+        self._count('bytes_written', len(compressed))
+        return digest
+
+    def get(self, digest):
+        """Content of a blob as bytes, None if there is no such blob"""
+        with self.lock:
+            data = self.cache.get(digest)
+            if data is not None:
+                self.cache.move_to_end(digest)
+                self.counters['cache_hits'] += 1
+                return data
+            self.counters['cache_misses'] += 1
+
+        conn = self.get_db_connection()
+        try:
+            row = conn.execute("SELECT chunks FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        parts = []
+        for chunk in json.loads(row[0]):
+            with open(self._chunk_path(chunk), 'rb') as file:
+                parts.append(zlib.decompress(file.read()))
+        data = b"".join(parts)
+        self._remember(digest, data)
+        return data
+
+    def _remember(self, digest, data):
+        if len(data) > self.cache_bytes // 4:
+            return
+        with self.lock:
+            if digest in self.cache:
+                self.cache.move_to_end(digest)
+                return
+            self.cache[digest] = data
+            self.cache_size += len(data)
+            while self.cache_size > self.cache_bytes:
+                _, evicted = self.cache.popitem(last=False)
+                self.cache_size -= len(evicted)
+
+    def get_ref(self, name):
+        conn = self.get_db_connection()
+        try:
+            row = conn.execute("SELECT hash FROM blobRefs WHERE name = ?", (name,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def set_ref(self, name, digest):
+        conn = self.get_db_connection()
+        try:
+            conn.execute('''
+                INSERT INTO blobRefs (name, hash) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET hash = excluded.hash, updated_at = CURRENT_TIMESTAMP
+            ''', (name, digest))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def delete_ref(self, name):
+        conn = self.get_db_connection()
+        try:
+            conn.execute("DELETE FROM blobRefs WHERE name = ?", (name,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def gc(self, roots=(), grace_seconds=GC_GRACE_SECONDS):
+        """Delete blobs that no ref and none of roots point to, then chunks no blob uses"""
+        roots = set(roots)
+        removed_blobs = []
+        live_chunks = set()
+        conn = self.get_db_connection()
+        try:
+            roots.update(row[0] for row in conn.execute("SELECT hash FROM blobRefs"))
+            for digest, chunks in conn.execute("SELECT hash, chunks FROM blobs").fetchall():
+                if digest not in roots:
+                    cursor = conn.execute("DELETE FROM blobs WHERE hash = ? AND created_at < datetime('now', ?)",
+                                          (digest, f'-{int(grace_seconds)} seconds'))
+                    if cursor.rowcount:
+                        removed_blobs.append(digest)
+                        continue
+                live_chunks.update(json.loads(chunks))
+            conn.commit()
+        finally:
+            conn.close()
+
+        with self.lock:
+            for digest in removed_blobs:
+                data = self.cache.pop(digest, None)
+                if data is not None:
+                    self.cache_size -= len(data)
+
+        removed_chunks = freed = 0
+        expired = time.time() - grace_seconds
+        for directory in os.listdir(self.root):
+            directory = os.path.join(self.root, directory)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if name in live_chunks:
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                    if stat.st_mtime < expired:
+                        os.remove(path)
+                        removed_chunks += 1
+                        freed += stat.st_size
+                except FileNotFoundError:
+                    pass
+        logger.info(f"Blob gc: {len(removed_blobs)} blobs, {removed_chunks} chunks, {freed} bytes removed")
+        return {'blobs_removed': len(removed_blobs), 'chunks_removed': removed_chunks, 'bytes_freed': freed}
+
+    def start_gc(self, roots, interval=GC_INTERVAL):
+        """Run gc(roots()) every interval seconds on a background thread"""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.gc(roots())
+                except Exception as e:
+                    logger.error(f"Blob gc failed: {str(e)}")
+
+        with self.lock:
+            if self.gc_thread is None:
+                self.gc_thread = threading.Thread(target=run, name="blob-gc", daemon=True)
+                self.gc_thread.start()
+
+    def stats(self):
+        with self.lock:
+            data = dict(self.counters)
+            data['cache_bytes'] = self.cache_size
+        return data
+
+
+class BlobStorage:
+    """DocumentStore storage keeping each file of uploads/ as a blob named after the file.
+
+    Files still on disk from before are read from there and moved into the store
+    the first time they are written.
+    """
+
+    def __init__(self, blob_store):
+        self.blob_store = blob_store
+
+    def exists(self, path):
+        return self.blob_store.get_ref(os.path.basename(path)) is not None or os.path.exists(path)
+
+    def read(self, path):
+        digest = self.blob_store.get_ref(os.path.basename(path))
+        if digest is None:
+            with open(path, 'r', encoding='utf-8', newline=None) as file:
+                return file.read()
+        data = self.blob_store.get(digest)
+        if data is None:
+            raise FileNotFoundError(f"Blob {digest} of {path} is missing")
+        text = data.decode('utf-8')
+        if "\r" in text:
+            # Same newline handling as reading the file in text mode
+            text = io.StringIO(text, newline=None).read()
+        return text
+
+    def prepare(self, path, chunks):
+        return self.blob_store.put("".join(chunks))
+
+    def commit(self, path, digest):
+        self.blob_store.set_ref(os.path.basename(path), digest)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def abort(self, path, digest):
+        pass  # an unreferenced blob is left to gc()
+
+    def remove(self, path):
+        self.blob_store.delete_ref(os.path.basename(path))
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove unreferenced blobs and chunks")
+    parser.add_argument("db_path")
+    parser.add_argument("root", help="blob folder")
+    parser.add_argument("--grace-seconds", type=int, default=GC_GRACE_SECONDS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from class_users import VersionDatabase
+    blob_store = BlobStore(args.db_path, args.root)
+    versions = VersionDatabase(args.db_path, blob_store)
+    print(blob_store.gc(versions.get_blob_hashes(), args.grace_seconds))
+
+
+if __name__ == "__main__":
+    main()
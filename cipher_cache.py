@@ -0,0 +1,129 @@
+"""AES key material kept per key, so a request does not pay for key setup.
+
+Base64-decoding the key and building the key objects costs more than encrypting
+a short header or a modification. KeyContext does it once per key; each message
+then gets its own Cipher under its own IV, so nothing is shared between
+messages and contexts are used from any thread without a lock.
+
+The CBC format on the wire stays what the browser's CryptoJS produces and
+expects, base64(iv + ciphertext) with PKCS7 padding. Messages encrypted in GCM
+mode are authenticated as well and carry the "gcm:" prefix, which base64 never
+starts with; decrypt() accepts both formats.
+"""
+import os
+import base64
+import binascii
+import threading
+from collections import OrderedDict
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+BLOCK = 16
+GCM_PREFIX = "gcm:"
+GCM_NONCE_BYTES = 12
+MAX_KEYS = 1024
+
+
+class DecryptionError(ValueError):
+    pass
+
+
+def _padding(size):
+    count = BLOCK - size % BLOCK
+    return bytes([count]) * count
+
+
+def _unpad(plain):
+    count = plain[-1]
+    if not 1 <= count <= BLOCK or plain[-count:] != bytes([count]) * count:
+        raise DecryptionError("Padding is incorrect")
+    return plain[:-count]
+
+
+class KeyContext:
+    """The AES algorithm object and an AESGCM instance for one key"""
+
+    def __init__(self, key_bytes):
+        self.algorithm = algorithms.AES(key_bytes)
+        self.gcm = AESGCM(key_bytes)
+
+    def encrypt(self, messages, mode="cbc"):
+        """Encrypt each bytes message; returns the base64 wire strings"""
+        if mode == "gcm":
+            results = []
+            for message in messages:
+                nonce = os.urandom(GCM_NONCE_BYTES)
+                sealed = self.gcm.encrypt(nonce, message, None)
+                results.append(GCM_PREFIX + base64.b64encode(nonce + sealed).decode("ascii"))
+            return results
+        if mode != "cbc":
+            raise ValueError(f"Unknown AES mode {mode}")
+        results = []
+        for message in messages:
+            iv = os.urandom(BLOCK)
+            view = memoryview(message)
+            whole = len(view) - len(view) % BLOCK  # bytes in complete blocks, the rest gets the padding
+            encryptor = Cipher(self.algorithm, modes.CBC(iv)).encryptor()
+            parts = [iv]
+            if whole:
+                parts.append(encryptor.update(view[:whole]))
+            parts.append(encryptor.update(view[whole:].tobytes() + _padding(len(view))))
+            parts.append(encryptor.finalize())
+            results.append(base64.b64encode(b"".join(parts)).decode("ascii"))
+        return results
+
+    def decrypt(self, encrypted):
+        """Decrypt each wire string; a message that cannot be decrypted gives a DecryptionError in its place"""
+        results = []
+        for value in encrypted:
+            try:
+                if value.startswith(GCM_PREFIX):
+                    sealed = base64.b64decode(value[len(GCM_PREFIX):])
+                    results.append(self.gcm.decrypt(sealed[:GCM_NONCE_BYTES], sealed[GCM_NONCE_BYTES:], None))
+                    continue
+                combined = memoryview(base64.b64decode(value))
+                if len(combined) < 2 * BLOCK or len(combined) % BLOCK:
+                    raise DecryptionError(f"Ciphertext of {len(combined)} bytes is not whole blocks")
+                decryptor = Cipher(self.algorithm, modes.CBC(combined[:BLOCK].tobytes())).decryptor()
+                results.append(_unpad(decryptor.update(combined[BLOCK:]) + decryptor.finalize()))
+            except DecryptionError as e:
+                results.append(e)
+            except (binascii.Error, InvalidTag, ValueError, TypeError, AttributeError) as e:
+                results.append(DecryptionError(str(e) or type(e).__name__))
+        return results
+
+
+class CipherCache:
+    """KeyContext by base64 key string, least recently used dropped beyond max_keys"""
+
+    def __init__(self, max_keys=MAX_KEYS):
+        self.max_keys = max_keys
+        self.contexts = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, aes_key):
+        """KeyContext of aes_key; raises ValueError for a key that is not base64 AES key material"""
+        with self.lock:
+            context = self.contexts.get(aes_key)
+            if context is not None:
+                self.contexts.move_to_end(aes_key)
+                self.counters['hits'] += 1
+                return context
+            self.counters['misses'] += 1
+        if not aes_key:
+            raise ValueError("AES key not provided")
+        context = KeyContext(base64.b64decode(aes_key))
+        with self.lock:
+            context = self.contexts.setdefault(aes_key, context)
+            while len(self.contexts) > self.max_keys:
+                self.contexts.popitem(last=False)
+                self.counters['evictions'] += 1
+        return context
+
+    def stats(self):
+        with self.lock:
+            data = dict(self.counters)
+            data['keys'] = len(self.contexts)
+        return data
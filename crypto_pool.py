@@ -0,0 +1,236 @@
+"""Password hashing and RSA work run in worker processes, off the request threads.
+
+Argon2 hashing is built to take tens of milliseconds of CPU, and the RSA steps
+of a login (decrypting the credentials, importing the client's public key and
+encrypting the userId and session token to it) run largely in Python while
+holding the GIL. A burst of logins done on the request threads slows every poll
+and save in the process. CryptoPool sends that work to a few worker processes:
+at most `workers` logins burn CPU at once and the GIL stays with the editing
+requests.
+
+The pool takes at most workers + queue_size operations at a time. Beyond that,
+or when an operation waits longer than its timeout, the caller gets a
+CryptoPoolBusy and the request a 503 with Retry-After, as when the accept queue
+is full.
+
+With workers=0 the same operations run inline on the calling thread.
+"""
+import base64
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import argon2
+from Crypto.PublicKey import RSA
+from Crypto.Cipher import PKCS1_v1_5
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 2
+QUEUE_SIZE = 32
+TIMEOUT = 10           # seconds an operation may take, waiting included
+LATENCY_SAMPLES = 1000
+
+_hasher = argon2.PasswordHasher()
+_private_key = None  # the server's RSA key, set in each worker by _init_worker
+
+
+class CryptoPoolBusy(Exception):
+    """The operation was not run, or not finished in time, because the pool is saturated"""
+
+
+def _init_worker(private_pem):
+    global _private_key
+    _private_key = RSA.import_key(private_pem) if private_pem else None
+
+
+def _timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def _hash_password(password):
+    return _hasher.hash(password)
+
+
+def _verify_password(hashed_password, input_password):
+    try:
+        return _hasher.verify(hashed_password, input_password)
+    except argon2.exceptions.VerifyMismatchError:
+        return False
+
+
+def _decrypt_rsa(values):
+    cipher = PKCS1_v1_5.new(_private_key)
+    results = []
+    for value in values:
+        try:
+            decrypted = cipher.decrypt(base64.b64decode(value), sentinel=None)
+            results.append(decrypted.decode('utf-8') if decrypted else None)
+        except Exception:
+            results.append(None)
+    return results
+
+
+def _encrypt_for_client(public_pem, messages):
+    cipher = PKCS1_v1_5.new(RSA.import_key(public_pem.encode('utf-8')))
+    return [base64.b64encode(cipher.encrypt(message.encode('utf-8'))).decode('utf-8') for message in messages]
+
+
+def _start_context():
+    # fork starts the workers without re-importing the server's main module; safe
+    # only while the process has no other threads that might hold a lock
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return None
+
+
+def _late_context():
+    # Pools made once the server is running come from a clean process instead
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+class CryptoPool:
+    """Process pool for Argon2 and RSA operations with a bounded backlog, timeouts and per-operation latency"""
+
+    def __init__(self, private_key=None, workers=WORKERS, queue_size=QUEUE_SIZE, timeout=TIMEOUT,
+                 samples=LATENCY_SAMPLES):
+        self.private_pem = private_key.export_key() if private_key is not None else None
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.samples = samples
+        self.slots = threading.BoundedSemaphore(workers + queue_size) if workers else None
+        self.executor = None
+        self.lock = threading.Lock()
+        self.in_flight = 0  # operations holding a slot, queued or running
+        self.operations = {}
+        if not workers:
+            _init_worker(self.private_pem)
+
+    def start(self):
+        """Start the worker processes now rather than on the first login.
+
+        Call it before the server opens its listening socket or starts its threads:
+        the workers are forked from this process and inherit both.
+        """
+        if not self.workers:
+            return
+        with self.lock:
+            if self.executor is None:
+                self.executor = self._new_executor(_start_context())
+        for future in [self.executor.submit(_timed, len, ()) for _ in range(self.workers)]:
+            future.result()
+        logger.info(f"Crypto pool started: {self.workers} processes, queue size {self.queue_size}")
+
+    def _new_executor(self, context=None):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context or _late_context(),
+                                   initializer=_init_worker, initargs=(self.private_pem,))
+
+    def hash_password(self, password):
+        return self._run('hash_password', _hash_password, password)
+
+    def verify_password(self, hashed_password, input_password):
+        return self._run('verify_password', _verify_password, hashed_password, input_password)
+
+    def decrypt_rsa(self, values):
+        """Each base64 value decrypted with the server's private key; None for one that cannot be"""
+        return self._run('decrypt_rsa', _decrypt_rsa, list(values))
+
+    def encrypt_for_client(self, public_pem, messages):
+        """Each message encrypted to the client's PEM public key, base64 encoded"""
+        return self._run('encrypt_for_client', _encrypt_for_client, public_pem, list(messages))
+
+    def _run(self, name, function, *args):
+        started = time.perf_counter()
+        if not self.workers:
+            try:
+                result, run_seconds = _timed(function, *args)
+            except Exception:
+                self._record(name, 'errors')
+                raise
+            self._record(name, 'completed', time.perf_counter() - started, run_seconds)
+            return result
+
+        if not self.slots.acquire(blocking=False):
+            self._record(name, 'rejected')
+            raise CryptoPoolBusy(f"Crypto pool full, {name} rejected")
+        with self.lock:
+            self.in_flight += 1
+        try:
+            future = self._submit(function, args)
+        except Exception:
+            self._release_slot()
+            self._record(name, 'errors')
+            raise
+        future.add_done_callback(lambda _: self._release_slot())
+
+        try:
+            result, run_seconds = future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            self._record(name, 'timeouts')
+            raise CryptoPoolBusy(f"{name} did not finish within {self.timeout}s")
+        except Exception:
+            self._record(name, 'errors')
+            raise
+        self._record(name, 'completed', time.perf_counter() - started, run_seconds)
+        return result
+
+    def _release_slot(self):
+        with self.lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+    def _submit(self, function, args):
+        with self.lock:
+            if self.executor is None:
+                self.executor = self._new_executor()
+            executor = self.executor
+        try:
+            return executor.submit(_timed, function, *args)
+        except BrokenProcessPool:
+            # A worker died (killed, out of memory); replace the pool once and retry.
+            # The new workers come from a forkserver, not a fork of this threaded process.
+            logger.error("Crypto pool broken, starting new worker processes")
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = self._new_executor()
+                executor = self.executor
+            return executor.submit(_timed, function, *args)
+
+    def _record(self, name, outcome, seconds=None, run_seconds=None):
+        with self.lock:
+            entry = self.operations.get(name)
+            if entry is None:
+                entry = self.operations[name] = {'completed': 0, 'errors': 0, 'timeouts': 0, 'rejected': 0,
+                                                 'run_seconds': 0.0, 'latencies': deque(maxlen=self.samples)}
+            entry[outcome] += 1
+            if seconds is not None:
+                entry['run_seconds'] += run_seconds
+                entry['latencies'].append(seconds)
+
+    def stats(self):
+        with self.lock:
+            data = {'workers': self.workers, 'queue_size': self.queue_size, 'operations': {}}
+            if self.slots is not None:
+                data['in_flight'] = self.in_flight
+            for name, entry in self.operations.items():
+                latencies = sorted(entry['latencies'])
+                data['operations'][name] = {
+                    'completed': entry['completed'],
+                    'errors': entry['errors'],
+                    'timeouts': entry['timeouts'],
+                    'rejected': entry['rejected'],
+                    'run_ms_avg': round(entry['run_seconds'] / entry['completed'] * 1000, 3) if entry['completed'] else 0.0,
+                    'latency_ms_p50': round(latencies[len(latencies) // 2] * 1000, 3) if latencies else 0.0,
+                    'latency_ms_p99': round(latencies[int(len(latencies) * 0.99)] * 1000, 3) if latencies else 0.0,
+                }
+        return data
@@ -0,0 +1,183 @@
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+BUSY_TIMEOUT_MS = 5000
+
+# Applied once to every new connection
+PRAGMAS = (
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA journal_mode = WAL",     # readers no longer block on the writer and vice versa
+    "PRAGMA synchronous = NORMAL",   # safe with WAL, one fsync per checkpoint instead of per commit
+    "PRAGMA cache_size = -16000",    # 16 MB page cache per connection
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 67108864",
+)
+
+
+class PooledConnection:
+    """What get_db_connection() hands out.
+
+    Wraps the calling thread's long-lived connection. close() returns it instead of
+    closing it and rolls back anything left uncommitted, so the existing
+    open / use / close code keeps working unchanged. Each user keeps its own
+    row_factory even though the classes share the connection.
+    """
+
+    def __init__(self, pool, holder, row_factory):
+        self._pool = pool
+        self._holder = holder
+        self._conn = holder.conn
+        self._row_factory = row_factory
+        self._closed = False
+        holder.depth += 1
+
+    def cursor(self):
+        cursor = self._conn.cursor()
+        cursor.row_factory = self._row_factory
+        return cursor
+
+    def execute(self, sql, parameters=()):
+        cursor = self.cursor()
+        cursor.execute(sql, parameters)
+        return cursor
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._holder.depth -= 1
+        if self._holder.depth == 0 and self._conn.in_transaction:
+            self._conn.rollback()
+            self._pool._count('dirty_releases')
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        # Safety net for a caller that forgot close()
+        if not getattr(self, '_closed', True):
+            self._pool._count('unclosed_releases')
+            self.close()
+
+
+class _ThreadConnection:
+    """Per-thread holder; when the thread ends it is collected and the connection closed"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.depth = 0  # connections handed out and not closed yet (calls can nest)
+
+
+def _close_connection(conn, pool):
+    try:
+        conn.close()
+    except Exception:
+        pass
+    pool._count('connections_open', -1)
+
+
+class ConnectionPool:
+    """One long-lived SQLite connection per thread for a database file"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.counters = {
+            'connections_open': 0,
+            'connections_opened': 0,
+            'checkouts': 0,
+            'dirty_releases': 0,
+            'unclosed_releases': 0,
+        }
+        self.connect_seconds = 0.0
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def _open(self):
+        started = time.perf_counter()
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        holder = _ThreadConnection(conn)
+        weakref.finalize(holder, _close_connection, conn, self)
+        with self.lock:
+            self.counters['connections_open'] += 1
+            self.counters['connections_opened'] += 1
+            self.connect_seconds += time.perf_counter() - started
+        return holder
+
+    def connection(self, row_factory=None):
+        holder = getattr(self.local, 'holder', None)
+        if holder is None:
+            holder = self.local.holder = self._open()
+        self._count('checkouts')
+        return PooledConnection(self, holder, row_factory)
+
+    def stats(self):
+        with self.lock:
+            data = dict(self.counters)
+            opened = data['connections_opened']
+            data['avg_connect_ms'] = round(self.connect_seconds / opened * 1000, 3) if opened else 0
+            data['reuse_ratio'] = round(1 - opened / data['checkouts'], 4) if data['checkouts'] else 0
+        return data
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path):
+    """The shared pool for db_path, so all *Database classes use the same connections"""
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ConnectionPool(db_path)
+        return pool
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {path: pool.stats() for path, pool in pools}
+
+
+class KeyedLock:
+    """Mutex per key (e.g. per fileID), entries are dropped when nobody holds or waits on them"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> [lock, number of holders and waiters]
+
+    @contextmanager
+    def hold(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.entries[key]
@@ -0,0 +1,258 @@
+import io
+import os
+import atexit
+import threading
+import time
+import logging
+from line_store import LineRope
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 2.0      # seconds between write-behind passes
+FLUSH_AFTER_EDITS = 200   # flush a document early after this many unsaved edits
+IDLE_EVICT_SECONDS = 600  # drop documents nobody touched for this long (after flushing)
+
+
+def read_lines(text):
+    """Split text the way reading the file back in universal-newline mode would"""
+    return io.StringIO(text, newline=None).readlines()
+
+
+def normalize(lines, start, end):
+    """Re-split lines[start:end] as if the file had been written and read back.
+
+    modify_file used to rewrite the file after every edit and re-read it with universal
+    newlines, so a "\r" inside a line became a line break and a line without a newline
+    merged with the next one. Lines outside the edit are already in that form, so only
+    the touched window (grown until both edges end in "\n") has to be re-split.
+    """
+    lo = max(0, min(start, len(lines)))
+    hi = max(lo, min(end, len(lines)))
+    while lo > 0 and not lines[lo - 1].endswith("\n"):
+        lo -= 1
+    while hi < len(lines) and (hi == lo or not lines[hi - 1].endswith("\n")):
+        hi += 1
+    lines[lo:hi] = read_lines("".join(lines[lo:hi]))
+
+
+class DiskStorage:
+    """Where DocumentStore keeps documents by default: the path is a plain file.
+
+    A storage reads a document's text and writes it in two steps, prepare() away
+    from any lock and commit() once the store has checked the document is still
+    wanted (abort() otherwise).
+    """
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def read(self, path):
+        with open(path, 'r', encoding='utf-8', newline=None) as file:
+            return file.read()
+
+    def prepare(self, path, chunks):
+        temp_path = f"{path}.{threading.get_ident()}.tmp"  # one per writer, so concurrent saves never share it
+        with open(temp_path, 'w', encoding='utf-8', newline='') as file:
+            file.writelines(chunks)
+            file.flush()
+            os.fsync(file.fileno())
+        return temp_path
+
+    def commit(self, path, temp_path):
+        os.replace(temp_path, path)
+
+    def abort(self, path, temp_path):
+        os.remove(temp_path)
+
+    def remove(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class Document:
+    """Authoritative line buffer of one open file"""
+
+    def __init__(self, path, lines):
+        self.path = path
+        self.lines = LineRope(lines)
+        self.lock = threading.RLock()
+        self.version = 0          # bumped on every edit
+        self.flushed_version = 0  # version last written to disk
+        self.last_used = time.monotonic()
+
+    @property
+    def dirty(self):
+        return self.version != self.flushed_version
+
+    def snapshot(self):
+        """O(1) copy of the lines that later edits do not affect"""
+        with self.lock:
+            self.last_used = time.monotonic()
+            return self.lines.snapshot()
+
+    def text(self):
+        return "".join(self.snapshot().iter_text())
+
+
+class DocumentStore:
+    """Keeps edited files in memory and writes them back to storage in the background"""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, flush_after_edits=FLUSH_AFTER_EDITS,
+                 idle_evict_seconds=IDLE_EVICT_SECONDS, storage=None):
+        self.storage = storage or DiskStorage()
+        self.flush_interval = flush_interval
+        self.flush_after_edits = flush_after_edits
+        self.idle_evict_seconds = idle_evict_seconds
+        self.documents = {}
+        self.lock = threading.Lock()
+        self.generation = 0  # bumped by create() and delete(), which change files behind get()'s unlocked read
+        self.flush_requested = threading.Event()
+        self.flusher = None
+        atexit.register(self.flush_all)
+
+    def _start_flusher(self):
+        if self.flusher is None:
+            self.flusher = threading.Thread(target=self._flush_loop, name="document-flusher", daemon=True)
+            self.flusher.start()
+
+    def get(self, path):
+        """Return the resident document for path, loading it from storage on first use.
+
+        The file is read without the store lock; if two threads load the same
+        path at once, the first Document inserted is kept and the other dropped.
+        A read that overlapped a create() or delete() is discarded and retried.
+        """
+        while True:
+            with self.lock:
+                document = self.documents.get(path)
+                if document is not None:
+                    document.last_used = time.monotonic()
+                    return document
+                generation = self.generation
+            loaded = Document(path, read_lines(self.storage.read(path)))
+            with self.lock:
+                if self.generation != generation:
+                    continue
+                document = self.documents.setdefault(path, loaded)
+                if document is loaded:
+                    self._start_flusher()
+                document.last_used = time.monotonic()
+                return document
+
+    def resident(self, path):
+        with self.lock:
+            return self.documents.get(path)
+
+    def _is_resident(self, document):
+        """Whether document is still the one held for its path.
+
+        Called with document.lock held, and so without taking self.lock:
+        _evict_idle takes the store lock first and document locks after it.
+        """
+        return self.documents.get(document.path) is document
+
+    def edit(self, path, apply):
+        """Run apply(lines) under the document lock and mark the document dirty.
+
+        If apply raises, the lines are rolled back to what they were before the call.
+        """
+        while True:
+            document = self.get(path)
+            with document.lock:
+                if not self._is_resident(document):
+                    continue  # evicted or discarded in between, load it again
+                before = document.lines.snapshot()
+                try:
+                    result = apply(document.lines)
+                except Exception:
+                    document.lines = before
+                    raise
+                document.version += 1
+                document.last_used = time.monotonic()
+                if document.version - document.flushed_version >= self.flush_after_edits:
+                    self.flush_requested.set()
+                return result
+
+    def snapshot_with(self, path, read):
+        """Return (snapshot of path, read()) with no edit of path in between.
+
+        Edits record their changeLog rows inside edit(), so read may look up the
+        newest ModID and get exactly the one the snapshot reflects.
+        """
+        while True:
+            document = self.get(path)
+            with document.lock:
+                if not self._is_resident(document):
+                    continue
+                document.last_used = time.monotonic()
+                return document.lines.snapshot(), read()
+
+    def read_text(self, path):
+        """Current content of path, from memory when the document is resident"""
+        document = self.resident(path)
+        if document is not None:
+            return document.text()
+        return self.storage.read(path)
+
+    def exists(self, path):
+        return self.resident(path) is not None or self.storage.exists(path)
+
+    def create(self, path, text):
+        """Store text as the content of path, replacing any document there"""
+        prepared = self.storage.prepare(path, [text])
+        with self.lock:
+            self.documents.pop(path, None)
+            self.storage.commit(path, prepared)
+            self.generation += 1
+
+    def delete(self, path):
+        with self.lock:
+            self.documents.pop(path, None)
+            self.storage.remove(path)
+            self.generation += 1
+
+    def flush(self, document):
+        with document.lock:
+            if not document.dirty:
+                return
+            version = document.version
+            snapshot = document.lines.snapshot()
+        # Stream the snapshot out while edits keep going on the live document
+        prepared = self.storage.prepare(document.path, snapshot.iter_text())
+        with self.lock:
+            # The file may have been deleted while we were writing
+            if self.documents.get(document.path) is not document:
+                self.storage.abort(document.path, prepared)
+                return
+            self.storage.commit(document.path, prepared)
+        with document.lock:
+            document.flushed_version = max(document.flushed_version, version)
+
+    def flush_all(self):
+        with self.lock:
+            documents = list(self.documents.values())
+        for document in documents:
+            try:
+                self.flush(document)
+            except Exception as e:
+                logger.error(f"Error flushing {document.path}: {str(e)}")
+
+    def _flush_loop(self):
+        while True:
+            self.flush_requested.wait(self.flush_interval)
+            self.flush_requested.clear()
+            self.flush_all()
+            self._evict_idle()
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            for path, document in list(self.documents.items()):
+                # A document being edited is not idle; skip it rather than wait with the store locked
+                if not document.lock.acquire(blocking=False):
+                    continue
+                try:
+                    if not document.dirty and now - document.last_used > self.idle_evict_seconds:
+                        del self.documents[path]
+                finally:
+                    document.lock.release()
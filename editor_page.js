@@ -412,6 +412,13 @@ let undoTriggered = false;
 
 let clientRSA;
 
+// Live editing channel (WebSocket), polling is the fallback while it is not open
+let editSocket = null;
+let editSocketReady = false;
+let pendingSocketModifications = [];
+let socketRequestId = 0;
+let pollLoopRunning = false;
+
 function onDocumentMouseMove(e) {
     if (!isResizing) return;
 
@@ -430,6 +437,8 @@ function onDocumentMouseUp() {
 
 // Functisonality Constants
 const DEBOUNCE_DELAY = 500; // ms
+const POLL_WAIT_SECONDS = 25; // how long the server may hold a poll open
+const POLL_RETRY_DELAY = 1000; // ms before re-polling after an error
 const MIN_WIDTH = 80;
 const MAX_WIDTH = window.innerWidth * 0.8;
 const languageMap = {
@@ -595,9 +604,10 @@ useCodeEditor((editor) => {
                 }
                 else if (isHighlighted){
                     isHighlighted = false;
-                    sendModifiction(endLineNumber, startLineNumber, "delete highlighted", lines.length);
-                    await new Promise(resolve => setTimeout(resolve, 50));
-                    sendModifiction(lines[startLineNumber - 1] , startLineNumber - 1, "update", lines.length);
+                    sendModificationBatch([
+                        buildModification(endLineNumber, startLineNumber, "delete highlighted", lines.length),
+                        buildModification(lines[startLineNumber - 1] , startLineNumber - 1, "update", lines.length)
+                    ]);
                 }
                 else if (isEnter){
                     isEnter = false;
@@ -605,8 +615,10 @@ useCodeEditor((editor) => {
                         sendModifiction("\r",startLineNumber, "insert", lines.length);
                     }
                     else{
-                        sendModifiction(lines[startLineNumber] ,startLineNumber, "insert", lines.length);
-                        sendModifiction(lines[startLineNumber - 1], startLineNumber - 1, "update", lines.length);
+                        sendModificationBatch([
+                            buildModification(lines[startLineNumber] ,startLineNumber, "insert", lines.length),
+                            buildModification(lines[startLineNumber - 1], startLineNumber - 1, "update", lines.length)
+                        ]);
                     }
                 }
 
@@ -629,15 +641,17 @@ useCodeEditor((editor) => {
     });
 });
 
-async function sendModifiction (content, row, action, linesLength) {
-    const modification = JSON.stringify({
+function buildModification(content, row, action, linesLength) {
+    return JSON.stringify({
         content: content,
         row: row,
         action: action,
         linesLength: linesLength,
     });
-    
-    await saveInput(modification);
+}
+
+async function sendModifiction (content, row, action, linesLength) {
+    await saveInput(buildModification(content, row, action, linesLength));
 }
 
 async function handlePaste(event) {
@@ -668,6 +682,50 @@ function get_password(){
 function get_userID(){
     userID = sessionStorage.getItem('userId');
     return userID}
+function get_sessionToken(){
+    return sessionStorage.getItem('sessionToken');}
+
+// With a session token the server takes the user from the session, so the file ID
+// goes in the clear and nothing has to be encrypted for the request headers
+function addSessionHeaders(headers) {
+    const token = get_sessionToken();
+    if (!token) {
+        return false;
+    }
+    headers['sessionToken'] = token;
+    headers['fileID'] = fileID.toString();
+    if (globalAES_key) {
+        headers['encrypted'] = 'true';
+    }
+    return true;
+}
+
+// An expired or revoked session: drop the token, later requests use encrypted IDs again
+function checkSession(response) {
+    if (response.status === 401 && get_sessionToken()) {
+        console.log('Session expired, falling back to encrypted headers');
+        sessionStorage.removeItem('sessionToken');
+    }
+}
+
+// End the session on the server too, so the token stops working before it expires
+async function logOut() {
+    const token = get_sessionToken();
+    if (token) {
+        try {
+            await fetch('/logout', {
+                method: 'POST',
+                headers: { 'sessionToken': token }
+            });
+        } catch (error) {
+            console.error('❌ Logout request failed:', error);
+        }
+    }
+    for (const key of ['sessionToken', 'userId', 'username', 'password']) {
+        sessionStorage.removeItem(key);
+    }
+    window.location.href = 'home_page.html';
+}
 
 function isTextHighlighted() {
     const selection = codeEditor.getSelection();
@@ -716,8 +774,10 @@ async function onKeyZ(change, lines) {
     }
 
     let text = changeLines.join("\n");
-    sendModifiction(change.range['endLineNumber'], change.range['startLineNumber'], "delete highlighted", 0);
-    sendModifiction(text, change.range['startLineNumber'] - 1, "update", lines.length);
+    sendModificationBatch([
+        buildModification(change.range['endLineNumber'], change.range['startLineNumber'], "delete highlighted", 0),
+        buildModification(text, change.range['startLineNumber'] - 1, "update", lines.length)
+    ]);
     undoTriggered = false;
 }
 
@@ -737,46 +797,47 @@ async function saveAll() {
 }
 
 async function saveInput(modification) {
+    if (editSocketReady && file_AES_key && clientRSA) {
+        queueSocketModification(clientRSA.encryptDataAES(modification, file_AES_key));
+        return;
+    }
     try {
-        let headers = { 'Connection': 'keep-alive' };
+        let headers = { 'Connection': 'keep-alive', 'Content-Type': 'application/json' };
+        
+        // Ensure file_AES_key is properly formatted
+        if (!file_AES_key) {
+            console.error('❌ No file AES key available');
+            throw new Error('File encryption key not available');
+        }
         
+        // Encrypt the modification with the file's AES key
+        const encryptedModification = clientRSA.encryptDataAES(modification, file_AES_key);
+        if (!encryptedModification) {
+            throw new Error('Failed to encrypt modification data');
+        }
+
         // Add AES encryption for sensitive data
-        if (clientRSA && clientRSA.isEncryptionAvailable() && globalAES_key) {
+        if (addSessionHeaders(headers)) {
+            console.log('🔑 Saving input with session token...');
+        } else if (clientRSA && clientRSA.isEncryptionAvailable() && globalAES_key) {
             console.log('🔒 Saving input with AES encryption...');
-            const encryptedFileID = clientRSA.encryptDataAES(fileID.toString(), globalAES_key);
-            const encryptedUserID = clientRSA.encryptDataAES(userID.toString(), globalAES_key);
-            
-            // Ensure file_AES_key is properly formatted
-            if (!file_AES_key) {
-                console.error('❌ No file AES key available');
-                throw new Error('File encryption key not available');
-            }
-            
-            // Encrypt the modification with the file's AES key
-            const encryptedModification = clientRSA.encryptDataAES(modification, file_AES_key);
-            if (!encryptedModification) {
-                throw new Error('Failed to encrypt modification data');
-            }
-            
-            headers['fileID'] = encryptedFileID;
-            headers['userID'] = encryptedUserID;
+            headers['fileID'] = clientRSA.encryptDataAES(fileID.toString(), globalAES_key);
+            headers['userID'] = clientRSA.encryptDataAES(userID.toString(), globalAES_key);
             headers['encrypted'] = 'true';
-            
-            var url = "/save?modification=" + encryptedModification;
         } else {
             console.log('🔓 Saving input without encryption...');
             headers['fileID'] = fileID;
             headers['userID'] = userID;
-            
-            const encodedModification = encodeURIComponent(modification);
-            var url = "/save?modification=" + encodedModification;
         }
 
-        const response = await fetch(url, {
-            method: 'GET',
-            headers: headers
+        // The modification goes in the body so large pastes are not limited by the URL length
+        const response = await fetch('/save', {
+            method: 'POST',
+            headers: headers,
+            body: JSON.stringify({ modification: encryptedModification })
         });
 
+        checkSession(response);
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
@@ -791,6 +852,49 @@ async function saveInput(modification) {
     }
 }
 
+// Saves the parts of one logical edit together; the server applies them atomically
+async function sendModificationBatch(modifications) {
+    if (editSocketReady && file_AES_key && clientRSA) {
+        for (const modification of modifications) {
+            queueSocketModification(clientRSA.encryptDataAES(modification, file_AES_key));
+        }
+        return;
+    }
+    try {
+        if (!file_AES_key) {
+            throw new Error('File encryption key not available');
+        }
+        let headers = { 'Content-Type': 'application/json' };
+        if (addSessionHeaders(headers)) {
+            // IDs come from the session
+        } else if (clientRSA && clientRSA.isEncryptionAvailable() && globalAES_key) {
+            headers['fileID'] = clientRSA.encryptDataAES(fileID.toString(), globalAES_key);
+            headers['userID'] = clientRSA.encryptDataAES(userID.toString(), globalAES_key);
+            headers['encrypted'] = 'true';
+        } else {
+            headers['fileID'] = fileID;
+            headers['userID'] = userID;
+        }
+
+        const encryptedModifications = modifications.map(modification => clientRSA.encryptDataAES(modification, file_AES_key));
+        const response = await fetch('/save-batch', {
+            method: 'POST',
+            headers: headers,
+            body: JSON.stringify({ modifications: encryptedModifications })
+        });
+
+        checkSession(response);
+        const result = handleEncryptedResponse(await response.json());
+        if (!response.ok) {
+            throw new Error((result && (result.error || result.message)) || `HTTP error! status: ${response.status}`);
+        }
+        console.log(result);
+    } catch (error) {
+        console.error('❌ Error saving file:', error);
+        showNotification('Error saving file: ' + error.message, 'error');
+    }
+}
+
 // Improved loadFile function with better encryption handling
 async function loadFile(fileId) {
     try {
@@ -1285,17 +1389,44 @@ function getRangeAndContent(update) {
     return { range, content, decorations };
 }
 
+async function applyUpdates(data) {
+    for (const update of data) {
+        if(update.ModID > lastModID)
+        {
+        lastModID = update.ModID;
+        await applyUpdate(update.modification);
+        }
+    }
+}
+
+// The server compacted away changes this client had not seen: start over from its snapshot
+async function applySnapshot(snapshot) {
+    Loadeing = true;
+    const lines = snapshot.content.split('\n');
+    if (lines[lines.length - 1].trim() === '') {
+        lines.pop();
+    }
+    codeEditor.setValue(lines.join('\n'));
+    lastModID = snapshot.ModID;
+    await applyUpdates(snapshot.updates);
+    console.log('✅ Reloaded from server snapshot');
+}
+
 async function pollForUpdates() {
     if (!fileID || !userID || lastModID === undefined || lastModID === null) {
         console.log('Skipping poll - missing fileID, userID, or lastModID');
         return;
     }
+    pollLoopRunning = true;
 
+    let retryDelay = 0;
     try {
         let headers = {};
         
         // Check if encryption is available and AES key exists
-        if (clientRSA && clientRSA.isEncryptionAvailable() && globalAES_key) {
+        if (addSessionHeaders(headers)) {
+            headers['lastModID'] = lastModID.toString();
+        } else if (clientRSA && clientRSA.isEncryptionAvailable() && globalAES_key) {
             headers = {
                 'fileID': clientRSA.encryptDataAES(fileID.toString(), globalAES_key),
                 'userID': clientRSA.encryptDataAES(userID.toString(), globalAES_key),
@@ -1309,12 +1440,15 @@ async function pollForUpdates() {
                 'lastModID': lastModID.toString()
             };
         }
+        // Long-poll: the server holds the request until there are new changes
+        headers['pollWait'] = POLL_WAIT_SECONDS.toString();
 
         const response = await fetch('/poll-updates', {
             method: 'GET',
             headers: headers
         });
 
+        checkSession(response);
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
@@ -1326,30 +1460,132 @@ async function pollForUpdates() {
             return;
         }
         else if (Array.isArray(data) && data.length > 0) {
-            for (const update of data) {
-                if(update.ModID > lastModID)
-                {
-                lastModID = update.ModID;
-                await applyUpdate(update.modification);
-                }
-            }
+            await applyUpdates(data);
+        }
+        else if (data && data.reload) {
+            await applySnapshot(data);
         }
         else {
             console.log('❌ Invalid update format received:', data);
         }
     } catch (error) {
+        retryDelay = POLL_RETRY_DELAY;
         if (error.name === 'TypeError' && error.message.includes('Failed to fetch')) {
             console.log('Connection error during polling - will retry next interval');
         } else {
             console.error('❌ Error polling for updates:', error);
         }
     } finally {
-        if (pollingInterval) {
-            setTimeout(pollForUpdates, 200);
+        // Updates arrive over the edit socket once it is open
+        if (pollingInterval && !editSocketReady) {
+            setTimeout(pollForUpdates, retryDelay);
+        } else {
+            pollLoopRunning = false;
         }
     }
 }
 
+function openEditSocket() {
+    closeEditSocket();
+    if (!('WebSocket' in window)) {
+        return;
+    }
+    const protocol = location.protocol === 'https:' ? 'wss://' : 'ws://';
+    const socket = new WebSocket(protocol + location.host + '/ws-edit');
+    editSocket = socket;
+
+    socket.onopen = () => {
+        let hello;
+        if (clientRSA && clientRSA.isEncryptionAvailable() && globalAES_key) {
+            hello = {
+                type: 'hello',
+                encrypted: true,
+                fileID: clientRSA.encryptDataAES(fileID.toString(), globalAES_key),
+                userID: clientRSA.encryptDataAES(userID.toString(), globalAES_key),
+                lastModID: clientRSA.encryptDataAES(lastModID.toString(), globalAES_key)
+            };
+        } else {
+            hello = {
+                type: 'hello',
+                encrypted: false,
+                fileID: fileID.toString(),
+                userID: userID.toString(),
+                lastModID: lastModID.toString()
+            };
+        }
+        socket.send(JSON.stringify(hello));
+    };
+
+    socket.onmessage = async (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === 'hello') {
+            editSocketReady = true;
+            console.log('✅ Live editing channel open');
+        } else if (message.type === 'updates') {
+            const data = handleEncryptedResponse(message.data, file_AES_key);
+            if (Array.isArray(data)) {
+                await applyUpdates(data);
+            }
+        } else if (message.type === 'reload') {
+            const data = handleEncryptedResponse(message.data, file_AES_key);
+            if (data && data.reload) {
+                await applySnapshot(data);
+            }
+        } else if (message.type === 'ack') {
+            for (const result of message.results) {
+                if (!result.status.startsWith('200')) {
+                    showNotification('Error saving file: ' + result.message, 'error');
+                }
+            }
+        } else if (message.type === 'error') {
+            console.error('❌ Edit channel error:', message.message);
+        }
+    };
+
+    socket.onclose = () => {
+        if (editSocket !== socket) {
+            return;
+        }
+        editSocket = null;
+        editSocketReady = false;
+        console.log('Live editing channel closed - falling back to polling');
+        if (pollingInterval && !pollLoopRunning) {
+            pollForUpdates();
+        }
+    };
+}
+
+function closeEditSocket() {
+    if (editSocket) {
+        const socket = editSocket;
+        editSocket = null;
+        editSocketReady = false;
+        pendingSocketModifications = [];
+        socket.close();
+    }
+}
+
+// Modifications queued in the same tick (e.g. insert + update on Enter) go out as one frame
+function queueSocketModification(encryptedModification) {
+    pendingSocketModifications.push(encryptedModification);
+    if (pendingSocketModifications.length === 1) {
+        queueMicrotask(flushSocketModifications);
+    }
+}
+
+function flushSocketModifications() {
+    const modifications = pendingSocketModifications;
+    pendingSocketModifications = [];
+    if (modifications.length === 0 || !editSocket) {
+        return;
+    }
+    editSocket.send(JSON.stringify({
+        type: 'save',
+        id: ++socketRequestId,
+        modifications: modifications
+    }));
+}
+
 async function periodicLoad() {
     try{
         const data = await getLoad(fileID);
@@ -1382,11 +1618,15 @@ async function periodicLoad() {
 function startPolling() {
     pollingInterval = true;
     loadingInterval = true;
-    pollForUpdates();
+    if (!pollLoopRunning) {
+        pollForUpdates();
+    }
     periodicLoad();
+    openEditSocket();
 }
 
 function stopPolling() {
+    closeEditSocket();
     if (pollingInterval) {
         clearInterval(pollingInterval);
         pollingInterval = false;
@@ -1931,7 +2171,9 @@ async function getVersion(version) {
     try {
         let headers = {};
         
-        if (clientRSA && clientRSA.isEncryptionAvailable() && globalAES_key) {
+        if (addSessionHeaders(headers)) {
+            headers['version'] = version;
+        } else if (clientRSA && clientRSA.isEncryptionAvailable() && globalAES_key) {
             console.log('🔒 Geting version with AES encryption...');
             headers['fileID'] = clientRSA.encryptDataAES(fileID.toString(), globalAES_key);
             headers['userID'] = clientRSA.encryptDataAES(userID.toString(), file_AES_key);
@@ -1948,6 +2190,7 @@ async function getVersion(version) {
             method: 'GET',
             headers: headers
         });
+        checkSession(response);
 
         const rawData = await response.json();
         const data = handleEncryptedResponse(rawData,file_AES_key);
@@ -0,0 +1,213 @@
+import time
+import socket
+import select
+import logging
+from response_writer import send_fully, sendmsg_fully
+
+logger = logging.getLogger(__name__)
+
+RECV_CHUNK_SIZE = 65536
+MAX_HEADER_BYTES = 2 * 1024 * 1024  # saves still carry the modification in the URL
+FIRST_BYTE_TIMEOUT = 300
+HEADER_TIMEOUT = 90
+IO_TIMEOUT = 60  # seconds a body read or a response write may wait on the client
+
+
+class HttpRequest:
+    """Parsed HTTP request line and headers"""
+
+    def __init__(self, method, target, version, headers, raw_headers):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers          # lower-cased header name -> value
+        self.raw_headers = raw_headers  # request text after the method, as the handlers expect it
+
+    def get(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    @property
+    def keep_alive(self):
+        """HTTP/1.1 connections persist unless the client asks to close them"""
+        connection = self.headers.get('connection', '').lower()
+        if self.version == "HTTP/1.1":
+            return connection != "close"
+        return connection == "keep-alive"
+
+    @property
+    def content_length(self):
+        value = self.headers.get('content-length')
+        if value is None:
+            return 0
+        try:
+            length = int(value)
+        except ValueError:
+            raise ValueError(f"Invalid Content-Length: {value}")
+        if length < 0:
+            raise ValueError(f"Invalid Content-Length: {value}")
+        return length
+
+
+def parse_request_head(head):
+    """Parse the bytes before the blank line into an HttpRequest"""
+    text = head.decode('utf-8', errors='replace')
+    request_line, _, header_block = text.partition("\r\n")
+
+    parts = request_line.split(" ")
+    if len(parts) != 3:
+        raise ValueError(f"Malformed request line: '{request_line[:100]}'")
+    method, target, version = parts
+
+    headers = {}
+    for line in header_block.split("\r\n"):
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        if not sep:
+            continue
+        headers[name.strip().lower()] = value.strip()
+
+    raw_headers = text[len(method) + 1:] + "\r\n\r\n"
+    return HttpRequest(method, target, version, headers, raw_headers)
+
+
+class BufferedSocket:
+    """Socket wrapper that reads in large chunks and keeps leftover bytes for the body.
+
+    Everything except recv is delegated to the wrapped socket, so handlers can keep
+    using it exactly like the raw client socket.
+    """
+
+    def __init__(self, sock, chunk_size=RECV_CHUNK_SIZE):
+        self.sock = sock
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.body_remaining = 0  # body bytes of the current request not yet read by a handler
+        self.bytes_sent = 0
+        self.write_seconds = 0.0  # time spent blocked in writes, for the per-route metrics
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def _fill(self):
+        data = self.sock.recv(self.chunk_size)
+        if data:
+            self.buffer += data
+        return len(data)
+
+    def read_request(self, first_byte_timeout=FIRST_BYTE_TIMEOUT, max_header_bytes=MAX_HEADER_BYTES,
+                     io_timeout=IO_TIMEOUT):
+        """Read one request head.
+
+        Returns None if the client closed, or stayed idle for first_byte_timeout,
+        before sending anything. Pipelined requests are parsed straight from the buffer.
+        The socket is left with io_timeout, so a client that stalls in the middle of
+        its body or stops reading the response cannot hold the worker indefinitely.
+        """
+        try:
+            if not self.buffer:
+                self.sock.settimeout(first_byte_timeout)
+                try:
+                    if not self._fill():
+                        return None
+                except socket.timeout:
+                    return None
+            self.sock.settimeout(HEADER_TIMEOUT)
+
+            # Only scan the newly received bytes (plus 3 for a split terminator)
+            scan_from = 0
+            while True:
+                end = self.buffer.find(b"\r\n\r\n", scan_from)
+                if end != -1:
+                    break
+                if len(self.buffer) > max_header_bytes:
+                    raise ValueError("Request headers too large")
+                scan_from = max(0, len(self.buffer) - 3)
+                if not self._fill():
+                    raise ConnectionResetError("Client disconnected while sending headers")
+        except socket.timeout:
+            logger.error("Timeout while receiving headers")
+            raise Exception("Timeout while receiving headers")
+        finally:
+            self.sock.settimeout(io_timeout)
+
+        head = bytes(self.buffer[:end])
+        del self.buffer[:end + 4]
+        request = parse_request_head(head)
+        self.body_remaining = request.content_length
+        return request
+
+    def recv(self, bufsize, flags=0):
+        """Return body bytes of the current request, buffered bytes first.
+
+        Never reads past Content-Length, so a pipelined request is left in the buffer.
+        """
+        bufsize = min(bufsize, self.body_remaining)
+        if bufsize <= 0:
+            return b""
+        if self.buffer:
+            data = bytes(self.buffer[:bufsize])
+            del self.buffer[:bufsize]
+        else:
+            data = self.sock.recv(bufsize, flags)
+        self.body_remaining -= len(data)
+        return data
+
+    def discard_body(self):
+        """Skip whatever part of the current body the handler did not read"""
+        while self.body_remaining > 0:
+            if not self.recv(self.chunk_size):
+                raise ConnectionResetError("Client disconnected while sending body")
+
+    def _write(self, write, *args):
+        started = time.perf_counter()
+        try:
+            sent = write(*args)
+        finally:
+            self.write_seconds += time.perf_counter() - started
+        self.bytes_sent += sent
+        return sent
+
+    def send(self, data, flags=0):
+        """Write all of data; unlike socket.send this never stops after part of it"""
+        return self._write(send_fully, self.sock, data, flags)
+
+    def sendall(self, data, flags=0):
+        self._write(send_fully, self.sock, data, flags)
+
+    def sendmsg(self, buffers, flags=0):
+        """Write the buffers back to back (headers and body) without joining them first"""
+        return self._write(sendmsg_fully, self.sock, buffers, flags)
+
+    def sendfile(self, file, offset=0, count=None):
+        """Send count bytes of file from offset with os.sendfile, without copying them through Python"""
+        return self._write(self.sock.sendfile, file, offset, count)
+
+    def wait_readable(self, timeout):
+        """Whether bytes can be read within timeout seconds (None waits indefinitely)"""
+        if self.buffer:
+            return True
+        poller = select.poll()  # not select(), which fails on descriptors above 1023
+        poller.register(self.sock, select.POLLIN)
+        return bool(poller.poll(None if timeout is None else timeout * 1000))
+
+    def read_stream(self, length):
+        """Read exactly length bytes of an upgraded (WebSocket) connection, ignoring HTTP framing"""
+        while len(self.buffer) < length:
+            if not self._fill():
+                raise ConnectionResetError("Client disconnected")
+        data = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        return data
+
+    def read_exact(self, length):
+        """Read exactly length body bytes, or fewer if the client disconnects"""
+        chunks = []
+        remaining = length
+        while remaining > 0:
+            data = self.recv(min(self.chunk_size, remaining))
+            if not data:
+                break
+            chunks.append(data)
+            remaining -= len(data)
+        return b"".join(chunks)
@@ -0,0 +1,265 @@
+import random
+
+CHUNK_LINES = 256  # target number of lines kept together in one leaf chunk
+
+
+class _Node:
+    """Treap node holding a chunk of consecutive lines. Never modified once published."""
+    __slots__ = ("left", "right", "chunk", "size", "priority")
+
+    def __init__(self, left, right, chunk, priority):
+        self.left = left
+        self.right = right
+        self.chunk = chunk
+        self.priority = priority
+        size = len(chunk)
+        if left is not None:
+            size += left.size
+        if right is not None:
+            size += right.size
+        self.size = size
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+
+def _merge(a, b):
+    """Concatenate two treaps"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        return _Node(a.left, _merge(a.right, b), a.chunk, a.priority)
+    return _Node(_merge(a, b.left), b.right, b.chunk, b.priority)
+
+
+def _split(node, k):
+    """Split into the first k lines and the rest. k must fall on a chunk boundary."""
+    if node is None:
+        return None, None
+    left_size = _size(node.left)
+    if k <= left_size:
+        left, right = _split(node.left, k)
+        return left, _Node(right, node.right, node.chunk, node.priority)
+    left, right = _split(node.right, k - left_size - len(node.chunk))
+    return _Node(node.left, left, node.chunk, node.priority), right
+
+
+def _locate(node, index):
+    """Return (start, chunk) of the chunk holding line index"""
+    start = 0
+    while node is not None:
+        left_size = _size(node.left)
+        if index < left_size:
+            node = node.left
+            continue
+        index -= left_size
+        start += left_size
+        if index < len(node.chunk):
+            return start, node.chunk
+        index -= len(node.chunk)
+        start += len(node.chunk)
+        node = node.right
+    raise IndexError("line index out of range")
+
+
+def _set(node, index, value):
+    left_size = _size(node.left)
+    if index < left_size:
+        return _Node(_set(node.left, index, value), node.right, node.chunk, node.priority)
+    index -= left_size
+    if index < len(node.chunk):
+        chunk = list(node.chunk)
+        chunk[index] = value
+        return _Node(node.left, node.right, chunk, node.priority)
+    return _Node(node.left, _set(node.right, index - len(node.chunk), value), node.chunk, node.priority)
+
+
+def _splice(node, start, stop, lines):
+    """Replace lines start:stop that lie inside a single chunk, copying only the path to it"""
+    left_size = _size(node.left)
+    if start < left_size:
+        return _Node(_splice(node.left, start, stop, lines), node.right, node.chunk, node.priority)
+    start -= left_size
+    stop -= left_size
+    chunk_size = len(node.chunk)
+    if start < chunk_size or (start == chunk_size and node.right is None):
+        chunk = node.chunk[:start] + lines + node.chunk[stop:]
+        return _Node(node.left, node.right, chunk, node.priority)
+    return _Node(node.left, _splice(node.right, start - chunk_size, stop - chunk_size, lines),
+                 node.chunk, node.priority)
+
+
+def _build(lines):
+    """Build a treap from a list of lines in linear time, cut into evenly sized chunks"""
+    if not lines:
+        return None
+    count = -(-len(lines) // CHUNK_LINES)
+    bounds = [len(lines) * i // count for i in range(count + 1)]
+    # Cartesian tree construction with a stack of the right spine
+    spine = []
+    for i in range(count):
+        chunk = lines[bounds[i]:bounds[i + 1]]
+        priority = random.random()
+        last = None
+        while spine and spine[-1][0] < priority:
+            last = spine.pop()
+        entry = [priority, chunk, last, None]  # priority, chunk, left, right
+        if spine:
+            spine[-1][3] = entry
+        spine.append(entry)
+
+    def freeze(entry):
+        if entry is None:
+            return None
+        return _Node(freeze(entry[2]), freeze(entry[3]), entry[1], entry[0])
+
+    return freeze(spine[0])
+
+
+def _iter_chunks(node, start=0):
+    """Yield the chunks covering lines start.. in order, the first one trimmed"""
+    stack = []
+    offset = 0
+    while node is not None:
+        left_size = _size(node.left)
+        if start < left_size:
+            stack.append(node)
+            node = node.left
+        elif start < left_size + len(node.chunk):
+            stack.append(node)
+            offset = start - left_size
+            break
+        else:
+            start -= left_size + len(node.chunk)
+            node = node.right
+    while stack:
+        node = stack.pop()
+        yield node.chunk[offset:] if offset else node.chunk
+        offset = 0
+        node = node.right
+        while node is not None:
+            stack.append(node)
+            node = node.left
+
+
+class LineRope:
+    """Sequence of lines backed by a persistent treap of line chunks.
+
+    Supports the subset of the list interface apply_action uses. Indexing, insert,
+    delete and slice replacement cost O(log n) plus the size of one chunk and of the
+    inserted lines, independent of where in the file the edit lands. Edits never
+    change existing nodes, so snapshot() is O(1) and a snapshot can be streamed to
+    disk while the document keeps changing.
+    """
+
+    def __init__(self, lines=()):
+        self.root = _build(list(lines))
+
+    def __len__(self):
+        return _size(self.root)
+
+    def __iter__(self):
+        for chunk in _iter_chunks(self.root):
+            yield from chunk
+
+    def iter_text(self):
+        """Yield the file content a chunk at a time, for writing to disk or a response"""
+        for chunk in _iter_chunks(self.root):
+            yield "".join(chunk)
+
+    def snapshot(self):
+        copy = LineRope.__new__(LineRope)
+        copy.root = self.root
+        return copy
+
+    def _index(self, index):
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("line index out of range")
+        return index
+
+    def _range(self, key):
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError("LineRope slices do not support a step")
+        return start, max(start, stop)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop = self._range(key)
+            lines = []
+            for chunk in _iter_chunks(self.root, start):
+                lines.extend(chunk[:stop - start - len(lines)])
+                if len(lines) >= stop - start:
+                    break
+            return lines
+        index = self._index(key)
+        start, chunk = _locate(self.root, index)
+        return chunk[index - start]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            start, stop = self._range(key)
+            self.replace(start, stop, value)
+        else:
+            self.root = _set(self.root, self._index(key), value)
+
+    def __delitem__(self, key):
+        if isinstance(key, slice):
+            start, stop = self._range(key)
+        else:
+            start = self._index(key)
+            stop = start + 1
+        self.replace(start, stop, ())
+
+    def insert(self, index, line):
+        length = len(self)
+        if index < 0:
+            index = max(0, index + length)
+        index = min(index, length)
+        self.replace(index, index, (line,))
+
+    def replace(self, start, stop, lines):
+        """Replace lines[start:stop] with lines.
+
+        Only the chunks at both ends of the range are rebuilt; everything between
+        them is dropped by splitting at chunk boundaries.
+        """
+        lines = list(lines)
+        length = len(self)
+        if length == 0:
+            self.root = _build(lines)
+            return
+        anchor = min(start, length - 1)
+        head_start, head = _locate(self.root, anchor)
+        tail_start, tail = _locate(self.root, max(stop - 1, anchor))
+        end = tail_start + len(tail)
+
+        if head_start == tail_start:
+            new_size = len(head) - (stop - start) + len(lines)
+            if CHUNK_LINES // 2 <= new_size <= CHUNK_LINES * 2 or new_size == length - (stop - start) + len(lines):
+                # The common case: the edit stays inside one chunk of reasonable size
+                self.root = _splice(self.root, start, stop, lines)
+                return
+
+        segment = head[:start - head_start] + lines + tail[stop - tail_start:]
+        left, rest = _split(self.root, head_start)
+        right = _split(rest, end - head_start)[1]
+
+        # Keep chunks from shrinking away: fold a small segment into a neighbour
+        if len(segment) < CHUNK_LINES // 2:
+            if right is not None:
+                _, chunk = _locate(right, 0)
+                segment += chunk
+                right = _split(right, len(chunk))[1]
+            elif left is not None:
+                chunk_start, chunk = _locate(left, _size(left) - 1)
+                segment = chunk + segment
+                left = _split(left, chunk_start)[0]
+
+        self.root = _merge(_merge(left, _build(segment)), right)
@@ -3,9 +3,24 @@ import os
 import socket
 import re
 import threading
+import time
 import urllib.parse
-import fcntl
 import logging
+from http_request import BufferedSocket, FIRST_BYTE_TIMEOUT
+from worker_pool import WorkerPool
+from update_notifier import UpdateNotifier
+from document_store import DocumentStore, normalize
+from db_pool import pool_stats
+from metadata_cache import cache_stats
+from update_fanout import UpdateFanout
+from sessions import SessionManager
+from crypto_pool import CryptoPool, CryptoPoolBusy
+from compaction import ChangeLogCompactor
+from blob_store import BlobStore, BlobStorage
+from static_cache import StaticAssetCache
+from content_encoding import DYNAMIC_MIN_BYTES, compressible, encode_dynamic, negotiate
+from response_writer import RouteMetrics, route_name
+from websocket_server import handshake_response, ThreadedSessions
 from class_users import UserDatabase, FileInfoDatabase, FilePermissionsDatabase, ChangeLogDatabase, VersionDatabase, RSAManager 
 
 # Set up logging
@@ -21,12 +36,25 @@ logger = logging.getLogger(__name__)
 
 # Create an instance at the start of your server
 DB_PATH = "/Users/hila/CEOs/users.db"
-user_db = UserDatabase(DB_PATH)
+BLOB_FOLDER = "/Users/hila/CEOs/blobs"
+blob_store = BlobStore(DB_PATH, BLOB_FOLDER)
+session_manager = SessionManager(DB_PATH)
+rsa_manager = RSAManager()
+crypto_pool = CryptoPool(rsa_manager.private_key)  # Argon2 and RSA of logins and signups, in worker processes
+user_db = UserDatabase(DB_PATH, session_manager, crypto_pool)
 file_permissions_db = FilePermissionsDatabase(DB_PATH)
 file_db = FileInfoDatabase(DB_PATH)
 change_log_db = ChangeLogDatabase(DB_PATH)
-version_log_db = VersionDatabase(DB_PATH)
-rsa_manager = RSAManager()
+version_log_db = VersionDatabase(DB_PATH, blob_store)
+update_fanout = UpdateFanout(change_log_db.get_changes_between, rsa_manager.encryptAES)
+update_notifier = UpdateNotifier()
+document_store = DocumentStore(storage=BlobStorage(blob_store))
+static_cache = StaticAssetCache()
+route_metrics = RouteMetrics()
+
+# Longest time a /poll-updates request may be held open waiting for new changes
+LONG_POLL_TIMEOUT = 25
+POLL_BACKLOG_CHECK = 1  # seconds between checks whether a waiting long-poll should free its worker
 
 # Initialize global AES key at module level
 global_AES_key = None
@@ -40,6 +68,28 @@ except Exception as e:
 
 logger.info("Database connections initialized")
 
+# Persistent connection settings
+KEEP_ALIVE_TIMEOUT = 15             # seconds an idle keep-alive connection is held open
+MAX_REQUESTS_PER_CONNECTION = 1000  # close and let the client reconnect after this many requests
+
+# Error page images, loaded on first use
+STATUS_CODE_FOLDER = "/Users/hila/CEOs/status_code"
+error_pages = {}
+
+# Lets the kernel put the headers and the start of the body in one packet (Linux only)
+MSG_MORE = getattr(socket, 'MSG_MORE', 0)
+
+# Per-thread flag read by ready_to_send, set by handle_client for the request being served
+connection_state = threading.local()
+
+# Worker pool settings (start_servers.py can override them)
+WORKER_THREADS = 64
+ACCEPT_QUEUE_SIZE = 256
+RETRY_AFTER_SECONDS = 2
+WEBSOCKET_SESSIONS = 64  # WebSocket sessions served at once, on their own threads outside the pool
+worker_pool = None
+websocket_sessions = None
+
 def should_encrypt_response(headers_data):
     """Check if the request indicates AES encryption should be used"""
     encrypted_header = re.search(r'encrypted:\s*(\S+)', headers_data)
@@ -67,15 +117,21 @@ def file_exist(file_path):
     return exists
 
 
+def error_page(name):
+    """Bytes of the image in status_code/ shown with an error, read from disk once"""
+    page = error_pages.get(name)
+    if page is None:
+        with open(f"{STATUS_CODE_FOLDER}/{name}", "rb") as file:
+            page = file.read()
+        error_pages[name] = page
+    return page
+
+
 def handle_404(client_socket):
     """Send 404 Not Found response with image"""
     logger.info("Sending 404 Not Found response")
     try:
-        with open(r"/Users/hila/CEOs/status_code/404.png", "rb") as file3:
-            photo = file3.read()
-            file_type = "image/png"
-            response = ready_to_send("404 Not Found", photo, file_type)
-            client_socket.send(response)
+        send_response(client_socket, "404 Not Found", error_page("404.png"), "image/png")
         logger.debug("404 response sent successfully")
     except Exception as e:
         logger.error(f"Error sending 404 response: {str(e)}")
@@ -85,11 +141,7 @@ def handle_403(client_socket):
     """Send 403 Forbidden response with image"""
     logger.info("Sending 403 Forbidden response")
     try:
-        with open(r"/Users/hila/CEOs/status_code/403.webp", "rb") as file3:
-            photo = file3.read()
-            file_type = "image/webp"
-            response = ready_to_send("403 Forbidden", photo, file_type)
-            client_socket.send(response)
+        send_response(client_socket, "403 Forbidden", error_page("403.webp"), "image/webp")
         logger.debug("403 response sent successfully")
     except Exception as e:
         logger.error(f"Error sending 403 response: {str(e)}")
@@ -99,11 +151,7 @@ def handle_500(client_socket):
     """Send 500 Internal Server Error response with image"""
     logger.error("Sending 500 Internal Server Error response")
     try:
-        with open(r"/Users/hila/CEOs/status_code/500.png", "rb") as file3:
-            photo = file3.read()
-            file_type = "image/png"
-            response = ready_to_send("500 Internal Server Error", photo, file_type)
-            client_socket.send(response)
+        send_response(client_socket, "500 Internal Server Error", error_page("500.png"), "image/png")
         logger.debug("500 response sent successfully")
     except BrokenPipeError:
         logger.warning("Client disconnected before 500 response could be sent")
@@ -118,85 +166,141 @@ def file_forbidden(file_path, forbidden):
     return is_forbidden
 
 
-def ready_to_send(status, data_file, content_type="text/html",Cache=False):
-    """Prepare HTTP response headers"""
+def ready_to_send(status, data_file, content_type="text/html",Cache=False, extra_headers=None, compress=True):
+    """Prepare HTTP response headers.
+
+    Cache=True marks the response cacheable for a year; a string is sent as the
+    Cache-Control value as is. Large text and JSON bodies are compressed with the
+    best encoding the client accepts unless compress is False.
+    """
     logger.debug(f"Preparing response: {status}, content_type: {content_type}")
+    if not isinstance(data_file, bytes):
+        data_file = str(data_file).encode('utf-8')
+    if compress and len(data_file) >= DYNAMIC_MIN_BYTES and compressible(content_type):
+        data_file, encoding = encode_dynamic(data_file, content_type, getattr(connection_state, 'accept_encoding', None))
+        encoding_headers = {"Content-Encoding": encoding} if encoding else {}
+        encoding_headers["Vary"] = "Accept-Encoding"
+        extra_headers = {**encoding_headers, **(extra_headers or {})}
+    return response_head(status, content_type, len(data_file), Cache, extra_headers) + data_file
+
+
+def response_head(status, content_type, content_length, Cache=False, extra_headers=None):
+    """Status line and headers of a response, up to and including the blank line"""
     headers = f"HTTP/1.1 {status}\r\n"
     headers += f"Content-Type: {content_type}\r\n"
-    if isinstance(data_file, bytes):
-        content_length = len(data_file)
-    else:
-        content_length = len(data_file.encode('utf-8'))
-    if Cache:
+    if isinstance(Cache, str):
+        headers += f"Cache-Control: {Cache}\r\n"
+    elif Cache:
         headers += f"Cache-Control: public, max-age=31536000\r\n"
     headers += f"Content-Length: {content_length}\r\n"
-    headers += f"Connection: close\r\n"
+    if extra_headers:
+        for name, value in extra_headers.items():
+            headers += f"{name}: {value}\r\n"
+    headers += connection_header()
+    headers += "\r\n"
+    return headers.encode()
+
+
+def send_response(client_socket, status, body, content_type, Cache=False, extra_headers=None):
+    """Send a bytes body after its headers without joining the two into a new buffer"""
+    client_socket.sendmsg([response_head(status, content_type, len(body), Cache, extra_headers), body])
+
+
+def send_file_response(client_socket, status, path, content_type, Cache=False, extra_headers=None):
+    """Send the file at path as the body, streamed from the page cache with sendfile"""
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        client_socket.sendall(response_head(status, content_type, size, Cache, extra_headers), MSG_MORE)
+        client_socket.sendfile(file, 0, size)
+
+
+def connection_header():
+    if getattr(connection_state, 'keep_alive', False):
+        return f"Connection: keep-alive\r\n"
+    return f"Connection: close\r\n"
+
+
+def not_modified_response(Cache, extra_headers):
+    """304 answer to a conditional GET: validators and caching headers, no body"""
+    headers = "HTTP/1.1 304 Not Modified\r\n"
+    headers += f"Cache-Control: {Cache}\r\n"
+    for name, value in extra_headers.items():
+        headers += f"{name}: {value}\r\n"
+    headers += connection_header()
     headers += "\r\n"
-    if isinstance(data_file, bytes):
-        return headers.encode() + data_file
-    return (headers + str(data_file)).encode()
+    return headers.encode()
+
+
+def optional_header(headers_data, name):
+    """Value of header name in headers_data, None if the request has no such header"""
+    match = re.search(rf'^{re.escape(name)}:[ \t]*(.*?)[ \t]*\r?$', headers_data, re.IGNORECASE | re.MULTILINE)
+    return match.group(1) if match else None
+
+
+def session_token(headers_data):
+    return optional_header(headers_data, 'sessionToken')
+
+
+def session_request_ids(client_socket, headers_data):
+    """(fileID, userID) of a request that carries a session token.
+
+    The fileID header is then sent in the clear and the user comes from the session.
+    Returns None when there is no token, so the caller reads the encrypted headers.
+    A token that does not validate, or a file the user cannot open, is answered
+    here and gives (None, None).
+    """
+    token = session_token(headers_data)
+    if token is None:
+        return None
+    session = session_manager.validate(token)
+    if session is None:
+        client_socket.send(ready_to_send("401 Unauthorized", json.dumps({"error": "Invalid or expired session"}),
+                                         "application/json"))
+        return None, None
+    file_id = get_header(client_socket, headers_data, r'fileID:\s*(\d+)', "fileID")
+    if not file_id:
+        return None, None
+    if not session_manager.open_file(session, file_id, file_permissions_db.has_access):
+        logger.warning(f"User {session.user_id} has no access to file {file_id}")
+        client_socket.send(ready_to_send("403 Forbidden", json.dumps({"error": "No access to this file"}),
+                                         "application/json"))
+        return None, None
+    return int(file_id), session.user_id
 
 
 def get_content_of_upload(client_socket, content_length):
     """Receive file upload content from client"""
     logger.info(f"Receiving upload content, expected length: {content_length}")
     
-    bytes_received = 0
-    content = b""
     try:
-        while bytes_received < content_length:
-            chunk_size = min(1024, content_length - bytes_received)
-            data = client_socket.recv(chunk_size)
-            if not data:
-                break
-            content += data
-            bytes_received += len(data)
+        content = client_socket.read_exact(content_length)
 
-        if bytes_received == content_length:
+        if len(content) == content_length:
             logger.info("File received successfully")
             return content.decode()
         else:
-            logger.warning(f"File upload incomplete. Received {bytes_received} of {content_length} bytes")
+            logger.warning(f"File upload incomplete. Received {len(content)} of {content_length} bytes")
             return None
     except (BrokenPipeError, ConnectionResetError) as e:
         logger.error(f"Connection error during file upload: {str(e)}")
         return None
 
 
-def receive_headers(client_socket):
-    """Receive and parse HTTP headers from client"""
+def receive_headers(client_socket, first_byte_timeout=FIRST_BYTE_TIMEOUT):
+    """Receive and parse HTTP request line and headers from client"""
     logger.debug("Receiving headers from client")
     
-    headers = b""
-    client_socket.settimeout(300)
-    action = client_socket.recv(4).decode()
-    client_socket.settimeout(90)
-    
-    if not action:
+    request = client_socket.read_request(first_byte_timeout)
+    if request is None:
         logger.info("Client disconnected")
-        return f"client disconnected", ""
-    
-    if action == "DELE":
-        action = action + client_socket.recv(2).decode()
-    
-    if action not in ["GET ", "POST", "DELETE"]:
-        logger.warning(f"Invalid HTTP action received: '{action}'")
-        return f"Not valid action", ""
+        return f"client disconnected", None
     
-    try:
-        while True:
-            chunk = client_socket.recv(1)
-            headers += chunk
-            if b"\r\n\r\n" in headers:
-                break
-    except socket.timeout:
-        logger.error("Timeout while receiving headers")
-        raise Exception("Timeout while receiving headers")
-    finally:
-        client_socket.settimeout(None)
+    if request.method not in ["GET", "POST", "DELETE"]:
+        logger.warning(f"Invalid HTTP action received: '{request.method}'")
+        return f"Not valid action", None
     
-    logger.debug(f"Headers received successfully, action: {action}")
-    return action, headers.decode()
+    logger.debug(f"Headers received successfully, action: {request.method}")
+    return request.method, request
 
 
 def get_header(client_socket, headers_data, header_pattern=r'filename:\s*(\S+)', header_name="header"):
@@ -205,6 +309,10 @@ def get_header(client_socket, headers_data, header_pattern=r'filename:\s*(\S+)',
     logger.debug(f"Headers data preview: {headers_data[:200]}...")
     
     header_match = re.search(header_pattern, headers_data)
+    if not header_match and header_name == "encrypted":
+        # Optional flag: the handler carries on unencrypted, so answering 406 here
+        # would put a second response on a keep-alive connection
+        return None
     if not header_match:
         logger.error(f"Header '{header_name}' not found in request")
         logger.debug(f"All headers received:\n{headers_data}")
@@ -282,8 +390,7 @@ def new_file(client_socket, PATH_TO_FOLDER, headers_data, value=""):
                 lines = value.split("/n")
             
             file_path = PATH_TO_FOLDER + "/uploads/" + decrypted_filename
-            with open(file_path, 'w') as file:
-                file.writelines(lines)
+            document_store.create(file_path, "".join(lines))
             
             logger.info(f"File '{decrypted_filename}' created at path: {file_path}")
             
@@ -309,84 +416,75 @@ def new_file(client_socket, PATH_TO_FOLDER, headers_data, value=""):
     client_socket.send(response)
 
 
-def modify_file(row, action, content, file_path, linesLength):
-    """Modify file content based on action type"""
-    logger.info(f"Modifying file: {file_path}, action: {action}, row: {row}")
-    
-    try:
-        with open(file_path, 'r+', encoding='utf-8', newline=None) as file:
-            fcntl.flock(file, fcntl.LOCK_EX)
-            lines = file.readlines()
-
-            # Handle special cases
-            if action == 'delete same line' or action == "Z update":
-                logger.debug(f"Lines length: {len(lines)}")
-                if len(lines) > linesLength:
-                    logger.debug('Update and delete action detected')
-                    action = 'update and delete row below'
-                else:
-                    action = 'update'
-
-            # Perform the action
-            if action == "delete highlighted":
-                for i in range(content - 1, row - 1, -1):
-                    del lines[i]
-                logger.debug(f"Deleted highlighted lines from {row} to {content}")
-
-            elif action == 'saveAll':
-                lines.clear()
-                lines = content
-                logger.debug("Saved all content")
-
-            elif action == 'delete':
-                logger.debug(f"Attempting to delete row: {row} from {len(lines)} lines")
-                if 0 <= row < len(lines):
-                    del lines[row]
-                else:
-                    raise ValueError("Row number is out of bounds.")
-
-            elif action == "insert" or action == "paste":
-                if action == "paste":
-                    content = content.replace('\\"', '"')
-                    if linesLength == row + len(content.split("\n")):
-                        print("in paste")
-                        content = content + "\r"
-
-                logger.debug(f"Inserting at row: {row}")
-                if row >= len(lines):
-                    lines.insert(row, content)
-                else:
-                    lines.insert(row, content + "\r")
-
-            elif action == 'update':
-                if row == len(lines):
-                    lines.insert(row, content)
-                elif 0 <= row < len(lines):
-                    logger.debug(f"Updating line: {row}")
-                    lines[row] = content + "\r"
-                else:
-                    raise ValueError("Row number is out of bounds.")
-
-            elif action == "update and delete row below":
-                logger.debug("Update and delete row below")
-                del lines[row + 1]
-                lines[row] = content + "\r"
-            else:
-                raise ValueError("Invalid action.")
+def apply_action(lines, row, action, content, linesLength):
+    """Apply one editor action to the line buffer in place. Returns the action performed.
 
-            # Write changes back to file
-            file.seek(0)
-            file.truncate()
-            file.writelines(lines)
-            logger.info("File modification completed successfully")
-            return action
+    Runs inside document_store.edit, which writes the buffer back to disk in the background.
+    """
+    # Handle special cases
+    if action == 'delete same line' or action == "Z update":
+        logger.debug(f"Lines length: {len(lines)}")
+        if len(lines) > linesLength:
+            logger.debug('Update and delete action detected')
+            action = 'update and delete row below'
+        else:
+            action = 'update'
+
+    # Perform the action
+    if action == "delete highlighted":
+        if not 0 <= row <= content <= len(lines):
+            raise ValueError("Row number is out of bounds.")
+        del lines[row:content]
+        logger.debug(f"Deleted highlighted lines from {row} to {content}")
+        normalize(lines, row, row)
+
+    elif action == 'saveAll':
+        lines[:] = content
+        logger.debug("Saved all content")
+        normalize(lines, 0, len(lines))
+
+    elif action == 'delete':
+        logger.debug(f"Attempting to delete row: {row} from {len(lines)} lines")
+        if 0 <= row < len(lines):
+            del lines[row]
+        else:
+            raise ValueError("Row number is out of bounds.")
+        normalize(lines, row, row)
+
+    elif action == "insert" or action == "paste":
+        if action == "paste":
+            content = content.replace('\\"', '"')
+            if linesLength == row + len(content.split("\n")):
+                content = content + "\r"
+
+        logger.debug(f"Inserting at row: {row}")
+        if row >= len(lines):
+            lines.insert(row, content)
+        else:
+            lines.insert(row, content + "\r")
+        normalize(lines, row, row + 1)
+
+    elif action == 'update':
+        if row == len(lines):
+            lines.insert(row, content)
+        elif 0 <= row < len(lines):
+            logger.debug(f"Updating line: {row}")
+            lines[row] = content + "\r"
+        else:
+            raise ValueError("Row number is out of bounds.")
+        normalize(lines, row, row + 1)
+
+    elif action == "update and delete row below":
+        logger.debug("Update and delete row below")
+        if not 0 <= row < len(lines) - 1:
+            raise ValueError("Row number is out of bounds.")
+        del lines[row + 1]
+        lines[row] = content + "\r"
+        normalize(lines, row, row + 1)
+    else:
+        raise ValueError("Invalid action.")
 
-    except FileNotFoundError as e:
-        logger.error(f"File not found: {file_path}")
-        raise FileNotFoundError(f"The file at {file_path} was not found.")
-    except Exception as e:
-        logger.error(f"Error modifying file: {str(e)}")
-        raise ValueError(f"An error occurred: {e}")
+    return action
 
 
 def get_version(file_id, user_id, version, client_socket, use_encryption=False):
@@ -420,25 +518,30 @@ def get_version(file_id, user_id, version, client_socket, use_encryption=False):
     client_socket.send(response)
 
 
-def save_modification(client_socket, file_id, file_name, file_path, modification_data, user_id):
-    """Save file modifications"""
-    logger.info(f"Saving modification for file {file_id} by user {user_id}")
+def apply_modifications(file_id, file_name, file_path, modifications_data, user_id):
+    """Apply decrypted modifications in order as one unit and log them.
+
+    The edits and their changeLog rows happen under the document lock, so a batch is
+    never interleaved with another save; if anything fails the document is rolled back.
+    Returns (status, message, (firstModID, lastModID) or None).
+    """
+    logger.info(f"Saving {len(modifications_data)} modification(s) for file {file_id} by user {user_id}")
     
-    if not os.path.exists(file_path):
+    if not document_store.exists(file_path):
         logger.error(f"File path does not exist: {file_path}")
         if file_name == "File not found":
-            client_socket.send(ready_to_send("200 OK", "File does not exist in database", "text/plain"))
-        else:
-            client_socket.send(ready_to_send("200 OK", "File does not exist in path", "text/plain"))
-        return
+            return "200 OK", "File does not exist in database", None
+        return "200 OK", "File does not exist in path", None
         
     if file_name == "File not found":
         logger.error(f"File {file_id} not found in database")
-        client_socket.send(ready_to_send("200 OK", "File does not exist in database", "text/plain"))
-        return
-        
-    try:
-        # Get the modification data from the match object
+        return "200 OK", "File does not exist in database", None
+
+    if not modifications_data:
+        return "400 Bad Request", "No modifications received", None
+
+    modifications = []
+    for modification_data in modifications_data:
         logger.debug(f"Modification data: {modification_data}")
         
         # Parse the modification data
@@ -446,54 +549,106 @@ def save_modification(client_socket, file_id, file_name, file_path, modification
             modification = json.loads(modification_data)
         except json.JSONDecodeError as e:
             logger.error(f"Invalid JSON in modification data: {e}")
-            client_socket.send(ready_to_send("400 Bad Request", "Invalid modification data format", "text/plain"))
-            return
+            return "400 Bad Request", "Invalid modification data format", None
             
         # Validate required fields
         required_fields = ['content', 'row', 'action', 'linesLength']
         missing_fields = [field for field in required_fields if field not in modification]
         if missing_fields:
             logger.error(f"Missing required fields in modification data: {missing_fields}")
-            client_socket.send(ready_to_send("400 Bad Request", f"Missing required fields: {', '.join(missing_fields)}", "text/plain"))
-            return
-            
-        content = modification['content']
-        
-        try:
-            modification['action'] = modify_file(
+            return "400 Bad Request", f"Missing required fields: {', '.join(missing_fields)}", None
+        modifications.append(modification)
+
+    def apply_all(lines):
+        for modification in modifications:
+            logger.info(f"Modifying file: {file_path}, action: {modification['action']}, row: {modification['row']}")
+            modification['action'] = apply_action(
+                lines,
                 modification['row'], 
                 modification['action'], 
-                content, 
-                file_path, 
+                modification['content'], 
                 modification['linesLength']
             )
-            msg = "File modified successfully."
-            if modification['action'] in ["paste", "update delete row below"]:
-                content = content + "\n"
-            change_log_db.add_modification(file_id, modification, user_id)
-            logger.info("Modification saved successfully")
-        except Exception as e:
-            msg = f"Error modifying file: {str(e)}"
-            logger.error(msg)
-            client_socket.send(ready_to_send("500 Internal Server Error", msg, "text/plain"))
-            return
-        
-        client_socket.send(ready_to_send("200 OK", msg, "text/plain"))
-        
+        result = change_log_db.add_modifications(file_id, modifications, user_id)
+        if result['status'] != 201:
+            raise ValueError(f"Could not log modifications: {result['message']}")
+        return result
+
+    try:
+        result = document_store.edit(file_path, apply_all)
+    except FileNotFoundError:
+        logger.error(f"File not found: {file_path}")
+        return "500 Internal Server Error", f"Error modifying file: The file at {file_path} was not found.", None
     except Exception as e:
-        logger.error(f"Error processing modification: {str(e)}")
-        client_socket.send(ready_to_send("500 Internal Server Error", str(e), "text/plain"))
+        msg = f"Error modifying file: An error occurred: {e}"
+        logger.error(msg)
+        return "500 Internal Server Error", msg, None
+
+    update_notifier.notify(file_id, result['lastModID'])
+    logger.info("Modification saved successfully")
+    return "200 OK", "File modified successfully.", (result['firstModID'], result['lastModID'])
+
+
+def apply_modification(file_id, file_name, file_path, modification_data, user_id):
+    """Apply one decrypted modification and log it. Returns (status, message)."""
+    status, msg, _ = apply_modifications(file_id, file_name, file_path, [modification_data], user_id)
+    return status, msg
+
+
+def save_modification(client_socket, file_id, file_name, file_path, modification_data, user_id):
+    """Save file modifications"""
+    status, msg = apply_modification(file_id, file_name, file_path, modification_data, user_id)
+    client_socket.send(ready_to_send(status, msg, "text/plain"))
 
 
 # GET request handlers
+def get_poll_wait(client_socket, headers_data):
+    """Seconds a poll may wait for new changes, 0 answers immediately"""
+    override = getattr(client_socket, 'poll_timeout', None)
+    if override is not None:
+        return override
+    match = re.search(r'pollWait:\s*(\d+)', headers_data)
+    if not match:
+        return 0
+    return min(int(match.group(1)), LONG_POLL_TIMEOUT)
+
+
+def updates_body(file_id, last_mod_id, user_id, last_seen, key=None):
+    """(JSON body, last ModID) of the changes user_id has not seen after last_mod_id,
+    encrypted when a key is given; (None, None) if there are none.
+
+    Changes up to last_seen, the newest this process has been notified of, come
+    from update_fanout and are shared by every reader of the file. Past that the
+    changeLog is asked directly, as it is when last_seen is not ahead of the reader.
+    """
+    if last_seen > last_mod_id:
+        body, last = update_fanout.updates(file_id, last_mod_id, last_seen, user_id, key)
+        if body:
+            return body, last
+        last_mod_id = last_seen  # everything up to last_seen was this user's own
+    updates = change_log_db.get_changes_for_user(file_id, last_mod_id, user_id)
+    if not updates:
+        return None, None
+    data = encrypt_response_data(json.dumps(updates), True, key) if key else updates
+    return json.dumps(data), max(update['ModID'] for update in updates)
+
+
 def handle_poll_updates(client_socket, headers_data):
     """Handle polling for file updates with encryption support"""
     try:
         # Check if request is encrypted
         encrypted_header = re.search(r'encrypted:\s*(\S+)', headers_data)
         is_encrypted = encrypted_header and encrypted_header.group(1).lower() == 'true'
+        session_ids = session_request_ids(client_socket, headers_data)
         
-        if is_encrypted:
+        if session_ids is not None:
+            fileID, userID = session_ids
+            if not fileID:
+                return
+            lastModID = get_header(client_socket, headers_data, r'lastModID:\s*(\d+)', "lastModID")
+            if not lastModID:
+                return
+        elif is_encrypted:
             #logger.info("Handling encrypted poll-updates request")
             # Get encrypted headers - note the different regex pattern for encrypted data
             fileID_encrypted = get_header(client_socket, headers_data, r'fileID:\s*(\S+)', "fileID")
@@ -506,9 +661,8 @@ def handle_poll_updates(client_socket, headers_data):
             
             # Decrypt the headers
             try:
-                fileID = rsa_manager.decryptAES(fileID_encrypted, str(global_AES_key))
-                lastModID = rsa_manager.decryptAES(lastModID_encrypted, str(global_AES_key))
-                userID = rsa_manager.decryptAES(userID_encrypted, str(global_AES_key))
+                fileID, lastModID, userID = rsa_manager.decryptAES_batch(
+                    [fileID_encrypted, lastModID_encrypted, userID_encrypted], str(global_AES_key))
                 
                 if not fileID or not lastModID or not userID:
                     logger.error("Failed to decrypt poll-updates headers")
@@ -539,28 +693,40 @@ def handle_poll_updates(client_socket, headers_data):
             logger.error(f"Error converting headers to integers: {str(e)}")
             return
         
-        updates = change_log_db.get_changes_for_user(fileID, lastModID, userID)
-        
+        change_log_compactor.touch(fileID, userID, lastModID)
+        reload = change_log_compactor.reload_for(fileID, lastModID)
+        if reload:
+            # The changes this client is missing were compacted away
+            file_key = file_db.get_aes_key(fileID)
+            response_data = encrypt_response_data(json.dumps(reload), True, file_key) if is_encrypted else reload
+            client_socket.send(ready_to_send("200 OK", json.dumps(response_data), content_type="application/json"))
+            return
+
         # Get file AES key for encryption
         file_key = file_db.get_aes_key(fileID)
         if not file_key:
             logger.error("No AES key found for file")
             return
+
+        # Long-poll: hold the request until someone else changes the file or the wait runs out
+        wait_seconds = get_poll_wait(client_socket, headers_data)
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            last_seen = update_notifier.latest_mod_id(fileID)
+            body, _ = updates_body(fileID, lastModID, userID, last_seen, str(file_key) if is_encrypted else None)
+            remaining = deadline - time.monotonic()
+            if body or remaining <= 0:
+                break
+            if hasattr(client_socket, 'park_poll'):
+                # The async server waits on the event loop instead of holding this thread
+                client_socket.park_poll(fileID, last_seen, remaining)
+                return
+            if worker_pool is not None and worker_pool.backlogged():
+                break  # answer now and give the worker to a queued connection; the client polls again
+            update_notifier.wait(fileID, last_seen, min(remaining, POLL_BACKLOG_CHECK))
             
-        if updates:
-            # Encrypt the updates if encryption is enabled
-            if is_encrypted:
-                try:
-                    # Ensure updates is a valid JSON string before encryption
-                    updates_json = json.dumps(updates)
-                    response_data = encrypt_response_data(updates_json, True, file_key)
-                    logger.debug(f"Encrypted response data: {response_data}")
-                except Exception as e:
-                    logger.error(f"Error encrypting updates: {str(e)}")
-                    return
-            else:
-                response_data = updates
-            response = ready_to_send("200 OK", json.dumps(response_data), content_type="application/json")
+        if body:
+            response = ready_to_send("200 OK", body, content_type="application/json")
         else:
             response = ready_to_send("200 OK", json.dumps("No updates"), content_type="application/json")
         
@@ -574,34 +740,153 @@ def handle_poll_updates(client_socket, headers_data):
 
 
 
-def handle_save_request(client_socket, headers_data, request, PATH_TO_FOLDER):
-    """Handle file save requests"""
-    logger.info("Handling save request")
-    
-    if not global_AES_key:
-        logger.error("Global AES key not available")
-        client_socket.send(ready_to_send("500 Internal Server Error", "Server encryption error", "text/plain"))
-        return
-    
+class EditSession:
+    """One WebSocket editing connection for a single file.
+
+    The client first sends {"type": "hello", "fileID", "userID", "lastModID", "encrypted"},
+    then {"type": "save", "id", "modifications": [...]} frames carrying one or more
+    modifications encrypted with the file key, exactly like /save?modification=.
+    Other users' changes are pushed back as {"type": "updates", "data": ...}.
+    """
+
+    def __init__(self):
+        self.file_id = None
+        self.user_id = None
+        self.last_mod_id = 0
+        self.file_key = None
+        self.is_encrypted = False
+        self.lock = threading.Lock()
+
+    def on_message(self, text):
+        """Handle one client message and return the replies to send"""
+        try:
+            message = json.loads(text)
+            if message.get('type') == 'hello':
+                return [self.open(message)]
+            if message.get('type') == 'save':
+                return [self.save(message)]
+            return [json.dumps({'type': 'error', 'message': 'Unknown message type'})]
+        except Exception as e:
+            logger.error(f"Error handling WebSocket message: {str(e)}")
+            return [json.dumps({'type': 'error', 'message': str(e)})]
+
+    def open(self, message):
+        is_encrypted = bool(message.get('encrypted'))
+        file_id = message.get('fileID')
+        user_id = message.get('userID')
+        last_mod_id = message.get('lastModID')
+        if is_encrypted:
+            file_id, user_id, last_mod_id = rsa_manager.decryptAES_batch(
+                [str(file_id), str(user_id), str(last_mod_id)], str(global_AES_key))
+        if not file_id or not user_id or last_mod_id is None:
+            raise ValueError("Missing fileID, userID or lastModID")
+
+        file_id = int(file_id)
+        user_id = int(user_id)
+        if not file_permissions_db.has_access(file_id, user_id):
+            raise ValueError("User does not have access to this file")
+        file_key = file_db.get_aes_key(file_id)
+        if not file_key:
+            raise ValueError("AES key not found for the file")
+
+        with self.lock:
+            self.user_id = user_id
+            self.last_mod_id = int(last_mod_id)
+            self.file_key = str(file_key)
+            self.is_encrypted = is_encrypted
+            self.file_id = file_id
+        logger.info(f"WebSocket session opened for file {file_id} by user {user_id}")
+        change_log_compactor.touch(file_id, user_id, last_mod_id)
+        return json.dumps({'type': 'hello', 'status': 'ok'})
+
+    def save(self, message):
+        if self.file_id is None:
+            raise ValueError("Send hello before saving")
+        file_name = file_db.get_filename_by_id(self.file_id)['filename']
+        file_path = PATH_TO_FOLDER + "/uploads/" + file_name
+
+        # All modifications of one message are applied as a batch
+        modifications = rsa_manager.decryptAES_batch(message.get('modifications', []), self.file_key)
+        if not all(modifications):
+            result = {'status': "400 Bad Request", 'message': "Failed to decrypt modification data"}
+            return json.dumps({'type': 'ack', 'id': message.get('id'), 'results': [result]})
+        status, msg, mod_range = apply_modifications(self.file_id, file_name, file_path, modifications, self.user_id)
+        result = {'status': status, 'message': msg}
+        if mod_range:
+            result['firstModID'], result['lastModID'] = mod_range
+        return json.dumps({'type': 'ack', 'id': message.get('id'), 'results': [result]})
+
+    def poll(self):
+        """Return (newest ModID of the file, updates message or None) for the pusher"""
+        last_seen = update_notifier.latest_mod_id(self.file_id)
+        with self.lock:
+            reload = change_log_compactor.reload_for(self.file_id, self.last_mod_id)
+            if reload:
+                self.last_mod_id = max([reload['ModID']] + [update['ModID'] for update in reload['updates']])
+            else:
+                # Sessions of the file at the same ModID all get the same body
+                body, last = updates_body(self.file_id, self.last_mod_id, self.user_id, last_seen,
+                                          self.file_key if self.is_encrypted else None)
+                if body:
+                    self.last_mod_id = last
+            change_log_compactor.touch(self.file_id, self.user_id, self.last_mod_id)
+        if reload:
+            data = encrypt_response_data(json.dumps(reload), True, self.file_key) if self.is_encrypted else reload
+            return last_seen, json.dumps({'type': 'reload', 'data': data})
+        if not body:
+            return last_seen, None
+        return last_seen, '{"type": "updates", "data": ' + body + '}'
+
+
+def handle_websocket(client_socket, http_request):
+    """Upgrade /ws-edit to a WebSocket editing session (threaded server).
+
+    The session runs on threads of its own, so the worker goes back to the pool.
+    Returns True when the session has taken over client_socket. Beyond
+    WEBSOCKET_SESSIONS the upgrade gets a 503 and the editor long-polls instead.
+    """
+    connection_state.keep_alive = False
+    response = handshake_response(http_request)
+    if response is None:
+        client_socket.send(ready_to_send("400 Bad Request", "Invalid WebSocket upgrade", "text/plain"))
+        return False
+    if websocket_sessions is None or not websocket_sessions.start(client_socket, response, EditSession(), update_notifier):
+        logger.warning("WebSocket session limit reached, refusing upgrade")
+        client_socket.send(ready_to_send("503 Service Unavailable", "Too many editing sessions", "text/plain",
+                                         extra_headers={"Retry-After": RETRY_AFTER_SECONDS}))
+        return False
+    return True
+
+
+def get_editor_ids(client_socket, headers_data):
+    """Read the fileID and userID headers of a save, decrypting them when needed"""
+    session_ids = session_request_ids(client_socket, headers_data)
+    if session_ids is not None:
+        return session_ids
     file_id = get_header(client_socket, headers_data, r'fileID:\s*(\S+)', "fileID")
     user_id = get_header(client_socket, headers_data, r'userID:\s*(\S+)', "userID")
     
     if not file_id or not user_id:
-        return
+        return None, None
 
     # Check if the values are AES encrypted
     is_encrypted = get_header(client_socket, headers_data, r'encrypted:\s*(\S+)', "encrypted")
     if is_encrypted and is_encrypted.lower() == 'true':
         if isinstance(file_id, str) and isinstance(user_id, str):
-            file_id = rsa_manager.decryptAES(file_id, str(global_AES_key))
-            user_id = rsa_manager.decryptAES(user_id, str(global_AES_key))
+            file_id, user_id = rsa_manager.decryptAES_batch([file_id, user_id], str(global_AES_key))
         else:
             logger.error("Invalid file_id or user_id type")
-            return
+            return None, None
     
     if not file_id or not user_id:
         logger.error("Failed to decrypt parameters or missing parameters")
-        return
+        return None, None
+    return file_id, user_id
+
+
+def handle_save_request(client_socket, headers_data, request, PATH_TO_FOLDER):
+    """Handle GET /save?modification=... (kept for clients that still use the URL form)"""
+    logger.info("Handling save request")
     
     #decoded_request = urllib.parse.unquote(request)
     match1 = re.search(r'/save\?modification=([^&]+)', request)
@@ -609,11 +894,39 @@ def handle_save_request(client_socket, headers_data, request, PATH_TO_FOLDER):
         logger.error("Modification header not found in save request")
         raise ValueError("modification header not found")
     
+    save_encrypted_modification(client_socket, headers_data, match1.group(1))
+
+
+def handle_save_post(client_socket, content_length, headers_data):
+    """Handle POST /save, the modification is sent as {"modification": ...} in the body"""
+    logger.info("Handling save request")
+
+    body = get_content_of_upload(client_socket, content_length)
+    try:
+        encrypted_modification = json.loads(body)['modification']
+        if not isinstance(encrypted_modification, str):
+            raise ValueError("modification must be a string")
+    except (ValueError, KeyError, TypeError) as e:
+        logger.error(f"Invalid save body: {str(e)}")
+        client_socket.send(ready_to_send("400 Bad Request", "Invalid modification data format", "text/plain"))
+        return
+
+    save_encrypted_modification(client_socket, headers_data, encrypted_modification)
+
+
+def save_encrypted_modification(client_socket, headers_data, encrypted_modification):
+    """Decrypt one modification with the file key and save it"""
+    if not global_AES_key:
+        logger.error("Global AES key not available")
+        client_socket.send(ready_to_send("500 Internal Server Error", "Server encryption error", "text/plain"))
+        return
+    
+    file_id, user_id = get_editor_ids(client_socket, headers_data)
+    if not file_id or not user_id:
+        return
+    
     try:
-        # Get the encrypted modification data
-        encrypted_modification = match1.group(1)
         file_AES_key = str(file_db.get_aes_key(file_id))
-        print("file_AES_key: " + str(file_AES_key))
         if not file_AES_key:
             logger.error(f"No AES key found for file ID: {file_id}")
             client_socket.send(ready_to_send("404 Not Found", "No AES key found for file", "text/plain"))
@@ -634,6 +947,53 @@ def handle_save_request(client_socket, headers_data, request, PATH_TO_FOLDER):
     save_modification(client_socket, file_id, file_name, file_path, modification, user_id)
 
 
+def handle_save_batch(client_socket, content_length, headers_data):
+    """Handle POST /save-batch: an ordered list of modifications applied as one unit"""
+    logger.info("Handling batch save request")
+    use_encryption = should_encrypt_response(headers_data)
+
+    def respond(status, data):
+        response_data = encrypt_response_data(data, use_encryption)
+        client_socket.send(ready_to_send(status, json.dumps(response_data), "application/json"))
+
+    body = get_content_of_upload(client_socket, content_length)
+    file_id, user_id = get_editor_ids(client_socket, headers_data)
+    if not file_id or not user_id:
+        if session_token(headers_data) is None:  # a rejected session was answered already
+            respond("400 Bad Request", {"error": "Missing fileID or userID"})
+        return
+
+    try:
+        encrypted_modifications = json.loads(body)['modifications']
+        if not isinstance(encrypted_modifications, list):
+            raise ValueError("modifications must be a list")
+    except (ValueError, KeyError, TypeError) as e:
+        logger.error(f"Invalid batch save body: {str(e)}")
+        respond("400 Bad Request", {"error": "Invalid batch format"})
+        return
+
+    file_AES_key = file_db.get_aes_key(file_id)
+    if not file_AES_key:
+        logger.error(f"No AES key found for file ID: {file_id}")
+        respond("404 Not Found", {"error": "No AES key found for file"})
+        return
+
+    modifications = rsa_manager.decryptAES_batch([str(encrypted_modification) for encrypted_modification
+                                                  in encrypted_modifications], str(file_AES_key))
+    if not all(modifications):
+        logger.error("Error decrypting modification data in batch")
+        respond("400 Bad Request", {"error": "Failed to decrypt modification data"})
+        return
+
+    file_name = file_db.get_filename_by_id(file_id)['filename']
+    file_path = PATH_TO_FOLDER + "/uploads/" + file_name
+    status, msg, mod_range = apply_modifications(file_id, file_name, file_path, modifications, user_id)
+    data = {"message": msg, "count": len(modifications)}
+    if mod_range:
+        data["firstModID"], data["lastModID"] = mod_range
+    respond(status, data)
+
+
 def handle_file_details(client_socket, headers_data):
     """Handle get file details requests"""
     logger.info("Handling file details request")
@@ -805,6 +1165,14 @@ def handle_get_version(client_socket, headers_data):
     
     use_encryption = should_encrypt_response(headers_data)
     
+    session_ids = session_request_ids(client_socket, headers_data)
+    if session_ids is not None:
+        file_id, user_id = session_ids
+        version = file_id and get_header(client_socket, headers_data, r'version:\s*(\S+)', "version")
+        if file_id and version:
+            get_version(file_id, user_id, version, client_socket, use_encryption)
+        return
+
     file_id = get_header(client_socket, headers_data, r'fileID:\s*(\S+)', "fileID")
     user_id = get_header(client_socket, headers_data, r'userID:\s*(\S+)', "userID")
     version = get_header(client_socket, headers_data, r'version:\s*(\S+)', "version")
@@ -911,11 +1279,10 @@ def handle_load_file(client_socket, headers_data, PATH_TO_FOLDER):
             file_path = f"{PATH_TO_FOLDER}/uploads/{filename}"
             logger.info(f"Loading file ID: {decrypted_file_id}, name: {filename}")
             
-            if not os.path.exists(file_path):
+            if not document_store.exists(file_path):
                 content = ''
             else:
-                with open(file_path, 'r') as file:
-                    content = file.read()
+                content = document_store.read_text(file_path)
             fileAESKey = file_db.get_aes_key(decrypted_file_id)
             logger.info("fileAESKey: " + str(fileAESKey))
             lastModID = change_log_db.get_last_mod_id(decrypted_file_id)
@@ -1008,8 +1375,8 @@ def find_file_type(request):
     return request, file_type
 
 
-def handle_static_files(client_socket, request, PATH_TO_FOLDER, FORBIDDEN):
-    """Handle static file requests (images, HTML, etc.) - FIXED VERSION"""
+def handle_static_files(client_socket, request, headers_data, PATH_TO_FOLDER, FORBIDDEN):
+    """Handle static file requests (images, HTML, etc.) from the static file cache"""
     logger.debug(f"Handling static file request: {request}")
     
     if file_forbidden(PATH_TO_FOLDER + request, FORBIDDEN):
@@ -1022,27 +1389,29 @@ def handle_static_files(client_socket, request, PATH_TO_FOLDER, FORBIDDEN):
         request, file_type = find_file_type(request)
         logger.info(f"Serving file: {request}, type: {file_type}")
 
-        if "imgs/" in request:
-            try:
-                with open(PATH_TO_FOLDER + request, "rb") as file3:
-                    photo = file3.read()
-               
-                response = ready_to_send("200 ok",photo,file_type)
-                client_socket.send(response)
-                
-            except Exception as e:
-                logger.error(f"Error serving image file {request}: {e}")
-                handle_500(client_socket)
-        else:
-            try:
-                with open(PATH_TO_FOLDER + request, "r", encoding='utf-8') as file2:
-                    code = file2.read()
-                response = ready_to_send("200 ok",code,file_type)
-                client_socket.send(response)
-                
-            except Exception as e:
-                logger.error(f"Error serving text file {request}: {e}")
-                handle_500(client_socket)
+        try:
+            asset = static_cache.get(PATH_TO_FOLDER + request, file_type)
+            body, encoding = asset.encoded(negotiate(optional_header(headers_data, "Accept-Encoding")))
+        except Exception as e:
+            logger.error(f"Error serving static file {request}: {e}")
+            handle_500(client_socket)
+            return
+
+        if asset.not_modified(optional_header(headers_data, "If-None-Match"),
+                              optional_header(headers_data, "If-Modified-Since")):
+            static_cache.count_not_modified()
+            client_socket.send(not_modified_response(asset.cache_control, asset.headers(encoding)))
+            return
+
+        if asset.body is not None:
+            send_response(client_socket, "200 ok", body, file_type, asset.cache_control, asset.headers(encoding))
+            return
+        try:
+            send_file_response(client_socket, "200 ok", PATH_TO_FOLDER + request, file_type,
+                               asset.cache_control, asset.headers())
+        except FileNotFoundError:
+            # Deleted since the stat; nothing has been sent yet
+            handle_404(client_socket)
 
 
 def handle_get_requests(client_socket, request, headers_data, PATH_TO_FOLDER, FORBIDDEN):
@@ -1069,8 +1438,10 @@ def handle_get_requests(client_socket, request, headers_data, PATH_TO_FOLDER, FO
             handle_load_file(client_socket, headers_data, PATH_TO_FOLDER)
         elif "/get-public-key" in request: 
             handle_public_key(client_socket)
+        elif "/server-stats" in request:
+            handle_server_stats(client_socket)
         elif "imgs/" in request or request == "//" or "." in request or "/" == request:
-            handle_static_files(client_socket, request, PATH_TO_FOLDER, FORBIDDEN)
+            handle_static_files(client_socket, request, headers_data, PATH_TO_FOLDER, FORBIDDEN)
         else:
             logger.warning(f"Unknown GET request: {request}")
             handle_500(client_socket)
@@ -1081,14 +1452,17 @@ def handle_login(client_socket, content_length,headers_data):
     """Handle login requests"""
     logger.info("Handling login request")
 
-    body = client_socket.recv(content_length).decode()
+    body = get_content_of_upload(client_socket, content_length)
     data = json.loads(body)
     
     # Check if data is encrypted
     if 'encrypted' in data and data['encrypted']:
         logger.debug("Processing encrypted login credentials")
-        decrypted_username = rsa_manager.decryptRSA(data.get('username'))
-        decrypted_password = rsa_manager.decryptRSA(data.get('password'))
+        try:
+            decrypted_username, decrypted_password = crypto_pool.decrypt_rsa([data.get('username'), data.get('password')])
+        except CryptoPoolBusy as e:
+            reject_crypto_busy(client_socket, e)
+            return
         
         if not decrypted_username or not decrypted_password:
             logger.error("Failed to decrypt login credentials")
@@ -1109,7 +1483,11 @@ def handle_login(client_socket, content_length,headers_data):
         response = ready_to_send("404 Not Found", 'public-key-client not found', "application/json")
         client_socket.send(response)
         return
-    response = user_db.login(username, password, clientPublicRSA)
+    try:
+        response = user_db.login(username, password, clientPublicRSA)
+    except CryptoPoolBusy as e:
+        reject_crypto_busy(client_socket, e)
+        return
     if response['status'] == 200:
         logger.info(f"Login successful for: {username}")
     else:
@@ -1118,18 +1496,41 @@ def handle_login(client_socket, content_length,headers_data):
     client_socket.send(ready_to_send(response['status'], json.dumps(response), "application/json"))
 
 
+def handle_logout(client_socket, headers_data):
+    """End the session of the request's token, so it cannot be used until it expires"""
+    token = session_token(headers_data)
+    if token is None or not session_manager.revoke(token):
+        client_socket.send(ready_to_send("401 Unauthorized", json.dumps({"error": "Invalid or expired session"}),
+                                         "application/json"))
+        return
+    logger.info("Session ended at logout")
+    response = {'status': 200, 'message': 'Logged out.'}
+    client_socket.send(ready_to_send(response['status'], json.dumps(response), "application/json"))
+
+
+def reject_crypto_busy(client_socket, error):
+    """Answer 503 when the crypto pool cannot take or finish a login or signup"""
+    logger.warning(f"Crypto pool busy: {str(error)}")
+    response = {'status': 503, 'message': 'Server busy, please retry'}
+    client_socket.send(ready_to_send("503 Service Unavailable", json.dumps(response), "application/json",
+                                     extra_headers={"Retry-After": RETRY_AFTER_SECONDS}))
+
+
 def handle_signup(client_socket, content_length):
     """Handle signup requests"""
     logger.info("Handling signup request")
     
-    body = client_socket.recv(content_length).decode()
+    body = get_content_of_upload(client_socket, content_length)
     data = json.loads(body)
     
     # Check if data is encrypted
     if 'encrypted' in data and data['encrypted']:
         logger.debug("Processing encrypted signup credentials")
-        decrypted_username = rsa_manager.decryptRSA(data.get('username'))
-        decrypted_password = rsa_manager.decryptRSA(data.get('password'))
+        try:
+            decrypted_username, decrypted_password = crypto_pool.decrypt_rsa([data.get('username'), data.get('password')])
+        except CryptoPoolBusy as e:
+            reject_crypto_busy(client_socket, e)
+            return
         
         if not decrypted_username or not decrypted_password:
             logger.error("Failed to decrypt signup credentials")
@@ -1150,7 +1551,11 @@ def handle_signup(client_socket, content_length):
         response = ready_to_send("404 Not Found", 'public-key-client not found', "application/json")
         client_socket.send(response)
         return
-    response = user_db.signup(username, password,clientPublicRSA)
+    try:
+        response = user_db.signup(username, password,clientPublicRSA)
+    except CryptoPoolBusy as e:
+        reject_crypto_busy(client_socket, e)
+        return
     
     if response['status'] == 201:
         logger.info(f"User registration successful: {username}")
@@ -1166,7 +1571,7 @@ def handle_user_permissions(client_socket, content_length, headers_data, request
     
     use_encryption = should_encrypt_response(headers_data)
     
-    body = client_socket.recv(content_length).decode()
+    body = get_content_of_upload(client_socket, content_length)
     
     # Decrypt body if it's AES encrypted
     is_encrypted = 'encrypted' in headers_data and 'true' in headers_data
@@ -1206,6 +1611,7 @@ def handle_user_permissions(client_socket, content_length, headers_data, request
         if "/revoke-user-to-file" in request:
             logger.info(f"Revoking access for user {userID} from file {fileID}")
             response = file_permissions_db.revoke_access(fileID, userID)
+            session_manager.close_file(fileID, userID)
         elif "/grant-user-to-file" in request:
             logger.info(f"Granting {role} access for user {userID} to file {fileID}")
             response = file_permissions_db.grant_access(fileID, userID, role)
@@ -1310,10 +1716,16 @@ def handle_post_requests(client_socket, request, headers_data, PATH_TO_FOLDER):
             handle_user_permissions(client_socket, content_length, headers_data, request)
         elif "/save-new-version" in request:
             handle_save_version(client_socket, content_length, headers_data)
+        elif "/save-batch" in request:
+            handle_save_batch(client_socket, content_length, headers_data)
+        elif request.split('?', 1)[0] == "/save":
+            handle_save_post(client_socket, content_length, headers_data)
+        elif "/logout" in request:
+            handle_logout(client_socket, headers_data)
         elif "/disconnection" in request:
             logger.info("Client disconnection request")
             if content_length > 0:
-                client_socket.recv(content_length).decode()
+                get_content_of_upload(client_socket, content_length)
             return
         elif "/get-global-aes" in request: 
             handle_global_aes(client_socket, content_length)
@@ -1419,14 +1831,13 @@ def handle_delete_file(client_socket, headers_data, PATH_TO_FOLDER):
             return
 
         permissions_result = file_permissions_db.delete_file_permissions(file_id)
-        try:
-            change_result = change_log_db.delete_file_changes(file_id)
-            if change_result['staus'] == 200:
-                logger.info(change_result['message'])
-            else:
-                 logger.error(change_result['message'])
-        except:
-            logger.error("Failed to delete file changes")
+        session_manager.close_file(file_id)
+        update_fanout.invalidate(file_id)
+        change_result = change_log_db.delete_file_changes(file_id)
+        if change_result['status'] == 200:
+            logger.info(change_result['message'])
+        else:
+            logger.error(change_result['message'])
         if permissions_result['status'] != 200:
             error_data = {"error": permissions_result['message']}
             response_data = encrypt_response_data(error_data, use_encryption)
@@ -1437,9 +1848,8 @@ def handle_delete_file(client_socket, headers_data, PATH_TO_FOLDER):
         # Delete file from filesystem
         try:
             file_path = os.path.join(PATH_TO_FOLDER, "uploads", file_result['filename'])
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.info(f"File deleted from filesystem: {file_path}")
+            document_store.delete(file_path)
+            logger.info(f"File deleted from storage: {file_path}")
         except Exception as e:
             logger.error(f"Error deleting file from filesystem: {str(e)}")
 
@@ -1469,83 +1879,186 @@ def handle_delete_requests(client_socket, request, headers_data, PATH_TO_FOLDER)
         handle_500(client_socket)
 
 
-def handle_client(client_socket, client_address, num_thread):
-    PATH_TO_FOLDER = r"/Users/hila/CEOs"
-    FORBIDDEN = {
-        f"{PATH_TO_FOLDER}/status_code/404.png",
-        f"{PATH_TO_FOLDER}/status_code/life.txt",
-        f"{PATH_TO_FOLDER}/status_code/500.png",
-        f"{PATH_TO_FOLDER}/users.db",
-        f"{PATH_TO_FOLDER}/__pycache__",
-        f"{PATH_TO_FOLDER}/class_users.py",
-        f"{PATH_TO_FOLDER}/notes.txt",
-        f"{PATH_TO_FOLDER}/start_servers.py",
-        f"{PATH_TO_FOLDER}/.venv",
-        f"{PATH_TO_FOLDER}/.vscode",
-        f"{PATH_TO_FOLDER}/.idea"
-    }
+PATH_TO_FOLDER = r"/Users/hila/CEOs"
+FORBIDDEN = {
+    f"{PATH_TO_FOLDER}/status_code/404.png",
+    f"{PATH_TO_FOLDER}/status_code/life.txt",
+    f"{PATH_TO_FOLDER}/status_code/500.png",
+    f"{PATH_TO_FOLDER}/users.db",
+    f"{PATH_TO_FOLDER}/__pycache__",
+    f"{PATH_TO_FOLDER}/class_users.py",
+    f"{PATH_TO_FOLDER}/notes.txt",
+    f"{PATH_TO_FOLDER}/start_servers.py",
+    f"{PATH_TO_FOLDER}/.venv",
+    f"{PATH_TO_FOLDER}/.vscode",
+    f"{PATH_TO_FOLDER}/.idea"
+}
+
+change_log_compactor = ChangeLogCompactor(change_log_db, file_db, f"{PATH_TO_FOLDER}/uploads", document_store)
+
+
+def route_request(client_socket, action, request, headers_data):
+    """Route a parsed request to the matching handler"""
+    connection_state.accept_encoding = optional_header(headers_data, "Accept-Encoding")
+    if action == "GET":
+        handle_get_requests(client_socket, request, headers_data, PATH_TO_FOLDER, FORBIDDEN)
+    elif action == "POST":
+        handle_post_requests(client_socket, request, headers_data, PATH_TO_FOLDER)
+    elif action == "DELETE":
+        handle_delete_requests(client_socket, request, headers_data, PATH_TO_FOLDER)
+    else:
+        logger.warning(f"Unknown HTTP method: {action}")
+
 
+def handle_client(client_socket, client_address, num_thread,
+                  keep_alive_timeout=KEEP_ALIVE_TIMEOUT, max_requests=MAX_REQUESTS_PER_CONNECTION):
     client_ip = client_address[0]
     client_port = client_address[1]
+    client_socket = BufferedSocket(client_socket)
+    request = ""
+    requests_served = 0
+    detached = False  # a WebSocket session took the connection over
 
     try:
-        try:
-            action, headers_data = receive_headers(client_socket)
-            
-            if action == "client disconnected":
-                logger.info(f"Client {client_ip} disconnected gracefully")
-                client_socket.close()
-                return
+        while True:
+            try:
+                backlogged = worker_pool is not None and worker_pool.backlogged()
+                if requests_served and backlogged and not client_socket.buffer:
+                    # Don't sit idle on a keep-alive connection while accepted ones wait for a worker
+                    break
+                # The first request gets the long timeout, later ones (or any, when connections
+                # are queued for a worker) only the keep-alive idle timeout
+                first_byte_timeout = FIRST_BYTE_TIMEOUT if requests_served == 0 and not backlogged else keep_alive_timeout
+                action, http_request = receive_headers(client_socket, first_byte_timeout)
+                
+                if action == "client disconnected":
+                    if requests_served == 0:
+                        logger.info(f"Client {client_ip} disconnected gracefully")
+                    break
+
+                if action == "Not valid action":
+                    logger.warning(f"Invalid HTTP method from {client_ip}")
+                    break
+
+                requests_served += 1
+                keep_alive = http_request.keep_alive and requests_served < max_requests
+                if worker_pool is not None and worker_pool.backlogged():
+                    # Give the worker back to connections waiting in the accept queue
+                    keep_alive = False
+                connection_state.keep_alive = keep_alive
+
+                request = http_request.target
+                headers_data = http_request.raw_headers
+
+                # Log non-polling requests with cleaner format
+                if "/poll-updates" not in request:
+                    method = action.strip()
+                    # Extract the path and query parameters
+                    request_parts = request.split('?', 1)
+                    path = request_parts[0]
+                    logger.info(f"{client_ip} → {method} {path}")
+
+                if request.startswith("/ws-edit"):
+                    detached = handle_websocket(client_socket, http_request)
+                    break
+
+                bytes_sent_before = client_socket.bytes_sent
+                write_seconds_before = client_socket.write_seconds
+
+                # Route requests to appropriate handlers
+                route_request(client_socket, action, request, headers_data)
+                route_metrics.record(route_name(request), client_socket.bytes_sent - bytes_sent_before,
+                                     client_socket.write_seconds - write_seconds_before)
+
+                # Keep Content-Length framing intact for the next request on this socket
+                client_socket.discard_body()
+
+                # Handlers that bail out without answering rely on the close to end the request
+                if not keep_alive or client_socket.bytes_sent == bytes_sent_before:
+                    break
+
+            except ConnectionResetError:
+                logger.warning(f"Connection lost: {client_ip} (Thread #{num_thread})")
+                break
+            except socket.timeout:
+                logger.warning(f"Request timeout: {client_ip} (Thread #{num_thread})")
+                break
+            except Exception as e:
+                logger.error(f"Request failed from {client_ip}: {str(e)}")
+                connection_state.keep_alive = False
+                error_response = ready_to_send("500 Internal Server Error", str(e), "text/plain")
+                client_socket.send(error_response)
+                break
 
-            if action == "Not valid action":
-                logger.warning(f"Invalid HTTP method from {client_ip}")
-                return
+    finally:
+        connection_state.keep_alive = False
+        if not detached:
+            client_socket.close()
+        if "/poll-updates" not in request:
+            logger.info(f"Connection closed: {client_ip} after {requests_served} request(s)")
 
-            end = headers_data.find(r"HTTP") - 1
-            request = headers_data[:end]
-
-            # Log non-polling requests with cleaner format
-            if "/poll-updates" not in request:
-                method = action.strip()
-                # Extract the path and query parameters
-                request_parts = request.split('?', 1)
-                path = request_parts[0]
-                logger.info(f"{client_ip} → {method} {path}")
-
-            # Route requests to appropriate handlers
-            if action == "GET ":
-                handle_get_requests(client_socket, request, headers_data, PATH_TO_FOLDER, FORBIDDEN)
-            elif action == "POST":
-                handle_post_requests(client_socket, request, headers_data, PATH_TO_FOLDER)
-            elif action == "DELETE":
-                handle_delete_requests(client_socket, request, headers_data, PATH_TO_FOLDER)
-            else:
-                logger.warning(f"Unknown HTTP method: {action}")
 
-        except ConnectionResetError:
-            logger.warning(f"Connection lost: {client_ip} (Thread #{num_thread})")
-        except socket.timeout:
-            logger.warning(f"Request timeout: {client_ip} (Thread #{num_thread})")
-        except Exception as e:
-            logger.error(f"Request failed from {client_ip}: {str(e)}")
-            error_response = ready_to_send("500 Internal Server Error", str(e), "text/plain")
-            client_socket.send(error_response)
+def reject_connection(client_socket):
+    """Shed load when the accept queue is full.
 
+    Runs on the accept thread, so the 503 gets one non-blocking send: a new
+    socket's send buffer takes it whole, and a client that cannot take it just
+    sees the close.
+    """
+    try:
+        client_socket.setblocking(False)
+        response = ready_to_send("503 Service Unavailable", "Server busy, please retry", "text/plain",
+                                 extra_headers={"Retry-After": RETRY_AFTER_SECONDS})
+        client_socket.send(response)
+    except Exception as e:
+        logger.debug(f"Could not send 503 response: {str(e)}")
     finally:
         client_socket.close()
-        if "/poll-updates" not in request:
-            logger.info(f"Connection closed: {client_ip}")
 
 
-def start_main_server(host='127.0.0.1', port=8000):
+def handle_server_stats(client_socket):
+    """Handle server metrics requests"""
+    data = worker_pool.stats() if worker_pool is not None else {}
+    data['database'] = pool_stats()
+    data['metadata_cache'] = cache_stats()
+    data['compaction'] = change_log_compactor.stats()
+    data['blobs'] = blob_store.stats()
+    data['static'] = static_cache.stats()
+    data['routes'] = route_metrics.stats()
+    data['sessions'] = session_manager.stats()
+    data['ciphers'] = rsa_manager.ciphers.stats()
+    data['update_fanout'] = update_fanout.stats()
+    data['crypto_pool'] = crypto_pool.stats()
+    if websocket_sessions is not None:
+        data['websockets'] = websocket_sessions.stats()
+    response = ready_to_send("200 OK", json.dumps(data), "application/json")
+    client_socket.send(response)
+
+
+def start_main_server(host='127.0.0.1', port=8000,
+                      keep_alive_timeout=KEEP_ALIVE_TIMEOUT, max_requests=MAX_REQUESTS_PER_CONNECTION,
+                      workers=WORKER_THREADS, queue_size=ACCEPT_QUEUE_SIZE, max_websockets=WEBSOCKET_SESSIONS):
     """Start the main server with improved logging"""
+    global worker_pool, websocket_sessions
     logger.info("Starting main server...")
+    crypto_pool.start()  # fork the crypto workers before the listening socket and the worker threads exist
     
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_socket.bind((host, port))
     server_socket.listen(100)
     
+    worker_pool = WorkerPool(
+        lambda client_socket, client_address, num_thread: handle_client(
+            client_socket, client_address, num_thread, keep_alive_timeout, max_requests),
+        num_workers=workers,
+        queue_size=queue_size
+    )
+    worker_pool.start()
+    websocket_sessions = ThreadedSessions(max_websockets)
+    change_log_compactor.start()
+    blob_store.start_gc(version_log_db.get_blob_hashes)
+    
     logger.info(f"Main server is up and running on {host}:{port}")
     logger.info(f"Link: http://{host}:{port}")
     
@@ -1557,13 +2070,10 @@ def start_main_server(host='127.0.0.1', port=8000):
             client_socket, client_address = server_socket.accept()
             num_thread += 1
             
-            # Create a new thread to handle the client
-            client_thread = threading.Thread(
-                target=handle_client, 
-                args=(client_socket, client_address, num_thread), 
-                daemon=True
-            )
-            client_thread.start()
+            # Hand the connection to the worker pool, or answer 503 if it is saturated
+            if not worker_pool.submit(client_socket, client_address, num_thread):
+                logger.warning(f"Accept queue full, rejecting {client_address[0]}")
+                reject_connection(client_socket)
 
         except Exception as e:
             logger.error(f"Error accepting connection: {str(e)}")
@@ -1617,7 +2127,7 @@ def handle_global_aes(client_socket, content_length):
     try:
         # Read the request body
         
-        body = client_socket.recv(content_length).decode()
+        body = get_content_of_upload(client_socket, content_length)
         data = json.loads(body)
         
         # Get client's public RSA key
@@ -0,0 +1,104 @@
+"""In-process cache of file metadata (names, owners, AES keys, roles).
+
+Handlers look the same few rows up several times per request; the cache answers
+those from memory. Entries expire after TTL_SECONDS, which bounds how long a change
+made by another process (e.g. a second server on the same database) can go unseen.
+Changes made through FileInfoDatabase / FilePermissionsDatabase invalidate the
+affected entries at once.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+MAX_ENTRIES = 10000
+TTL_SECONDS = 30
+
+
+def cache_key(value):
+    """IDs arrive as ints or as strings from headers; both must hit the same entry"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class MetadataCache:
+    """Bounded LRU map whose entries also expire ttl seconds after they were stored"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires at, value), least recently used first
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def get(self, key, load):
+        """Cached value of key, or load() stored in the cache. A None from load is not cached."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return entry[1]
+                del self.entries[key]
+                self.counters['expirations'] += 1
+            self.counters['misses'] += 1
+            generation = self.counters['invalidations']
+
+        value = load()
+        if value is None:
+            return None
+        with self.lock:
+            # An invalidation while we were loading may have made the value stale
+            if generation == self.counters['invalidations']:
+                self.entries[key] = (now + self.ttl, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.counters['evictions'] += 1
+        return value
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.counters['invalidations'] += 1
+
+    def invalidate_where(self, predicate):
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                del self.entries[key]
+            self.counters['invalidations'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.counters['invalidations'] += 1
+
+    def stats(self):
+        with self.lock:
+            data = dict(self.counters)
+            data['entries'] = len(self.entries)
+            lookups = data['hits'] + data['misses']
+            data['hit_ratio'] = round(data['hits'] / lookups, 4) if lookups else 0
+        return data
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(db_path, name):
+    """The shared cache name of db_path, so every *Database instance sees the same entries"""
+    with _caches_lock:
+        cache = _caches.get((db_path, name))
+        if cache is None:
+            cache = _caches[(db_path, name)] = MetadataCache()
+        return cache
+
+
+def cache_stats():
+    with _caches_lock:
+        caches = list(_caches.items())
+    return {f"{name} ({path})": cache.stats() for (path, name), cache in caches}
@@ -0,0 +1,100 @@
+"""Writing responses to a client socket, and what it costs per route.
+
+socket.send may write only part of its buffer, so every write here loops until
+the kernel has taken all of it. Big bodies go out WRITE_CHUNK_BYTES at a time:
+on a blocking socket each call waits until the client has drained enough of the
+send buffer, which is the backpressure. Headers and body are handed to sendmsg
+together, so they leave in one system call without being joined into a new
+buffer first.
+"""
+import threading
+from collections import deque
+
+WRITE_CHUNK_BYTES = 256 * 1024
+MAX_ROUTES = 200          # routes beyond this are counted together as "other"
+LATENCY_SAMPLES = 1024    # write latencies kept per route for the percentiles
+
+
+def send_fully(sock, data, flags=0):
+    """Write all of data to sock. Returns the number of bytes written."""
+    view = memoryview(data).cast("B")
+    total = len(view)
+    offset = 0
+    while offset < total:
+        offset += sock.send(view[offset:offset + WRITE_CHUNK_BYTES], flags)
+    return total
+
+
+def sendmsg_fully(sock, buffers, flags=0):
+    """Write the buffers one after the other, gathered into as few system calls as possible"""
+    views = [memoryview(buffer).cast("B") for buffer in buffers if len(buffer)]
+    total = sum(len(view) for view in views)
+    if not hasattr(sock, "sendmsg"):
+        for view in views:
+            send_fully(sock, view, flags)
+        return total
+    while views:
+        batch, size = [], 0
+        for view in views:
+            if size >= WRITE_CHUNK_BYTES:
+                break
+            view = view[:WRITE_CHUNK_BYTES - size]
+            batch.append(view)
+            size += len(view)
+        sent = sock.sendmsg(batch, (), flags)
+        # Drop what was written, keeping the unwritten tail of a partly written buffer
+        while sent:
+            if sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+    return total
+
+
+def route_name(target):
+    """Metrics key of a request target: the API path, or "static" for files"""
+    path = target.split("?", 1)[0]
+    if path == "/" or "." in path or "imgs/" in path:
+        return "static"
+    return path
+
+
+class RouteMetrics:
+    """Requests, bytes written and write latency per route"""
+
+    def __init__(self, max_routes=MAX_ROUTES, samples=LATENCY_SAMPLES):
+        self.max_routes = max_routes
+        self.samples = samples
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def record(self, route, bytes_sent, seconds):
+        with self.lock:
+            entry = self.routes.get(route)
+            if entry is None:
+                if len(self.routes) >= self.max_routes:
+                    route = "other"
+                    entry = self.routes.get(route)
+                if entry is None:
+                    entry = self.routes[route] = {'requests': 0, 'bytes': 0, 'write_seconds': 0.0,
+                                                  'latencies': deque(maxlen=self.samples)}
+            entry['requests'] += 1
+            entry['bytes'] += bytes_sent
+            entry['write_seconds'] += seconds
+            entry['latencies'].append(seconds)
+
+    def stats(self):
+        with self.lock:
+            data = {}
+            for route, entry in self.routes.items():
+                latencies = sorted(entry['latencies'])
+                data[route] = {
+                    'requests': entry['requests'],
+                    'bytes': entry['bytes'],
+                    'write_ms_total': round(entry['write_seconds'] * 1000, 1),
+                    'write_ms_p50': round(latencies[len(latencies) // 2] * 1000, 3),
+                    'write_ms_p99': round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+                }
+        return data
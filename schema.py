@@ -0,0 +1,196 @@
+"""Versioned schema migrations for the SQLite store.
+
+The schema version lives in PRAGMA user_version. Every migration runs in its own
+transaction and bumps the version, so a database is always at exactly one version
+and starting any server (or running this module) brings it up to date:
+
+    python schema.py /Users/hila/CEOs/users.db
+
+Add new migrations at the end of MIGRATIONS; never edit one that has shipped.
+"""
+import sys
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = [
+    # 1: the tables the *Database classes used to create on start-up
+    ("create tables", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            userID INTEGER UNIQUE PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS fileInfo (
+            fileID INTEGER UNIQUE PRIMARY KEY,
+            filename TEXT NOT NULL,
+            ownerID INTEGER,
+            aesKey TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (ownerID) REFERENCES users(userID)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS filePermissions (
+            fileID INTEGER,
+            userID INTEGER,
+            role TEXT,
+            PRIMARY KEY (fileID, userID),
+            FOREIGN KEY (fileID) REFERENCES fileInfo(fileID),
+            FOREIGN KEY (userID) REFERENCES users(userID)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS changeLog (
+            fileID INTEGER,
+            modification TEXT NOT NULL,
+            modBy INTEGER,
+            Timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            ModID INTEGER PRIMARY KEY AUTOINCREMENT,
+            FOREIGN KEY (fileID) REFERENCES fileInfo(fileID),
+            FOREIGN KEY (modBy) REFERENCES users(userID)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS versionsLog (
+            version INTEGER,
+            fileID INTEGER,
+            timeStamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            content TEXT,
+            PRIMARY KEY (version, fileID),
+            FOREIGN KEY (fileID) REFERENCES fileInfo (fileID)
+        )
+        ''',
+    ]),
+    # 2: indexes for the hot lookups
+    ("index access paths", [
+        # get_last_mod_id (MAX(ModID) WHERE fileID) is answered from the index alone,
+        # get_changes_for_user seeks to (fileID, ModID > ?) and filters modBy in the index
+        "CREATE INDEX IF NOT EXISTS idx_changelog_file_mod ON changeLog (fileID, ModID, modBy)",
+        # get_user_access_files looks permissions up by userID alone
+        "CREATE INDEX IF NOT EXISTS idx_permissions_user ON filePermissions (userID, fileID, role)",
+        # check_file_exists: (ownerID, filename) -> fileID (the rowid, so covered)
+        "CREATE INDEX IF NOT EXISTS idx_fileinfo_owner_name ON fileInfo (ownerID, filename)",
+    ]),
+    # 3: per-file snapshot written by change-log compaction: content includes every
+    # change up to ModID, and the changes up to prunedModID have been deleted
+    ("change log snapshots", [
+        '''
+        CREATE TABLE IF NOT EXISTS changeLogSnapshots (
+            fileID INTEGER PRIMARY KEY,
+            ModID INTEGER NOT NULL,
+            prunedModID INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (fileID) REFERENCES fileInfo(fileID)
+        )
+        ''',
+    ]),
+    # 4: versions stored as compressed keyframes and deltas (version_codec) in data;
+    # rows written before keep their plain text in content with encoding 'text'
+    ("delta-compressed versions", [
+        "ALTER TABLE versionsLog ADD COLUMN encoding TEXT NOT NULL DEFAULT 'text'",
+        "ALTER TABLE versionsLog ADD COLUMN baseVersion INTEGER",
+        "ALTER TABLE versionsLog ADD COLUMN chainLength INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE versionsLog ADD COLUMN data BLOB",
+    ]),
+    # 5: content-addressed blob store (blob_store): chunk lists by content hash,
+    # named blobs for the files under uploads/, and the hash of every version
+    ("blob store", [
+        '''
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            chunks TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS blobRefs (
+            name TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        "ALTER TABLE versionsLog ADD COLUMN contentHash TEXT",
+    ]),
+    # 6: login sessions (sessions.SessionManager) and the key their tokens are signed with
+    ("sessions", [
+        '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            sessionID TEXT PRIMARY KEY,
+            userID INTEGER NOT NULL,
+            expiresAt INTEGER NOT NULL,
+            openFiles TEXT NOT NULL DEFAULT '[]',
+            FOREIGN KEY (userID) REFERENCES users(userID)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expiresAt)",
+        "CREATE TABLE IF NOT EXISTS sessionSecret (id INTEGER PRIMARY KEY CHECK (id = 1), secret BLOB NOT NULL)",
+    ]),
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_path, target=LATEST_VERSION):
+    """Apply the migrations db_path is missing, up to target. Returns the final version."""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        version = schema_version(conn)
+        while version < target:
+            description, statements = MIGRATIONS[version]
+            # IMMEDIATE takes the write lock up front, so two processes starting
+            # together cannot both apply the same migration
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if schema_version(conn) != version:
+                    conn.execute("ROLLBACK")
+                    version = schema_version(conn)
+                    continue
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            version += 1
+            logger.info(f"Database {db_path} migrated to version {version}: {description}")
+        return version
+    finally:
+        conn.close()
+
+
+def ensure_schema(db_path):
+    """Migrate db_path once per process; called by every *Database class"""
+    with _migrate_lock:
+        if db_path not in _migrated:
+            migrate(db_path)
+            _migrated.add(db_path)
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(f"usage: python {sys.argv[0]} <database path>")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    print(f"schema version {migrate(sys.argv[1])} (latest {LATEST_VERSION})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Signed, expiring session tokens issued at login.
+
+A token is "<session id>.<user id>.<expires at>.<signature>", the signature being
+an HMAC-SHA256 of the first three fields under a server secret. Checking one costs
+a hash and a dictionary lookup, where the encrypted-header scheme costs an AES
+decryption per header. The server keeps a table of live sessions (the user and the
+files the session has been allowed to open), so a token can be revoked before it
+expires and a file's access check is made once per session, not once per request.
+
+With a db_path the secret and the sessions are also kept in SQLite, and tokens
+stay valid across a server restart; without one they live in memory only.
+"""
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+from db_pool import get_pool
+from schema import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL_SECONDS = 12 * 3600
+SIGNATURE_BYTES = 16   # truncated HMAC, keeps the RSA-encrypted token under one RSA block
+PURGE_INTERVAL = 60    # seconds between sweeps of expired sessions
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+class Session:
+    def __init__(self, session_id, user_id, expires, open_files=()):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.expires = expires
+        self.open_files = set(open_files)
+
+
+class SessionManager:
+    """Issues and validates session tokens; the table of live sessions is keyed by session id"""
+
+    def __init__(self, db_path=None, ttl=SESSION_TTL_SECONDS, secret=None):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.sessions = {}
+        self.revocations = {}  # fileID -> number of close_file calls, so open_file can spot one it raced with
+        self.lock = threading.Lock()
+        self.last_purge = time.time()
+        self.counters = {'issued': 0, 'valid': 0, 'invalid': 0, 'expired': 0, 'revoked': 0}
+        if db_path:
+            ensure_schema(db_path)
+            self.pool = get_pool(db_path)
+            self.secret = secret or self._stored_secret()
+            self._load()
+        else:
+            self.pool = None
+            self.secret = secret or os.urandom(32)
+
+    def _stored_secret(self):
+        conn = self.pool.connection()
+        try:
+            conn.execute("INSERT OR IGNORE INTO sessionSecret (id, secret) VALUES (1, ?)", (os.urandom(32),))
+            conn.commit()
+            return bytes(conn.execute("SELECT secret FROM sessionSecret WHERE id = 1").fetchone()[0])
+        finally:
+            conn.close()
+
+    def _load(self):
+        conn = self.pool.connection()
+        try:
+            rows = conn.execute("SELECT sessionID, userID, expiresAt, openFiles FROM sessions WHERE expiresAt > ?",
+                                (int(time.time()),)).fetchall()
+        finally:
+            conn.close()
+        for session_id, user_id, expires, open_files in rows:
+            self.sessions[session_id] = Session(session_id, user_id, expires, json.loads(open_files))
+        if rows:
+            logger.info(f"Restored {len(rows)} sessions from {self.db_path}")
+
+    def _persist(self, statement, parameters):
+        if self.pool is None:
+            return
+        conn = self.pool.connection()
+        try:
+            conn.execute(statement, parameters)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _sign(self, payload):
+        return _b64(hmac.new(self.secret, payload.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES])
+
+    def issue(self, user_id):
+        """New session for user_id; returns its token"""
+        session = Session(_b64(os.urandom(16)), int(user_id), int(time.time()) + self.ttl)
+        payload = f"{session.session_id}.{session.user_id}.{session.expires}"
+        with self.lock:
+            self.sessions[session.session_id] = session
+            self.counters['issued'] += 1
+        self._persist("INSERT INTO sessions (sessionID, userID, expiresAt) VALUES (?, ?, ?)",
+                      (session.session_id, session.user_id, session.expires))
+        self.purge_expired()
+        return payload + "." + self._sign(payload)
+
+    def validate(self, token):
+        """The Session of token, or None if it is malformed, forged, expired or revoked"""
+        payload, _, signature = (token or "").rpartition(".")
+        parts = payload.split(".")
+        if len(parts) != 3 or not hmac.compare_digest(signature.encode(), self._sign(payload).encode()):
+            self._count('invalid')
+            return None
+        session_id, user_id, expires = parts
+        if int(expires) <= time.time():
+            self._count('expired')
+            return None
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None or session.user_id != int(user_id):
+                self.counters['invalid'] += 1
+                return None
+            self.counters['valid'] += 1
+        return session
+
+    def open_file(self, session, file_id, has_access):
+        """Whether session may use file_id. has_access(file_id, user_id) is asked
+        the first time only; a file it allows is remembered with the session."""
+        file_id = int(file_id)
+        if file_id in session.open_files:
+            return True
+        while True:
+            with self.lock:
+                generation = self.revocations.get(file_id, 0)
+            if not has_access(file_id, session.user_id):
+                return False
+            with self.lock:
+                # Access revoked while has_access was running: its answer may be stale, ask again
+                if self.revocations.get(file_id, 0) != generation:
+                    continue
+                session.open_files.add(file_id)
+                open_files = json.dumps(sorted(session.open_files))
+            break
+        self._persist("UPDATE sessions SET openFiles = ? WHERE sessionID = ?", (open_files, session.session_id))
+        return True
+
+    def close_file(self, file_id, user_id=None):
+        """Forget file_id in the sessions of user_id (or of everyone), e.g. after access was revoked"""
+        file_id = int(file_id)
+        changed = []
+        with self.lock:
+            self.revocations[file_id] = self.revocations.get(file_id, 0) + 1
+            for session in self.sessions.values():
+                if file_id in session.open_files and (user_id is None or session.user_id == int(user_id)):
+                    session.open_files.discard(file_id)
+                    changed.append((json.dumps(sorted(session.open_files)), session.session_id))
+        for parameters in changed:
+            self._persist("UPDATE sessions SET openFiles = ? WHERE sessionID = ?", parameters)
+
+    def revoke(self, token):
+        """End the session of token, e.g. at logout; False if the token is not valid"""
+        session = self.validate(token)
+        if session is None:
+            return False
+        with self.lock:
+            self.sessions.pop(session.session_id, None)
+            self.counters['revoked'] += 1
+        self._persist("DELETE FROM sessions WHERE sessionID = ?", (session.session_id,))
+        return True
+
+    def purge_expired(self, force=False):
+        """Drop expired sessions; runs at most once per PURGE_INTERVAL unless forced"""
+        now = time.time()
+        with self.lock:
+            if not force and now - self.last_purge < PURGE_INTERVAL:
+                return 0
+            self.last_purge = now
+            expired = [session_id for session_id, session in self.sessions.items() if session.expires <= now]
+            for session_id in expired:
+                del self.sessions[session_id]
+        self._persist("DELETE FROM sessions WHERE expiresAt <= ?", (int(now),))
+        return len(expired)
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self.lock:
+            data = dict(self.counters)
+            data['sessions'] = len(self.sessions)
+        data['persistent'] = self.pool is not None
+        return data
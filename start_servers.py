@@ -2,6 +2,21 @@ import threading
 import socket
 from polling_server import start_polling_server
 from main_server import start_main_server
+from async_server import start_async_server
+
+# "threaded" runs the worker-pool server, "asyncio" runs the event-loop server
+SERVER_MODE = "threaded"
+
+# Async server: threads that run the handlers (SQLite, crypto) off the event loop
+EXECUTOR_WORKERS = 32
+
+# Main server worker pool: number of worker threads and how many accepted
+# connections may wait for a free worker before new ones get a 503.
+# A waiting long-poll holds a worker only until connections queue for one.
+WORKER_THREADS = 64
+ACCEPT_QUEUE_SIZE = 256
+# WebSocket editing sessions served at once, each on two threads of its own
+WEBSOCKET_SESSIONS = 64
 
 def main():
     print()
@@ -10,7 +25,19 @@ def main():
 
     # Create threads for both servers
     #polling_thread = threading.Thread(target=start_polling_server, args=(host, 8001))
-    main_thread = threading.Thread(target=start_main_server, args=(host, 8000))
+    if SERVER_MODE == "asyncio":
+        main_thread = threading.Thread(
+            target=start_async_server,
+            args=(host, 8000),
+            kwargs={'executor_workers': EXECUTOR_WORKERS}
+        )
+    else:
+        main_thread = threading.Thread(
+            target=start_main_server,
+            args=(host, 8000),
+            kwargs={'workers': WORKER_THREADS, 'queue_size': ACCEPT_QUEUE_SIZE,
+                    'max_websockets': WEBSOCKET_SESSIONS}
+        )
 
     # Start the threads
     #polling_thread.start()
@@ -0,0 +1,173 @@
+"""In-memory cache of the static files (pages, scripts, styles, images).
+
+Each file is read once and kept with a strong ETag (a hash of its bytes) and its
+Last-Modified date. Every request costs one stat(): a changed mtime or size reloads
+the file, so edits on disk show up on the next request without a restart.
+Compressed copies are made the first time a client asks for them and kept with
+the file; each gets its own ETag, as a different representation must.
+
+Images and other binary files, and any file over MAX_CACHED_FILE_BYTES, are not
+held in memory: only their validators are cached (the ETag then comes from the
+mtime and size) and the body is streamed from disk with sendfile.
+
+At most MAX_FILES files and MAX_CACHE_BYTES of bodies and compressed copies are
+kept; the least recently requested files go first.
+"""
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from content_encoding import ENCODINGS, STATIC_LEVELS, STATIC_MIN_BYTES, compressible, compress
+
+logger = logging.getLogger(__name__)
+
+MAX_CACHED_FILE_BYTES = 8 * 1024 * 1024  # larger files are streamed from disk
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+MAX_FILES = 1024
+
+# Vendored, minified libraries are replaced by a file with a new name, never edited
+# in place, so browsers may keep them for a year without asking again
+IMMUTABLE_POLICY = "public, max-age=31536000, immutable"
+IMAGE_POLICY = "public, max-age=86400"
+# Our own pages, scripts and styles change with every deploy: always revalidate,
+# which costs one 304 when nothing changed
+REVALIDATE_POLICY = "no-cache"
+
+
+def cache_policy(path):
+    """Cache-Control value for the file at path"""
+    name = os.path.basename(path)
+    if name.endswith(".min.js") or name.endswith(".min.css"):
+        return IMMUTABLE_POLICY
+    if "/imgs/" in path or name.endswith(".ico"):
+        return IMAGE_POLICY
+    return REVALIDATE_POLICY
+
+
+class StaticAsset:
+    """Content and validators of one file as of its mtime; body is None for streamed files"""
+
+    def __init__(self, path, body, mtime_ns, size, content_type):
+        self.path = path
+        self.body = body
+        self.content_type = content_type
+        self.mtime_ns = mtime_ns
+        self.size = size
+        if body is None:
+            self.etag = f'"{mtime_ns:x}-{size:x}"'
+        else:
+            self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.mtime = mtime_ns // 1_000_000_000  # HTTP dates have whole seconds
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.cache_control = cache_policy(path)
+        self.compressible = body is not None and compressible(content_type) and len(body) >= STATIC_MIN_BYTES
+        self.etags = {self.etag} | {self.variant_etag(encoding) for encoding in ENCODINGS}
+        self.variants = {}  # encoding -> compressed body, None if it did not get smaller
+        self.lock = threading.Lock()
+
+    @property
+    def reserved_bytes(self):
+        """Memory the asset may come to hold: the body plus one compressed copy per encoding,
+        each no larger than the body since bigger ones are not kept"""
+        if self.body is None:
+            return 0
+        return len(self.body) * (1 + len(ENCODINGS)) if self.compressible else len(self.body)
+
+    def variant_etag(self, encoding):
+        return self.etag[:-1] + "-" + encoding + '"' if encoding else self.etag
+
+    def encoded(self, encoding):
+        """(body, encoding) to send for a client that accepts encoding; compresses on first use"""
+        if encoding is None or not self.compressible:
+            return self.body, None
+        with self.lock:
+            if encoding not in self.variants:
+                compressed = compress(self.body, encoding, STATIC_LEVELS[encoding])
+                self.variants[encoding] = compressed if len(compressed) < len(self.body) else None
+                logger.debug(f"Compressed {self.path} with {encoding}: {len(self.body)} -> {len(compressed)} bytes")
+            compressed = self.variants[encoding]
+        if compressed is None:
+            return self.body, None
+        return compressed, encoding
+
+    def headers(self, encoding=None):
+        headers = {"ETag": self.variant_etag(encoding), "Last-Modified": self.last_modified}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        if self.compressible:
+            headers["Vary"] = "Accept-Encoding"
+        return headers
+
+    def not_modified(self, if_none_match=None, if_modified_since=None):
+        """Whether a conditional GET with these header values can be answered with 304"""
+        if if_none_match is not None:
+            # If-None-Match wins over If-Modified-Since; GET uses the weak comparison
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or any(tag.removeprefix("W/") in self.etags for tag in tags)
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return self.mtime <= since
+        return False
+
+
+class StaticAssetCache:
+    """StaticAsset by path, reloaded when the file's mtime or size changes, least recently used dropped first"""
+
+    def __init__(self, max_file_bytes=MAX_CACHED_FILE_BYTES, max_bytes=MAX_CACHE_BYTES, max_files=MAX_FILES):
+        self.max_file_bytes = max_file_bytes
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.assets = OrderedDict()
+        self.reserved = 0  # sum of reserved_bytes of the cached assets
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'loads': 0, 'not_modified': 0, 'evictions': 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def get(self, path, content_type):
+        """StaticAsset for path; raises OSError if the file cannot be read"""
+        stat = os.stat(path)
+        with self.lock:
+            asset = self.assets.get(path)
+            if asset is not None and asset.mtime_ns == stat.st_mtime_ns and asset.size == stat.st_size:
+                self.assets.move_to_end(path)
+                self.counters['hits'] += 1
+                return asset
+
+        if compressible(content_type) and stat.st_size <= self.max_file_bytes:
+            with open(path, "rb") as file:
+                body = file.read()
+        else:
+            body = None
+        asset = StaticAsset(path, body, stat.st_mtime_ns, stat.st_size, content_type)
+        with self.lock:
+            previous = self.assets.pop(path, None)
+            if previous is not None:
+                self.reserved -= previous.reserved_bytes
+            self.assets[path] = asset
+            self.reserved += asset.reserved_bytes
+            self.counters['loads'] += 1
+            while len(self.assets) > 1 and (len(self.assets) > self.max_files or self.reserved > self.max_bytes):
+                _, evicted = self.assets.popitem(last=False)
+                self.reserved -= evicted.reserved_bytes
+                self.counters['evictions'] += 1
+        logger.debug(f"Cached static file {path} ({stat.st_size} bytes, ETag {asset.etag})")
+        return asset
+
+    def count_not_modified(self):
+        self._count('not_modified')
+
+    def stats(self):
+        with self.lock:
+            data = dict(self.counters)
+            data['files'] = len(self.assets)
+            data['bytes'] = sum(len(asset.body) + sum(len(variant) for variant in asset.variants.values() if variant)
+                                for asset in self.assets.values() if asset.body is not None)
+        return data
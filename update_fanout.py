@@ -0,0 +1,122 @@
+"""Poll and push payloads built once per range of changes and shared by every reader.
+
+When several editors have a file open, every one of them asks for the same new
+changeLog rows after each edit. An entry here holds the rows of one
+(fileID, fromModID, toModID) range, read once, and the response bodies made from
+them: the JSON list of changes, or that list encrypted with the file key.
+
+Readers never get their own changes back. A reader who wrote none of the rows
+in the range gets the shared body of all of them; each author present in the
+range gets a body of their own without their rows. With one person typing and K
+others watching, an edit costs one query and one encryption instead of K.
+
+Rows and bodies are held up to MAX_BYTES in total; the least recently used
+ranges go first.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+MAX_BYTES = 32 * 1024 * 1024
+ROW_OVERHEAD = 64     # bytes counted per row and per range besides the JSON text
+
+
+class UpdateRange:
+    """The changeLog rows of one range and the bodies made from them so far"""
+
+    def __init__(self):
+        self.rows = None     # [(ModID, modBy, modification JSON)] in ModID order
+        self.authors = frozenset()
+        self.bodies = {}     # (excluded author or None, key or None) -> (body or None, last ModID)
+        self.size = 0
+        self.lock = threading.Lock()
+
+
+class UpdateFanout:
+    """UpdateRange by (fileID, fromModID, toModID), bounded by the bytes it holds.
+
+    load_rows(file_id, after_mod_id, upto_mod_id) reads the rows of a range,
+    encrypt(text, key) encrypts a body.
+    """
+
+    def __init__(self, load_rows, encrypt, max_bytes=MAX_BYTES):
+        self.load_rows = load_rows
+        self.encrypt = encrypt
+        self.max_bytes = max_bytes
+        self.ranges = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'bodies': 0, 'evictions': 0}
+
+    def updates(self, file_id, after_mod_id, upto_mod_id, user_id, key=None):
+        """(body, last ModID) of the changes of file_id in (after_mod_id, upto_mod_id]
+        not made by user_id. body is the JSON list of changes, or the
+        {"encrypted_data", "encrypted"} object when a key is given; (None, None)
+        if there are no such changes."""
+        range_key = (int(file_id), int(after_mod_id), int(upto_mod_id))
+        user_id = int(user_id)
+        with self.lock:
+            entry = self.ranges.get(range_key)
+            if entry is None:
+                entry = self.ranges[range_key] = UpdateRange()
+            self.ranges.move_to_end(range_key)
+
+        added = 0
+        with entry.lock:
+            if entry.rows is None:
+                entry.rows = self.load_rows(*range_key)
+                entry.authors = frozenset(row[1] for row in entry.rows)
+                added = ROW_OVERHEAD + sum(ROW_OVERHEAD + len(row[2]) for row in entry.rows)
+                self._count('misses')
+            else:
+                self._count('hits')
+            variant = (user_id if user_id in entry.authors else None, key)
+            result = entry.bodies.get(variant)
+            if result is None:
+                result = entry.bodies[variant] = self._body(entry.rows, user_id, key)
+                added += len(result[0] or "")
+                self._count('bodies')
+        if added:
+            self._grow(range_key, entry, added)
+        return result
+
+    def _body(self, rows, user_id, key):
+        # modBy != userID in SQL also leaves out rows without an author
+        rows = [row for row in rows if row[1] is not None and row[1] != user_id]
+        if not rows:
+            return None, None
+        # The rows already hold each modification as JSON; no need to parse and re-serialise them
+        body = "[" + ", ".join(f'{{"modification": {modification}, "ModID": {mod_id}}}'
+                               for mod_id, _, modification in rows) + "]"
+        if key is not None:
+            body = json.dumps({"encrypted_data": self.encrypt(body, key), "encrypted": True})
+        return body, rows[-1][0]
+
+    def _grow(self, range_key, entry, added):
+        with self.lock:
+            if self.ranges.get(range_key) is not entry:
+                return  # evicted while its body was being made
+            entry.size += added
+            self.bytes += added
+            while self.bytes > self.max_bytes and len(self.ranges) > 1:
+                _, evicted = self.ranges.popitem(last=False)
+                self.bytes -= evicted.size
+                self.counters['evictions'] += 1
+
+    def invalidate(self, file_id):
+        """Forget every range of file_id, e.g. when the file is deleted"""
+        file_id = int(file_id)
+        with self.lock:
+            for range_key in [range_key for range_key in self.ranges if range_key[0] == file_id]:
+                self.bytes -= self.ranges.pop(range_key).size
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self.lock:
+            data = dict(self.counters)
+            data['ranges'] = len(self.ranges)
+            data['bytes'] = self.bytes
+        return data
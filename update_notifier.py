@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+
+
+class UpdateNotifier:
+    """In-process registry that wakes pollers waiting for new changeLog rows of a file.
+
+    Waiters pass the newest ModID they already know about and are released as soon
+    as a higher ModID is reported for that file through notify(). Each file being
+    waited on has its own Condition, so a save only wakes the pollers of its file.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conditions = {}     # fileID -> [Condition on self.lock, number of waiting threads]
+        self.latest = {}         # fileID -> newest ModID reported
+        self.async_waiters = {}  # fileID -> set of (loop, future)
+
+    def notify(self, file_id, mod_id):
+        """Called after a modification of file_id has been committed"""
+        file_id = int(file_id)
+        with self.lock:
+            if mod_id is not None and mod_id > self.latest.get(file_id, 0):
+                self.latest[file_id] = mod_id
+            entry = self.conditions.get(file_id)
+            if entry is not None:
+                entry[0].notify_all()
+            waiters = self.async_waiters.pop(file_id, ())
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_release, future)
+
+    def latest_mod_id(self, file_id):
+        """Newest ModID reported for file_id in this process, 0 if none yet.
+
+        Read it before querying the changeLog and wait on it afterwards: a change
+        committed in between is then never missed, without asking the database.
+        """
+        with self.lock:
+            return self.latest.get(int(file_id), 0)
+
+    def wait(self, file_id, after_mod_id, timeout):
+        """Block until file_id has a ModID above after_mod_id. Returns False on timeout."""
+        file_id = int(file_id)
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            if self.latest.get(file_id, 0) > after_mod_id:
+                return True
+            entry = self.conditions.get(file_id)
+            if entry is None:
+                entry = self.conditions[file_id] = [threading.Condition(self.lock), 0]
+            entry[1] += 1
+            try:
+                while self.latest.get(file_id, 0) <= after_mod_id:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    entry[0].wait(remaining)
+                return True
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.conditions[file_id]
+
+    async def wait_async(self, file_id, after_mod_id, timeout):
+        """Event-loop version of wait() that does not hold a thread while waiting"""
+        file_id = int(file_id)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            if self.latest.get(file_id, 0) > after_mod_id:
+                return True
+            entry = (loop, future)
+            self.async_waiters.setdefault(file_id, set()).add(entry)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self.lock:
+                waiters = self.async_waiters.get(file_id)
+                if waiters is not None:
+                    waiters.discard(entry)
+                    if not waiters:
+                        del self.async_waiters[file_id]
+
+
+def _release(future):
+    if not future.done():
+        future.set_result(True)
@@ -0,0 +1,63 @@
+"""Encoding of stored file versions.
+
+A version is either a keyframe (the whole text, zlib-compressed) or a delta
+against an earlier version: a zlib-compressed JSON list of line operations,
+[start, stop] to copy base lines start:stop and a list of strings to insert.
+"""
+import json
+import zlib
+from difflib import SequenceMatcher
+
+COMPRESS_LEVEL = 6
+
+
+def compress(text):
+    return zlib.compress(text.encode('utf-8'), COMPRESS_LEVEL)
+
+
+def decompress(blob):
+    return zlib.decompress(blob).decode('utf-8')
+
+
+def split_lines(text):
+    return text.splitlines(keepends=True)
+
+
+def make_delta(old, text):
+    """Compressed delta that turns the lines old into text"""
+    new = split_lines(text)
+
+    # Most saves touch a few places; trimming the common ends keeps the
+    # matcher's work proportional to the changed region
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+
+    ops = []
+    if prefix:
+        ops.append([0, prefix])
+    matcher = SequenceMatcher(None, old[prefix:len(old) - suffix], new[prefix:len(new) - suffix])
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([prefix + i1, prefix + i2])
+        elif j2 > j1:
+            ops.append(new[prefix + j1:prefix + j2])
+    if suffix:
+        ops.append([len(old) - suffix, len(old)])
+    return zlib.compress(json.dumps(ops, separators=(',', ':')).encode('utf-8'), COMPRESS_LEVEL)
+
+
+def apply_delta(old, delta):
+    """Apply a delta to the lines old and return the new lines"""
+    lines = []
+    for op in json.loads(zlib.decompress(delta)):
+        if op and isinstance(op[0], int):
+            lines.extend(old[op[0]:op[1]])
+        else:
+            lines.extend(op)
+    return lines
@@ -0,0 +1,312 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import socket
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+PUSH_WAIT = 25  # seconds the pusher waits for new changes before checking again
+PUSH_COALESCE = 0.02  # after a wake-up, let a burst of saves land so it goes out as one push
+PING_INTERVAL = 30  # seconds of silence from the client before the server pings it
+IDLE_TIMEOUT = 75   # seconds of silence, pings unanswered, after which the session is closed
+FRAME_TIMEOUT = 30  # seconds to finish reading a frame once it has started, or to drain a write
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+def handshake_response(http_request):
+    """Build the 101 response for an upgrade request, or None if it is not a valid one"""
+    key = http_request.get('sec-websocket-key')
+    if not key or 'upgrade' not in http_request.get('connection', '').lower():
+        return None
+    accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+    return (
+        "HTTP/1.1 101 Switching Protocols\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        f"Sec-WebSocket-Accept: {accept}\r\n"
+        "\r\n"
+    ).encode()
+
+
+def encode_frame(opcode, payload=b""):
+    """Encode one unmasked server frame"""
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 65536:
+        header += bytes([126]) + struct.pack("!H", length)
+    else:
+        header += bytes([127]) + struct.pack("!Q", length)
+    return header + payload
+
+
+def _unmask(payload, mask):
+    if not mask:
+        return payload
+    # XOR the whole payload at once instead of byte by byte
+    repeated = (mask * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(len(payload), 'big')
+
+
+def _payload_length(second_byte, extended):
+    length = second_byte & 0x7F
+    if length == 126:
+        return struct.unpack("!H", extended)[0]
+    if length == 127:
+        return struct.unpack("!Q", extended)[0]
+    return length
+
+
+def _extended_size(second_byte):
+    length = second_byte & 0x7F
+    return {126: 2, 127: 8}.get(length, 0)
+
+
+def read_frame(client_socket, idle_timeout=None):
+    """Blocking version of read_frame_async on a BufferedSocket whose timeout is FRAME_TIMEOUT"""
+    if not client_socket.wait_readable(idle_timeout):
+        return None
+    first, second = client_socket.read_stream(2)
+    size = _extended_size(second)
+    extended = client_socket.read_stream(size) if size else b""
+    length = _payload_length(second, extended)
+    if length > MAX_MESSAGE_BYTES:
+        raise ValueError("WebSocket frame too large")
+    mask = client_socket.read_stream(4) if second & 0x80 else b""
+    payload = client_socket.read_stream(length) if length else b""
+    return bool(first & 0x80), first & 0x0F, _unmask(payload, mask)
+
+
+async def read_frame_async(reader, idle_timeout=None):
+    """Read one frame. Returns (fin, opcode, payload), or None if no frame starts within idle_timeout.
+
+    A frame that stops part way raises asyncio.TimeoutError after FRAME_TIMEOUT;
+    the connection cannot be read any further then.
+    """
+    try:
+        first, second = await asyncio.wait_for(reader.readexactly(2), idle_timeout)
+    except asyncio.TimeoutError:
+        return None  # readexactly takes nothing from the stream until it has both bytes
+    return await asyncio.wait_for(_read_frame_rest(reader, first, second), FRAME_TIMEOUT)
+
+
+async def _read_frame_rest(reader, first, second):
+    size = _extended_size(second)
+    extended = await reader.readexactly(size) if size else b""
+    length = _payload_length(second, extended)
+    if length > MAX_MESSAGE_BYTES:
+        raise ValueError("WebSocket frame too large")
+    mask = await reader.readexactly(4) if second & 0x80 else b""
+    payload = await reader.readexactly(length) if length else b""
+    return bool(first & 0x80), first & 0x0F, _unmask(payload, mask)
+
+
+class MessageAssembler:
+    """Joins fragmented frames and answers control frames"""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def feed(self, fin, opcode, payload):
+        """Returns ('message', text), ('ping', payload), ('close', None) or (None, None)"""
+        if opcode == OP_CLOSE:
+            return 'close', None
+        if opcode == OP_PING:
+            return 'ping', payload
+        if opcode == OP_PONG:
+            return None, None
+        if opcode not in (OP_TEXT, OP_BINARY, OP_CONTINUATION):
+            raise ValueError(f"Unknown WebSocket opcode: {opcode}")
+        self.parts.append(payload)
+        self.size += len(payload)
+        if self.size > MAX_MESSAGE_BYTES:
+            raise ValueError("WebSocket message too large")
+        if not fin:
+            return None, None
+        message = b"".join(self.parts).decode('utf-8')
+        self.parts = []
+        self.size = 0
+        return 'message', message
+
+
+def run_session(client_socket, session, notifier):
+    """Serve an upgraded connection on the current thread, pushing updates from a helper thread.
+
+    The threaded counterpart of run_session_async, with the same ping and idle
+    limits; client_socket is a BufferedSocket. ThreadedSessions runs it.
+    """
+    client_socket.settimeout(FRAME_TIMEOUT)
+    send_lock = threading.Lock()
+    closed = threading.Event()
+
+    def send(opcode, payload):
+        with send_lock:
+            client_socket.sendall(encode_frame(opcode, payload))
+
+    def pusher():
+        try:
+            while not closed.is_set():
+                last_seen, message = session.poll()
+                if message:
+                    send(OP_TEXT, message.encode('utf-8'))
+                if notifier.wait(session.file_id, last_seen, PUSH_WAIT):
+                    closed.wait(PUSH_COALESCE)
+        except Exception as e:
+            if not closed.is_set():
+                logger.error(f"WebSocket push failed: {str(e)}")
+
+    assembler = MessageAssembler()
+    pusher_thread = None
+    last_heard = time.monotonic()
+    try:
+        while True:
+            frame = read_frame(client_socket, PING_INTERVAL)
+            if frame is None:
+                if time.monotonic() - last_heard >= IDLE_TIMEOUT:
+                    logger.info("WebSocket client idle, closing")
+                    send(OP_CLOSE, b"")
+                    break
+                send(OP_PING, b"")
+                continue
+            last_heard = time.monotonic()
+            kind, value = assembler.feed(*frame)
+            if kind == 'close':
+                send(OP_CLOSE, b"")
+                break
+            if kind == 'ping':
+                send(OP_PONG, value)
+            elif kind == 'message':
+                for reply in session.on_message(value):
+                    send(OP_TEXT, reply.encode('utf-8'))
+                if pusher_thread is None and session.file_id is not None:
+                    pusher_thread = threading.Thread(target=pusher, name="ws-pusher", daemon=True)
+                    pusher_thread.start()
+    except (ConnectionResetError, BrokenPipeError):
+        logger.info("WebSocket client disconnected")
+    except socket.timeout:
+        logger.info("WebSocket client stalled, closing")
+    finally:
+        closed.set()
+        if pusher_thread is not None:
+            pusher_thread.join()  # at most PUSH_WAIT, so a session's threads end before its slot is freed
+
+
+class ThreadedSessions:
+    """Threads for the WebSocket sessions of the threaded server, outside its worker pool.
+
+    Each session runs on a reader thread and a pusher thread; at most
+    max_sessions run at once and start() refuses the rest.
+    """
+
+    def __init__(self, max_sessions):
+        self.max_sessions = max_sessions
+        self.active = 0
+        self.lock = threading.Lock()
+        self.counters = {'started': 0, 'rejected': 0}
+
+    def start(self, client_socket, handshake, session, notifier):
+        """Send the 101 handshake and serve the session on its own thread, which
+        closes client_socket at the end. Returns False, having sent nothing, when
+        max_sessions are already running."""
+        with self.lock:
+            if self.active >= self.max_sessions:
+                self.counters['rejected'] += 1
+                return False
+            self.active += 1
+            self.counters['started'] += 1
+        thread = threading.Thread(target=self._run, args=(client_socket, handshake, session, notifier),
+                                  name="ws-session", daemon=True)
+        thread.start()
+        return True
+
+    def _run(self, client_socket, handshake, session, notifier):
+        try:
+            client_socket.sendall(handshake)
+            run_session(client_socket, session, notifier)
+        except Exception as e:
+            logger.error(f"WebSocket session failed: {str(e)}")
+        finally:
+            client_socket.close()
+            with self.lock:
+                self.active -= 1
+
+    def stats(self):
+        with self.lock:
+            data = dict(self.counters)
+            data['active'] = self.active
+            data['max_sessions'] = self.max_sessions
+        return data
+
+
+async def run_session_async(reader, writer, session, notifier, executor):
+    """Serve an upgraded connection on the event loop, pushing updates from a task.
+
+    session provides on_message(text) -> list of replies, poll() -> (last_seen, message or None)
+    and file_id once the client has identified itself; its calls run on the executor.
+    A client that stays silent is pinged every PING_INTERVAL and dropped after IDLE_TIMEOUT.
+    """
+    loop = asyncio.get_running_loop()
+    send_lock = asyncio.Lock()
+
+    async def send(opcode, payload):
+        async with send_lock:
+            writer.write(encode_frame(opcode, payload))
+            await asyncio.wait_for(writer.drain(), FRAME_TIMEOUT)
+
+    async def pusher():
+        try:
+            while True:
+                last_seen, message = await loop.run_in_executor(executor, session.poll)
+                if message:
+                    await send(OP_TEXT, message.encode('utf-8'))
+                if await notifier.wait_async(session.file_id, last_seen, PUSH_WAIT):
+                    await asyncio.sleep(PUSH_COALESCE)
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        except Exception as e:
+            logger.error(f"WebSocket push failed: {str(e)}")
+
+    assembler = MessageAssembler()
+    pusher_task = None
+    last_heard = loop.time()
+    try:
+        while True:
+            frame = await read_frame_async(reader, PING_INTERVAL)
+            if frame is None:
+                if loop.time() - last_heard >= IDLE_TIMEOUT:
+                    logger.info("WebSocket client idle, closing")
+                    await send(OP_CLOSE, b"")
+                    break
+                await send(OP_PING, b"")
+                continue
+            last_heard = loop.time()
+            kind, value = assembler.feed(*frame)
+            if kind == 'close':
+                await send(OP_CLOSE, b"")
+                break
+            if kind == 'ping':
+                await send(OP_PONG, value)
+            elif kind == 'message':
+                for reply in await loop.run_in_executor(executor, session.on_message, value):
+                    await send(OP_TEXT, reply.encode('utf-8'))
+                if pusher_task is None and session.file_id is not None:
+                    pusher_task = asyncio.create_task(pusher())
+    except (ConnectionResetError, BrokenPipeError, asyncio.IncompleteReadError):
+        logger.info("WebSocket client disconnected")
+    finally:
+        if pusher_task is not None:
+            pusher_task.cancel()
@@ -0,0 +1,81 @@
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """Fixed number of worker threads fed by a bounded queue of accepted connections"""
+
+    def __init__(self, handler, num_workers=64, queue_size=256):
+        self.handler = handler
+        self.num_workers = num_workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.threads = []
+
+        # Metrics
+        self.accepted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.busy_workers = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def start(self):
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._worker, name=f"worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Worker pool started: {self.num_workers} workers, queue size {self.queue.maxsize}")
+
+    def submit(self, *args):
+        """Queue a job for the workers. Returns False if the queue is full."""
+        try:
+            self.queue.put_nowait((time.monotonic(), args))
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return False
+        with self.lock:
+            self.accepted += 1
+        return True
+
+    def backlogged(self):
+        """True when jobs are waiting because every worker is busy"""
+        return not self.queue.empty()
+
+    def _worker(self):
+        while True:
+            enqueued_at, args = self.queue.get()
+            wait = time.monotonic() - enqueued_at
+            with self.lock:
+                self.busy_workers += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            try:
+                self.handler(*args)
+            except Exception as e:
+                logger.error(f"Unhandled error in worker: {str(e)}")
+            finally:
+                with self.lock:
+                    self.busy_workers -= 1
+                    self.completed += 1
+                self.queue.task_done()
+
+    def stats(self):
+        with self.lock:
+            started = self.completed + self.busy_workers
+            return {
+                'workers': self.num_workers,
+                'busy_workers': self.busy_workers,
+                'queue_depth': self.queue.qsize(),
+                'queue_size': self.queue.maxsize,
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'avg_wait_ms': round(self.total_wait / started * 1000, 3) if started else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 3),
+            }